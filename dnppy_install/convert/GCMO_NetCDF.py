@@ -1,76 +1,141 @@
-
 # standard imports
-import sys
+from multiprocessing.pool import ThreadPool
 import os
 
 # dnppy imports
 from dnppy import core
-
-# arcpy imports
-import arcpy
-if arcpy.CheckExtension('Spatial')=='Available':
-    arcpy.CheckOutExtension('Spatial')
-    from arcpy.sa import *
-    from arcpy import env
-    arcpy.env.overwriteOutput = True
+from _netcdf import _netcdf_file, _num_to_dates, _date_names, _grid_geotransform
+from _netcdf import _lat_names, _lon_names, _time_names
+from numpy_to_geotiff import numpy_to_geotiff, _create_geotiff
 
 
 __all__ = ["GCMO_NetCDF"]
 
 
-def GCMO_NetCDF(netcdf_list, variable, outdir):
+def GCMO_NetCDF(netcdf_list, variable, outdir, stack = False, chunk_size = 64,
+                threads = 4, nodata = -9999):
     """
     Extracts all time layers from a "Global Climate Model Output" NetCDF layer
 
+    The variable is read straight from the NetCDF file in chunks of many time steps
+    at once, rather than one layer at a time through arcpy, and the georeferencing
+    is worked out once from the lat and lon coordinate variables. Each time step is
+    then written to its own GeoTIFF by a pool of threads while the next chunk is read,
+    so a file of many decades of daily data exports about as fast as the disk allows.
+    arcpy is not needed.
+
     Inputs:
         netcdf_list     list of netcdfs from CORDEX climate distribution
         varaible        the climate variable of interest (tsmax, tsmin, etc)
         outdir          output directory to save files.
+        stack           set True to write all time steps of each netcdf into a single
+                        multi-band tif, with one band per time step, instead of one tif
+                        per time step.
+        chunk_size      number of time steps to read from the netcdf at once
+        threads         number of tifs to write at once
+        nodata          value written in place of the fill values of the netcdf
+
+    Returns:
+        output_list     list of filepaths to all tifs created
     """
 
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
     netcdf_list = core.enf_list(netcdf_list)
+    output_list = []
 
     for netcdf in netcdf_list:
-        # get net cdf properties object
-        props = arcpy.NetCDFFileProperties(netcdf)
-        
-        print("finding dimensions")
-        dims  = props.getDimensions()
-        for dim in dims:
-            print dim, props.getDimensionSize(dim)
-
-        # make sure the variable is in this netcdf
-        if variable:
-            if not variable in props.getVariables():
-                print("Valid variables for this file include {0}".format(props.getVariables()))
+        with _netcdf_file(netcdf) as nc:
+
+            # make sure the variable is in this netcdf
+            if variable not in nc:
+                print("Valid variables for this file include {0}".format(nc.variables))
                 raise Exception("Variable '{0}' is not in this netcdf!".format(variable))
 
-        for dim in dims:
-            if dim == "time":
-
-                # set other dimensions
-                x_dim = "lon"
-                y_dim = "lat"
-                band_dim = ""
-                valueSelectionMethod = "BY_VALUE"
-                
-                size = props.getDimensionSize(dim)
-                for i in range(size):
-
-                    # sanitize the dimname for invalid characters
-                    dimname = props.getDimensionValue(dim,i).replace(" 12:00:00 PM","")
-                    dimname = dimname.replace("/","-").replace(" ","_")
-                    
-                    dim_value = [["time", props.getDimensionValue(dim,i)]]
-                    print("extracting '{0}' from '{1}'".format(variable, dim_value))
-
-                    outname = core.create_outname(outdir, netcdf, dimname, 'tif')
-                    
-                    arcpy.MakeNetCDFRasterLayer_md(netcdf, variable, x_dim, y_dim, "temp",
-                                                   band_dim, dim_value, valueSelectionMethod)
-                    arcpy.CopyRaster_management("temp", outname, "", "", "", "NONE", "NONE", "")
-                    
-    return
+            print("finding dimensions")
+            dims = nc.dimensions(variable)
+            print("{0} {1}".format(dims, nc.variable(variable).shape))
+
+            # georeferencing and time stamps only need to be worked out once per file
+            lat_name  = nc.find(_lat_names)
+            lon_name  = nc.find(_lon_names)
+            time_name = nc.find(_time_names)
+            time_axis, lat_axis, lon_axis = nc.axes(variable, lat_name, lon_name, time_name)
+            geotransform, flip = _grid_geotransform(nc.coordinate([lat_name]), nc.coordinate([lon_name]))
+
+            values, units, calendar = nc.times(time_name)
+            dimnames = _date_names(_num_to_dates(values, units, calendar))
+
+            size = len(dimnames)
+            if stack:
+                outname = core.create_outname(outdir, netcdf, variable, 'tif')
+                output_list.append(_export_stack(nc, variable, outname, size, chunk_size,
+                                                 (time_axis, lat_axis, lon_axis), flip,
+                                                 geotransform, nodata))
+                continue
+
+            pool    = ThreadPool(max(1, threads))
+            pending = []
+            try:
+                for start in range(0, size, chunk_size):
+                    stop  = min(start + chunk_size, size)
+                    block = _read_block(nc, variable, start, stop, (time_axis, lat_axis, lon_axis),
+                                        flip, nodata)
+                    print("extracting '{0}' from '{1}' to '{2}'".format(
+                        variable, dimnames[start], dimnames[stop - 1]))
+
+                    writes = []
+                    for i in range(stop - start):
+                        outname = core.create_outname(outdir, netcdf, dimnames[start + i], 'tif')
+                        writes.append(pool.apply_async(numpy_to_geotiff,
+                                                       (block[i], outname, geotransform, 4326, nodata)))
+                    pending.append(writes)
+
+                    # reading runs one chunk ahead of writing, which keeps memory bounded
+                    if len(pending) > 1:
+                        output_list += [write.get() for write in pending.pop(0)]
+
+                for writes in pending:
+                    output_list += [write.get() for write in writes]
+            finally:
+                pool.close()
+                pool.join()
+
+    return output_list
+
+
+def _read_block(nc, variable, start, stop, axes, flip, nodata):
+    """ reads time steps [start, stop) as a north up (time, lat, lon) array """
+
+    time_axis, lat_axis, lon_axis = axes
+    selection = [slice(None)] * len(nc.dimensions(variable))
+    selection[time_axis] = slice(start, stop)
+
+    block = nc.read(variable, selection, nodata)
+    block = block.transpose([time_axis, lat_axis, lon_axis])
+    if flip:
+        block = block[:, ::-1, :]
+    return block
+
+
+def _export_stack(nc, variable, outname, size, chunk_size, axes, flip, geotransform, nodata):
+    """ writes every time step of a variable into one multi-band tif, a chunk at a time """
+
+    first   = _read_block(nc, variable, 0, min(chunk_size, size), axes, flip, nodata)
+    dataset = _create_geotiff(outname, first.shape[1], first.shape[2], size, first.dtype,
+                              geotransform, 4326, nodata)
+
+    block = first
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        if start > 0:
+            block = _read_block(nc, variable, start, stop, axes, flip, nodata)
+
+        print("writing bands {0} to {1} of {2}".format(start + 1, stop, outname))
+        for i in range(stop - start):
+            dataset.GetRasterBand(start + i + 1).WriteArray(block[i])
+
+    dataset.FlushCache()
+    dataset = None
+    return outname
@@ -1,53 +1,292 @@
 __author__ = 'jwely'
 
-import h5py
+from multiprocessing import Pool
+import numpy
 import os
 
-def HDF5_to_numpy(hdfpath, layers = None):
+__all__ = ["HDF5_to_numpy",
+           "HDF5_stack",
+           "hdf5_reader"]
+
+
+# names of the 1d coordinate datasets searched for when subsetting by bounding box
+_lat_names = ["lat", "latitude", "Latitude", "LAT", "Lat"]
+_lon_names = ["lon", "longitude", "Longitude", "LON", "Lon"]
+
+
+class hdf5_reader(object):
+    """
+    Lazy read only access to the datasets of an HDF5 file.
+
+    Nothing is read from a dataset until a subset of it is asked for, and then
+    only the chunks covering that subset (hyperslab) are read from disk, so
+    memory use and read time scale with the subset rather than with the file.
+    Subsets are given as row and column ranges of the last two dimensions, or
+    as a lat/lon bounding box which is located in the 1d lat and lon coordinate
+    datasets of the file (such as "Grid/lat" and "Grid/lon" in GPM IMERG).
+
+    Example Usage:
+        with convert.hdf5_reader(imerg_path) as h5:
+            precip = h5.read("precipitationCal", bbox = (-80, 36, -75, 40))
+    """
+
+    def __init__(self, hdfpath, cache_mb = 64, cache_slots = 10007):
+        """
+        :param hdfpath:     filepath to an HDF5 file
+        :param cache_mb:    size of the raw chunk cache in MB. The HDF5 default is 1MB,
+                            which is smaller than a single row of chunks in many products,
+                            so the same chunks would be decompressed again and again.
+        :param cache_slots: number of hash slots in the chunk cache. should be a prime
+                            number well above the number of chunks which fit in the cache.
+        """
+
+        import h5py
+
+        self.hdfpath = hdfpath
+
+        # chunk cache settings are set through the low level api, which works
+        # with every h5py version
+        fapl = h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+        mdc, _, _, w0 = fapl.get_cache()
+        fapl.set_cache(mdc, cache_slots, int(cache_mb * 1024 * 1024), w0)
+        self.hdf = h5py.File(h5py.h5f.open(hdfpath, h5py.h5f.ACC_RDONLY, fapl = fapl))
+
+        # layers are named within the first group of the file, or the root for flat files
+        first = self.hdf[list(self.hdf)[0]]
+        self.group  = first if isinstance(first, h5py.Group) else self.hdf
+        self.bands  = list(self.group)
+        self._coords = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def __getitem__(self, layer):
+        """ lazy h5py dataset for a layer index, layer name or full path within the file """
+
+        if isinstance(layer, int):
+            layer = self.bands[layer]
+        if layer in self.group:
+            return self.group[layer]
+        return self.hdf[layer]
+
+
+    def info(self):
+        """ prints the index, name, shape and type of each layer """
+
+        print("Contents of {0}".format(os.path.basename(self.hdfpath)))
+        for i, band in enumerate(self.bands):
+            print("  {0}  {1}".format(i, self.group[band]))
+
+
+    def read(self, layer, rows = None, cols = None, bbox = None):
+        """
+        reads a subset of one layer into a numpy array.
+
+        :param layer:   layer index, layer name, or full path of a dataset in the file
+        :param rows:    (start, stop) index range or slice of the second to last dimension
+        :param cols:    (start, stop) index range or slice of the last dimension
+        :param bbox:    (min lon, min lat, max lon, max lat) bounding box. the dimensions
+                        matching the lat and lon coordinates of the file are cut down
+                        to it, which works whatever order the dimensions are in.
+
+        :return:        numpy array of the subset. leading dimensions, such as time,
+                        are read in full.
+        """
+
+        dataset   = self[layer]
+        selection = [slice(None)] * dataset.ndim
+
+        if rows is not None:
+            selection[-2] = _as_slice(rows)
+        if cols is not None:
+            selection[-1] = _as_slice(cols)
+        if bbox is not None:
+            for axis, index_range in self.bbox_selection(dataset, bbox).items():
+                selection[axis] = index_range
+
+        return dataset[tuple(selection)]
+
+
+    def coordinates(self, dataset):
+        """ returns (lat, lon) 1d numpy arrays of the coordinates for a dataset """
+
+        group = dataset.parent
+        if group.name not in self._coords:
+            lat = _find_dataset([group, self.hdf], _lat_names)
+            lon = _find_dataset([group, self.hdf], _lon_names)
+            if lat is None or lon is None:
+                raise ValueError("No lat/lon coordinate datasets found for {0}, use rows "
+                                 "and cols instead of bbox".format(dataset.name))
+            self._coords[group.name] = (lat[()].ravel(), lon[()].ravel())
+
+        return self._coords[group.name]
+
+
+    def bbox_selection(self, dataset, bbox):
+        """ {axis: slice} of the dataset dimensions which fall within a bounding box """
+
+        min_lon, min_lat, max_lon, max_lat = bbox
+        lat, lon = self.coordinates(dataset)
+
+        lat_axis = _find_axis(dataset.shape, len(lat), preferred = dataset.ndim - 2)
+        lon_axis = _find_axis(dataset.shape, len(lon), preferred = dataset.ndim - 1,
+                              exclude = lat_axis)
+
+        return {lat_axis: _index_range(lat, min_lat, max_lat),
+                lon_axis: _index_range(lon, min_lon, max_lon)}
+
+
+    def close(self):
+        self.hdf.close()
+
+
+def HDF5_to_numpy(hdfpath, layers = None, rows = None, cols = None, bbox = None, cache_mb = 64):
     """
     Extracts one or more layers from an HDF5 file and returns a dict of numpy arrays
 
+    Only the requested subset of each layer is read from disk, see hdf5_reader.
+
     :param hdfpath:         filepath to an HDF5 file
     :param layers:          a list of integer values or layer names to extract
                             leave "None" to return numpy arrays for ALL layers
+    :param rows:            optional (start, stop) row range of each layer to read
+    :param cols:            optional (start, stop) column range of each layer to read
+    :param bbox:            optional (min lon, min lat, max lon, max lat) bounding box
+                            to read, for files with lat and lon coordinate datasets
+    :param cache_mb:        size of the HDF5 chunk cache in MB
 
     :return:                dict with band names as keys and numpy arrays as values
     """
 
-    with h5py.File(hdfpath, "r", driver = "core") as hdf:
-        group  = hdf[list(hdf)[0]]
-        bands  = list(group)
-
-        # print info about each dataset
-        print("Contents of {0}".format(os.path.basename(hdfpath)))
-        for i,x in enumerate(group.values()):
-            print i,x
+    with hdf5_reader(hdfpath, cache_mb) as h5:
+        h5.info()
+        bands = h5.bands
 
         if layers is None:
-            layers = bands
+            layers = list(bands)
 
         elif isinstance(layers, str) or isinstance(layers, int):
             layers = [layers]
 
         # verify that the desired layer can be extracted
+        layers = list(layers)
         for i, layer in enumerate(layers):
-            if isinstance(layer, int) and layer <= len(bands):
+            if isinstance(layer, int) and layer < len(bands):
                 layers[i] = bands[layer]
-            elif isinstance(layer, str) and layer in bands:
-                layers[i] = layer
 
-        layer_dict ={}
+        layer_dict = {}
         for layer in layers:
             try:
-                layer_dict[layer] = group[layer][()]
-            except:
-                print("Failed to read layer '{0}'".format(layer))
+                layer_dict[layer] = h5.read(layer, rows, cols, bbox)
+            except Exception as e:
+                print("Failed to read layer '{0}'! {1}".format(layer, e))
 
     return layer_dict
 
 
+def HDF5_stack(hdfpaths, layer, rows = None, cols = None, bbox = None,
+               processes = 1, cache_mb = 64):
+    """
+    Reads the same subset of one layer from many HDF5 files, such as a time series
+    of GPM IMERG files, and stacks them into one array.
+
+    h5py can only read one thing at a time within a process, so files are read in
+    parallel by a pool of processes.
+
+    :param hdfpaths:        list of filepaths to HDF5 files
+    :param layer:           layer index, name or full dataset path to read from each file
+    :param rows:            optional (start, stop) row range to read
+    :param cols:            optional (start, stop) column range to read
+    :param bbox:            optional (min lon, min lat, max lon, max lat) bounding box
+    :param processes:       number of files to read at once
+    :param cache_mb:        size of the HDF5 chunk cache in MB, for each file
+
+    :return:                numpy array with one more dimension than the layer,
+                            the first of which is the index within hdfpaths
+    """
+
+    args = [(hdfpath, layer, rows, cols, bbox, cache_mb) for hdfpath in hdfpaths]
+
+    if processes > 1 and len(args) > 1:
+        pool = Pool(min(processes, len(args)))
+        try:
+            arrays = pool.map(_read_one, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        arrays = [_read_one(arg) for arg in args]
+
+    return numpy.array(arrays)
+
+
+def _read_one(args):
+    """ reads one subset, at the top level of the module so that Pool can pickle it """
+
+    hdfpath, layer, rows, cols, bbox, cache_mb = args
+    with hdf5_reader(hdfpath, cache_mb) as h5:
+        return h5.read(layer, rows, cols, bbox)
+
+
+def _as_slice(index_range):
+    """ slice from a slice, a (start, stop) pair, or a single index """
+
+    if isinstance(index_range, slice):
+        return index_range
+    if isinstance(index_range, int):
+        return slice(index_range, index_range + 1)
+    start, stop = index_range
+    return slice(start, stop)
+
+
+def _find_dataset(groups, names):
+    """ first dataset found in any of the groups by any of the names """
+
+    import h5py
+
+    for group in groups:
+        for name in names:
+            if name in group and isinstance(group[name], h5py.Dataset):
+                return group[name]
+    return None
+
+
+def _find_axis(shape, length, preferred, exclude = None):
+    """ the axis of shape which is length long, preferring the preferred axis """
+
+    candidates = [i for i, n in enumerate(shape) if n == length and i != exclude]
+    if not candidates:
+        raise ValueError("No dimension of {0} is {1} long".format(shape, length))
+    if preferred in candidates:
+        return preferred
+    return candidates[-1]
+
+
+def _index_range(coords, low, high):
+    """
+    slice of the positions in a sorted 1d coordinate array within [low, high],
+    found by binary search. works for ascending or descending coordinates.
+    """
+
+    if coords[0] <= coords[-1]:
+        return slice(int(numpy.searchsorted(coords, low, "left")),
+                     int(numpy.searchsorted(coords, high, "right")))
+
+    # descending, such as latitudes from north to south
+    n = len(coords)
+    reverse = coords[::-1]
+    return slice(n - int(numpy.searchsorted(reverse, high, "right")),
+                 n - int(numpy.searchsorted(reverse, low, "left")))
+
+
 if __name__ == "__main__":
     rasterpath = r"C:\Users\jwely\Desktop\troubleshooting\3B-HHR-L.MS.MRG.3IMERG.20150401-S233000-E235959.1410.V03E.RT-H5"
     output = HDF5_to_numpy(rasterpath, [2,3,5])
 
-    print output.keys()
\ No newline at end of file
+    print output.keys()
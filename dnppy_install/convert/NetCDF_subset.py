@@ -0,0 +1,267 @@
+__author__ = 'jwely'
+
+from dnppy import core
+from _netcdf import _netcdf_file, _num_to_dates, _date_to_num, _date_names, _grid_geotransform
+from _netcdf import _lat_names, _lon_names, _time_names
+from HDF5_to_numpy import _index_range
+from numpy_to_geotiff import numpy_to_geotiff
+from multiprocessing.pool import ThreadPool
+import numpy
+import os
+
+__all__ = ["NetCDF_subset",
+           "NetCDF_subset_to_tif"]
+
+
+def NetCDF_subset(netcdf_list, variable = None, bbox = None, start_dto = None, end_dto = None,
+                  nodata = -9999):
+    """
+    Reads a bounding box and time window out of many NetCDF files, such as a daily
+    series of PERSIANN-CDR files, into one numpy cube.
+
+    The bounding box and time window are turned into index ranges by binary search
+    on the lat, lon and time coordinate variables, so only that hyperslab of each
+    file is read from disk. Latitudes may run north to south or south to north and
+    longitudes may run from 0 to 360 or from -180 to 180, the cube is always north up.
+
+    :param netcdf_list:     list of NetCDF files on the same grid, in time order
+    :param variable:        name of the variable to read. defaults to the "cdr_variable"
+                            attribute of Climate Data Record files.
+    :param bbox:            (min lon, min lat, max lon, max lat) bounding box. boxes which
+                            cross the 0 or 180 degree meridian of the file are read in two parts.
+    :param start_dto:       datetime object of the first time step to read, inclusive
+    :param end_dto:         datetime object of the last time step to read, inclusive
+    :param nodata:          value written in place of the fill values of the files
+
+    :return (cube, dates, geotransform):
+                            cube is a (time, rows, cols) numpy array, dates is a list of
+                            (year, month, day, hour) tuples for the time steps (None
+                            for files without a time dimension), and
+                            geotransform is the gdal geotransform of the cube.
+    """
+
+    # plan every file first, which only reads coordinates, so the cube is allocated once
+    plans = [plan for plan in _plan_all(netcdf_list, variable, bbox, start_dto, end_dto)]
+    if not plans:
+        raise ValueError("No data within the bounding box and time window")
+
+    _check_grids(plans)
+    total = sum(len(plan.dates) for plan in plans)
+
+    cube  = None
+    dates = []
+    for plan in plans:
+        with _netcdf_file(plan.netcdf) as nc:
+            block = plan.read(nc, nodata)
+
+        if cube is None:
+            cube = numpy.empty((total,) + block.shape[1:], dtype = block.dtype)
+        cube[len(dates):len(dates) + block.shape[0]] = block
+        dates += plan.dates
+
+    return cube, dates, plans[0].geotransform
+
+
+def NetCDF_subset_to_tif(netcdf_list, outdir, variable = None, bbox = None, start_dto = None,
+                         end_dto = None, nodata = -9999, threads = 4):
+    """
+    Saves a bounding box and time window out of many NetCDF files, such as a daily
+    series of PERSIANN-CDR files, as one GeoTIFF per time step.
+
+    Files are read one at a time, as in NetCDF_subset, while the time steps of the
+    previous file are written by a pool of threads, so memory use does not grow
+    with the number of files.
+
+    :param netcdf_list:     list of NetCDF files
+    :param outdir:          output directory to save tifs
+    :param variable:        name of the variable to read. defaults to the "cdr_variable"
+                            attribute of Climate Data Record files.
+    :param bbox:            (min lon, min lat, max lon, max lat) bounding box
+    :param start_dto:       datetime object of the first time step to read, inclusive
+    :param end_dto:         datetime object of the last time step to read, inclusive
+    :param nodata:          value written in place of the fill values of the files
+    :param threads:         number of tifs to write at once
+
+    :return output_list:    list of filepaths to all tifs created
+    """
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    output_list = []
+    pool    = ThreadPool(max(1, threads))
+    pending = []
+    try:
+        for plan in _plan_all(netcdf_list, variable, bbox, start_dto, end_dto):
+            with _netcdf_file(plan.netcdf) as nc:
+                block = plan.read(nc, nodata)
+
+            # files without a time dimension get a single tif
+            if plan.time_slice is None:
+                datenames = ["subset"]
+            else:
+                datenames = _date_names(plan.dates)
+
+            writes = []
+            for i, datename in enumerate(datenames):
+                outname = core.create_outname(outdir, plan.netcdf, datename, 'tif')
+                writes.append(pool.apply_async(numpy_to_geotiff,
+                                               (block[i], outname, plan.geotransform, 4326, nodata)))
+            pending.append(writes)
+
+            # reading runs one file ahead of writing, which keeps memory bounded
+            if len(pending) > 1:
+                output_list += [write.get() for write in pending.pop(0)]
+
+        for writes in pending:
+            output_list += [write.get() for write in writes]
+    finally:
+        pool.close()
+        pool.join()
+
+    print("Saved {0} subset tifs to {1}".format(len(output_list), outdir))
+    return output_list
+
+
+class _subset_plan(object):
+    """ index ranges of the part of one NetCDF file within a bounding box and time window """
+
+    def __init__(self, nc, variable, bbox, start_dto, end_dto):
+
+        self.netcdf   = nc.path
+        self.variable = variable
+
+        lat_name  = nc.find(_lat_names)
+        lon_name  = nc.find(_lon_names)
+        time_name = nc.find(_time_names)
+        self.time_axis, self.lat_axis, self.lon_axis = nc.axes(variable, lat_name, lon_name, time_name)
+
+        lat = nc.coordinate([lat_name])
+        lon = nc.coordinate([lon_name])
+
+        # spatial index ranges
+        if bbox is None:
+            self.lat_slice  = slice(None)
+            self.lon_slices = [slice(None)]
+            shift = 0
+        else:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            self.lat_slice = _index_range(lat, min_lat, max_lat)
+            self.lon_slices, shift = _lon_slices(lon, min_lon, max_lon)
+
+        # the two parts of a box across the edge of the grid are joined into one
+        sub_lat = lat[self.lat_slice]
+        sub_lon = [lon[s] + (i * 360) for i, s in enumerate(self.lon_slices)]
+        sub_lon = numpy.concatenate(sub_lon) + shift
+
+        # time index range, time steps are in increasing order in CF files
+        if time_name is None or self.time_axis is None:
+            self.time_slice = None
+            self.dates      = [None]
+        else:
+            values, units, calendar = nc.times(time_name)
+            start = 0 if start_dto is None else \
+                int(numpy.searchsorted(values, _date_to_num(start_dto, units, calendar), "left"))
+            stop  = len(values) if end_dto is None else \
+                int(numpy.searchsorted(values, _date_to_num(end_dto, units, calendar), "right"))
+            self.time_slice = slice(start, stop)
+            self.dates      = _num_to_dates(values[start:stop], units, calendar)
+
+        self.empty = len(sub_lat) == 0 or len(sub_lon) == 0 or len(self.dates) == 0
+        if not self.empty:
+            resolution = (_step(lon), _step(lat))
+            self.geotransform, self.flip = _grid_geotransform(sub_lat, sub_lon, resolution)
+            self.shape = (len(sub_lat), len(sub_lon))
+
+
+    def read(self, nc, nodata):
+        """ reads the hyperslab as a north up (time, lat, lon) array """
+
+        ndim   = len(nc.dimensions(self.variable))
+        blocks = []
+        for lon_slice in self.lon_slices:
+            selection = [slice(None)] * ndim
+            selection[self.lat_axis] = self.lat_slice
+            selection[self.lon_axis] = lon_slice
+            if self.time_slice is not None:
+                selection[self.time_axis] = self.time_slice
+            blocks.append(nc.read(self.variable, selection, nodata))
+
+        block = numpy.concatenate(blocks, axis = self.lon_axis)
+
+        if self.time_slice is None:
+            block = block.reshape((1,) + block.shape)
+            block = block.transpose([0, self.lat_axis + 1, self.lon_axis + 1])
+        else:
+            block = block.transpose([self.time_axis, self.lat_axis, self.lon_axis])
+
+        if self.flip:
+            block = block[:, ::-1, :]
+        return block
+
+
+def _plan_all(netcdf_list, variable, bbox, start_dto, end_dto):
+    """ yields a _subset_plan for each file with data in the bounding box and time window """
+
+    for netcdf in core.enf_list(netcdf_list):
+        with _netcdf_file(netcdf) as nc:
+
+            name = variable or nc.attrs().get("cdr_variable")
+            if name not in nc:
+                print("Valid variables for this file include {0}".format(nc.variables))
+                raise Exception("Variable '{0}' is not in this netcdf!".format(name))
+
+            plan = _subset_plan(nc, name, bbox, start_dto, end_dto)
+
+        if plan.empty:
+            print("No data within the bounding box and time window in {0}".format(netcdf))
+            continue
+        yield plan
+
+
+def _check_grids(plans):
+    """ raises an error unless every plan cuts out the same grid """
+
+    for plan in plans[1:]:
+        if plan.shape != plans[0].shape or \
+           not numpy.allclose(plan.geotransform, plans[0].geotransform):
+            raise ValueError("{0} is not on the same grid as {1}".format(plan.netcdf, plans[0].netcdf))
+
+
+def _step(coords):
+    """ signed spacing of a regular 1d coordinate array """
+
+    if len(coords) < 2:
+        return 1.0
+    return (coords[-1] - coords[0]) / float(len(coords) - 1)
+
+
+def _lon_slices(lon, min_lon, max_lon):
+    """
+    list of one or two index ranges of ascending longitudes within [min_lon, max_lon],
+    and the shift in degrees which puts the longitudes of the subset in the same
+    -180 to 180 or 0 to 360 convention as the bounding box.
+    """
+
+    if max_lon - min_lon >= 360:
+        return [slice(None)], 0
+
+    # put the box in the convention of the file, which may put its west edge east of its east edge
+    if lon[-1] > 180:
+        shift   = -360 if min_lon < 0 else 0
+        min_lon = min_lon % 360
+        max_lon = max_lon % 360 if max_lon != 360 else 360
+    else:
+        shift   = 360 if max_lon > 180 else 0
+        min_lon = (min_lon + 180) % 360 - 180
+        max_lon = (max_lon + 180) % 360 - 180 if max_lon != 180 else 180
+
+    if min_lon <= max_lon:
+        return [_index_range(lon, min_lon, max_lon)], shift
+
+    # boxes across the edge of the grid are read as the western part, then the eastern
+    # part, which continues past the edge. for -180 to 180 grids that puts the subset
+    # in 0 to 360 longitudes whichever way the box was given.
+    high = _index_range(lon, min_lon, lon[-1])
+    low  = _index_range(lon, lon[0], max_lon)
+    return [high, low], shift if lon[-1] > 180 else 0
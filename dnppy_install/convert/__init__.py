@@ -4,7 +4,13 @@ dnppy convert contains functions for misc conversion between formats and types.
 
 __author__ = ["Jeffry Ely, jeff.ely.08@gmail.com"]
 
+from extract_archive import *
 from extract_targz import *
+from tar_index import *
+from extract_HDF_layer_data import *
+from numpy_to_geotiff import *
+from HDF5_to_numpy import *
 from GCMO_NetCDF import *
+from NetCDF_subset import *
 
 
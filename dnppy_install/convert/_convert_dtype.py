@@ -1,12 +1,13 @@
 __author__ = 'jwely'
 
-import gdal
 
 def _convert_dtype(numpy_dtype_string):
     """
     converts numpy dtype to a gdal data type object
     """
 
+    import gdal
+
     ndt = str(numpy_dtype_string)
 
     if ndt == "float64":
@@ -18,11 +19,14 @@ def _convert_dtype(numpy_dtype_string):
     elif ndt == "uint32":
         return gdal.GDT_UInt32
 
-    elif "unit" in ndt:
+    elif ndt == "uint8" or ndt == "bool":
+        return gdal.GDT_Byte
+
+    elif "uint" in ndt:
         return gdal.GDT_UInt16
 
     elif ndt == "int32":
         return gdal.GDT_Int32
 
     else:
-        return gdal.GDT_Int16
\ No newline at end of file
+        return gdal.GDT_Int16
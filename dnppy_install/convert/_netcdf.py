@@ -0,0 +1,400 @@
+__author__ = 'jwely'
+
+"""
+arcpy free, read only access to NetCDF files, used by the NetCDF functions of convert.
+
+NetCDF4 files are HDF5 files underneath and are read with h5py. Older NetCDF3
+(classic) files are read with scipy. Either way variables are opened lazily, so
+slicing a variable reads only that hyperslab from disk.
+"""
+
+from datetime import datetime, timedelta
+import calendar as _calendar
+import numpy
+import math
+import os
+
+
+# candidate names of the coordinate variables
+_lat_names  = ["lat", "latitude", "Latitude", "LAT", "Lat", "y"]
+_lon_names  = ["lon", "longitude", "Longitude", "LON", "Lon", "x"]
+_time_names = ["time", "Time", "TIME", "t"]
+
+_unit_seconds = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# calendar months in each unit of "months since" and "years since" times, as used by
+# monthly GCM output. Fractions are fractions of the length of the month they fall in.
+_unit_months  = {"month": 1, "year": 12}
+_month_days   = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+class _netcdf_file(object):
+    """ a NetCDF file opened with h5py or scipy, whichever can read it """
+
+    def __init__(self, path):
+        self.path = path
+        self._h5  = None
+        self._nc3 = None
+
+        import h5py
+
+        try:
+            self._h5 = h5py.File(path, "r")
+        except IOError:
+            try:
+                from scipy.io import netcdf_file
+            except ImportError:
+                raise IOError("{0} is not a NetCDF4 file, and NetCDF3 files need scipy".format(path))
+            self._nc3 = netcdf_file(path, "r", mmap = True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    @property
+    def variables(self):
+        if self._h5 is not None:
+            import h5py
+            return [name for name in self._h5 if isinstance(self._h5[name], h5py.Dataset)]
+        return list(self._nc3.variables)
+
+
+    def __contains__(self, name):
+        return name in self.variables
+
+
+    def variable(self, name):
+        """ lazy array-like handle of a variable, sliced reads only touch that hyperslab """
+
+        if self._h5 is not None:
+            return self._h5[name]
+        return self._nc3.variables[name]
+
+
+    def attrs(self, name = None):
+        """ dict of the attributes of a variable, or of the file if name is None """
+
+        if self._h5 is not None:
+            items = (self._h5 if name is None else self._h5[name]).attrs.items()
+        elif name is None:
+            items = self._nc3._attributes.items()
+        else:
+            items = self._nc3.variables[name]._attributes.items()
+
+        attrs = {}
+        for key, value in items:
+            if isinstance(value, numpy.ndarray) and value.size == 1:
+                value = value.ravel()[0]
+            if isinstance(value, (bytes, numpy.bytes_)):
+                value = value.decode("utf-8", "replace")
+            attrs[key] = value
+        return attrs
+
+
+    def dimensions(self, name):
+        """ tuple of the dimension names of a variable """
+
+        if self._nc3 is not None:
+            return tuple(self._nc3.variables[name].dimensions)
+
+        # netcdf4 attaches each dimension to its variable as an HDF5 dimension scale
+        dataset = self._h5[name]
+        names = []
+        for i, dim in enumerate(dataset.dims):
+            try:
+                names.append(os.path.basename(dim[0].name))
+            except Exception:
+                names.append("dim{0}".format(i))
+        return tuple(names)
+
+
+    def find(self, names):
+        """ name of the first variable found out of a list of candidate names """
+
+        variables = self.variables
+        for name in names:
+            if name in variables:
+                return name
+        return None
+
+
+    def coordinate(self, names):
+        """
+        1d numpy array of the first coordinate variable found out of a list of names.
+        raises a ValueError for 2d coordinates, such as the lat and lon of rotated pole grids.
+        """
+
+        name = self.find(names)
+        if name is None:
+            raise ValueError("None of the variables {0} are in {1}".format(names, self.path))
+
+        self._check_1d(name)
+        return numpy.array(self.variable(name)[:])
+
+
+    def axes(self, name, lat_name, lon_name, time_name = None):
+        """
+        (time axis, lat axis, lon axis) of a variable, from its dimension names.
+        time axis is None for variables without one. Variables whose dimensions are
+        not named after the coordinates are assumed to be ordered (time, lat, lon).
+        raises a ValueError unless lat and lon are 1d and match the variable's dimensions.
+        """
+
+        dims  = self.dimensions(name)
+        ndim  = len(dims)
+        shape = self.variable(name).shape
+
+        def position(coord_name, default):
+            return dims.index(coord_name) if coord_name in dims else default
+
+        lat_axis  = position(lat_name, ndim - 2)
+        lon_axis  = position(lon_name, ndim - 1)
+        time_axis = position(time_name, 0 if ndim > 2 else None)
+
+        # output is only georeferenced correctly if the variable lies on the lat/lon grid
+        for coord_name, axis in [(lat_name, lat_axis), (lon_name, lon_axis)]:
+            if coord_name is None:
+                raise ValueError("No lat and lon coordinates for '{0}' in {1}".format(name, self.path))
+            self._check_1d(coord_name)
+            length = self.variable(coord_name).shape[0]
+            if ndim < 2 or shape[axis] != length:
+                raise ValueError("'{0}' {1} of {2} is not on the grid of its '{3}' coordinate "
+                                 "of {4} values".format(name, dims, self.path, coord_name, length))
+        return time_axis, lat_axis, lon_axis
+
+
+    def _check_1d(self, name):
+        """ raises a ValueError if a coordinate variable is not 1d """
+
+        shape = self.variable(name).shape
+        if len(shape) != 1:
+            raise ValueError("'{0}' {1} of {2} is not a 1d coordinate, so the data is not on a "
+                             "regular lat/lon grid. Rotated pole grids, such as those of CORDEX, "
+                             "must be regridded first.".format(name, shape, self.path))
+
+
+    def read(self, name, selection, nodata = None):
+        """
+        reads a hyperslab of a variable, unpacked with its scale_factor and add_offset.
+        Fill values are replaced with nodata, if given.
+        """
+
+        attrs = self.attrs(name)
+        array = numpy.array(self.variable(name)[tuple(selection)])
+
+        # some products, such as PERSIANN-CDR, use both markers with different values
+        mask = None
+        for key in ["_FillValue", "missing_value"]:
+            if key in attrs:
+                mask = (array == attrs[key]) if mask is None else (mask | (array == attrs[key]))
+
+        if "scale_factor" in attrs or "add_offset" in attrs:
+            array = array * numpy.float32(attrs.get("scale_factor", 1)) + numpy.float32(attrs.get("add_offset", 0))
+
+        if mask is not None and nodata is not None:
+            array[mask] = nodata
+        return array
+
+
+    def times(self, time_name = None):
+        """ (numeric values, units, calendar) of the time variable """
+
+        time_name = time_name or self.find(_time_names)
+        if time_name is None:
+            raise ValueError("No time variable in {0}".format(self.path))
+
+        attrs = self.attrs(time_name)
+        return (numpy.array(self.variable(time_name)[:]).ravel(),
+                attrs.get("units", "days since 1970-01-01"),
+                attrs.get("calendar", "standard").lower())
+
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5.close()
+        if self._nc3 is not None:
+            self._nc3.close()
+
+
+def _parse_units(units):
+    """
+    unit name ("second", "minute", "hour", "day", "month" or "year") and origin
+    datetime of cf time units like "days since 1949-12-01"
+    """
+
+    if " since " not in units:
+        raise ValueError("Time units '{0}' are not of the form 'days since 1949-12-01'".format(units))
+
+    step, origin = units.split(" since ")
+    step = step.strip().lower().rstrip("s")
+    if step not in _unit_seconds and step not in _unit_months:
+        raise ValueError("Time units '{0}' are not supported, the unit must be one of {1}".format(
+                         units, sorted(_unit_seconds.keys() + _unit_months.keys())))
+
+    origin = origin.strip().replace("T", " ").rstrip("Z").split("+")[0].strip()
+    for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            origin = datetime.strptime(origin.split(".")[0], fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        # years before 1000 are sometimes written without zero padding
+        year, month, day = [int(p) for p in origin.split(" ")[0].split("-")]
+        origin = datetime(year, month, day)
+
+    return step, origin
+
+
+def _month_length(year, month, calendar):
+    """ number of days in a month of a calendar """
+
+    if calendar == "360_day":
+        return 30
+    if calendar in ["noleap", "365_day"]:
+        return _month_days[month - 1]
+    if calendar in ["all_leap", "366_day"]:
+        return 29 if month == 2 else _month_days[month - 1]
+    return _calendar.monthrange(year, month)[1]
+
+
+def _add_months(origin, months, calendar):
+    """
+    (year, month, day, hour) a number of calendar months after an origin datetime.
+    The fraction of a month is a fraction of the length of the month it falls in.
+    """
+
+    whole = int(math.floor(months))
+    year, month = divmod(origin.year * 12 + origin.month - 1 + whole, 12)
+    month += 1
+
+    length  = _month_length(year, month, calendar)
+    day     = min(origin.day, length)
+    seconds = ((months - whole) * length * 86400 +
+               origin.hour * 3600 + origin.minute * 60 + origin.second)
+
+    if not _fixed_calendar(calendar):
+        dto = datetime(year, month, day) + timedelta(seconds = seconds)
+        return dto.year, dto.month, dto.day, dto.hour
+
+    days, rest = divmod(seconds, 86400)
+    number = _day_number(year, month, day, calendar) + int(days)
+    return _from_day_number(number, calendar) + (int(rest // 3600),)
+
+
+def _day_number(year, month, day, calendar):
+    """ day count from year 0 in the fixed length calendars """
+
+    if calendar == "360_day":
+        return year * 360 + (month - 1) * 30 + day - 1
+
+    leap = 1 if calendar in ["all_leap", "366_day"] else 0
+    days = [d + (leap if m == 1 else 0) for m, d in enumerate(_month_days)]
+    return year * sum(days) + sum(days[:month - 1]) + day - 1
+
+
+def _from_day_number(number, calendar):
+    """ (year, month, day) from a day count of a fixed length calendar """
+
+    if calendar == "360_day":
+        year, rest = divmod(number, 360)
+        return year, rest // 30 + 1, rest % 30 + 1
+
+    leap = 1 if calendar in ["all_leap", "366_day"] else 0
+    days = [d + (leap if m == 1 else 0) for m, d in enumerate(_month_days)]
+    year, rest = divmod(number, sum(days))
+    month = 0
+    while rest >= days[month]:
+        rest  -= days[month]
+        month += 1
+    return year, month + 1, rest + 1
+
+
+def _fixed_calendar(calendar):
+    return calendar in ["noleap", "365_day", "all_leap", "366_day", "360_day"]
+
+
+def _num_to_dates(values, units, calendar = "standard"):
+    """
+    (year, month, day, hour) tuples for cf time values. tuples are used rather than
+    datetime objects because 360 day calendars have dates such as February 30th.
+    """
+
+    step, origin = _parse_units(units)
+    dates = []
+    for value in values:
+        if step in _unit_months:
+            dates.append(_add_months(origin, float(value) * _unit_months[step], calendar))
+            continue
+
+        offset = float(value) * _unit_seconds[step]
+
+        if not _fixed_calendar(calendar):
+            dto = origin + timedelta(seconds = offset)
+            dates.append((dto.year, dto.month, dto.day, dto.hour))
+            continue
+
+        days, rest = divmod(offset + origin.hour * 3600 + origin.minute * 60 + origin.second, 86400)
+        number = _day_number(origin.year, origin.month, origin.day, calendar) + int(days)
+        dates.append(_from_day_number(number, calendar) + (int(rest // 3600),))
+    return dates
+
+
+def _date_to_num(dto, units, calendar = "standard"):
+    """ cf time value of a datetime object, in the units and calendar of a file """
+
+    step, origin = _parse_units(units)
+
+    if step in _unit_months:
+        length = _month_length(dto.year, dto.month, calendar)
+        months = (dto.year - origin.year) * 12 + dto.month - origin.month
+        clock  = ((dto.day - min(origin.day, length)) * 86400 + (dto.hour - origin.hour) * 3600 +
+                  (dto.minute - origin.minute) * 60 + (dto.second - origin.second))
+        return (months + clock / (length * 86400.0)) / _unit_months[step]
+
+    seconds = _unit_seconds[step]
+    if not _fixed_calendar(calendar):
+        return (dto - origin).total_seconds() / seconds
+
+    days = (_day_number(dto.year, dto.month, min(dto.day, 30) if calendar == "360_day" else dto.day, calendar) -
+            _day_number(origin.year, origin.month, origin.day, calendar))
+    clock = (dto.hour - origin.hour) * 3600 + (dto.minute - origin.minute) * 60 + (dto.second - origin.second)
+    return (days * 86400.0 + clock) / seconds
+
+
+def _date_names(dates):
+    """
+    "YYYY-MM-DD" names for (year, month, day, hour) tuples from _num_to_dates, with
+    the hour added as "_HH" when there is more than one time step in a day.
+    """
+
+    names = ["{0:04d}-{1:02d}-{2:02d}".format(*date[:3]) for date in dates]
+    if len(set(names)) < len(names):
+        names = ["{0:04d}-{1:02d}-{2:02d}_{3:02d}".format(*date) for date in dates]
+    return names
+
+
+def _grid_geotransform(lat, lon, resolution = None):
+    """
+    gdal geotransform of a regular grid from its 1d lat and lon coordinates, which
+    are the centers of the pixels. Also returns True if rows must be flipped to put
+    north at the top, which is the case when lat is ascending.
+
+    resolution is an optional (lon step, lat step) for subsets too small to measure
+    it from, with the same signs as the steps of the full coordinate arrays.
+    """
+
+    if resolution is not None:
+        xres, yres = resolution
+    else:
+        xres = (lon[-1] - lon[0]) / float(len(lon) - 1) if len(lon) > 1 else 1.0
+        yres = (lat[-1] - lat[0]) / float(len(lat) - 1) if len(lat) > 1 else 1.0
+
+    top  = max(lat[0], lat[-1]) + abs(yres) / 2
+    left = lon[0] - xres / 2
+    return (left, xres, 0.0, top, 0.0, -abs(yres)), yres > 0
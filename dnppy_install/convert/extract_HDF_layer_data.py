@@ -1,9 +1,80 @@
 __author__ = ['djjensen', 'jwely']
 
-import gdal
+from multiprocessing import Pool
+import csv
 import os
 
-def extract_HDF_layer_data(hdfpath, layer_indexs = None):
+__all__ = ["extract_HDF_layer_data",
+           "scan_HDF_layers",
+           "hdf_layer"]
+
+
+# columns of the table returned by scan_HDF_layers, in order
+_columns = ["hdfpath", "index", "name", "subdataset", "rows", "cols", "bands",
+            "datatype", "projection", "geotransform"]
+
+
+class hdf_layer(object):
+    """
+    Header information of one layer (subdataset) of an HDF file, without its pixels.
+
+    Only plain strings and numbers are kept, not the gdal dataset, so thousands of
+    these can be held at once. The pixels are read from disk only when read() is
+    called. For backwards compatibility a layer also acts like the list
+
+        [layer name descriptor, projection, geotransform, numpy_array]
+
+    where asking for the numpy_array (index 3) reads it.
+    """
+
+    def __init__(self, hdfpath, index, name, subdataset, rows = None, cols = None, bands = None,
+                 datatype = None, projection = None, geotransform = None):
+
+        self.hdfpath      = hdfpath
+        self.index        = index
+        self.name         = name
+        self.subdataset   = subdataset
+        self.rows         = rows
+        self.cols         = cols
+        self.bands        = bands
+        self.datatype     = datatype
+        self.projection   = projection
+        self.geotransform = geotransform
+
+
+    def __repr__(self):
+        return "hdf_layer({0} {1} of {2})".format(self.index, self.name, os.path.basename(self.hdfpath))
+
+
+    def __getitem__(self, i):
+        items = [lambda: self.name, lambda: self.projection, lambda: self.geotransform, self.read]
+        return items[i]()
+
+
+    def __len__(self):
+        return 4
+
+
+    def read(self):
+        """ reads the pixels of this layer into a numpy array """
+
+        import gdal
+
+        dataset = gdal.Open(self.subdataset)
+        if dataset is None:
+            raise Exception("gdal could not open {0}".format(self.subdataset))
+        numpy_array = dataset.ReadAsArray()
+        dataset = None
+        return numpy_array
+
+
+    def as_row(self):
+        """ dict of the attributes of this layer, one row of the scan_HDF_layers table """
+
+        return dict((column, getattr(self, column)) for column in _columns)
+
+
+def extract_HDF_layer_data(hdfpath, layer_indexs = None, read_arrays = False):
     """
     Extracts one or more layers from an HDF file and returns a dictionary with
     all the data available in the HDF layer for use in further format conversion
@@ -14,15 +85,20 @@ def extract_HDF_layer_data(hdfpath, layer_indexs = None):
     layer indexs = [1,2,3]
 
     the output dict will have keys :
-                    ["MasterMetadata", "1", "2", "3"]
+                    ["MasterMetadata", 1, 2, 3]
 
     where the "MasterMetadata" values very widely in format depending on
     data source, but should contain georeferencing information and the like.
-    Each of the values for those integer keys will be a list of
-    values that looks like this.
+    Each of the values for those integer keys will be an hdf_layer, which
+    behaves like a list of values that looks like this.
 
         [layer name descriptor, projection, geotransform, numpy_array]
 
+    only the headers of each layer are read, the numpy_array of a layer is
+    read from disk when it is asked for, with layer[3] or layer.read(). Set
+    read_arrays to True to read them all up front, in which case the values
+    are plain lists.
+
     gdal has proven annoying to use, but this function should help you
     get started with programming support for any HDF datatype. Building
     proper geotransormation will require info in the MasterMetadata most
@@ -30,45 +106,133 @@ def extract_HDF_layer_data(hdfpath, layer_indexs = None):
     applied to all datatypes.
     """
 
-    # output dict
-    out_info = {}
-    layer_names = []
+    import gdal
 
     # open the HDF dataset
     hdf_dataset = gdal.Open(hdfpath)
+    if hdf_dataset is None:
+        raise Exception("gdal could not open {0}".format(hdfpath))
 
-    try:
-        subdatasets = hdf_dataset.GetSubDatasets()
+    subdatasets = _subdatasets(hdf_dataset, hdfpath)
+
+    if layer_indexs is None:
+        layer_indexs = range(len(subdatasets))
+    elif isinstance(layer_indexs, int):
+        layer_indexs = [layer_indexs]
+
+    print("Contents of {0}".format(os.path.basename(hdfpath)))
+    for i, dataset_string in enumerate(subdatasets):
+        print("  {0}  {1}".format(i, dataset_string[1]))
+
+    # give metadata info for the entire layer
+    out_info = {"MasterMetadata": hdf_dataset.GetMetadata_Dict()}
+    hdf_dataset = None
+
+    # layers are keyed by their index, and hold no open gdal datasets
+    for layer in layer_indexs:
+        out_info[layer] = _scan_layer(hdfpath, layer, subdatasets[layer])
+        if read_arrays:
+            out_info[layer] = list(out_info[layer])
+
+    return out_info
+
+
+def scan_HDF_layers(hdfpaths, layer_indexs = None, processes = 4, outpath = None):
+    """
+    Scans the layer headers of many HDF files at once, without reading any pixels,
+    for planning work over thousands of files.
+
+    :param hdfpaths:        list of filepaths to HDF files
+    :param layer_indexs:    list of layer indices to scan in each file. defaults to all.
+    :param processes:       number of files to scan at once
+    :param outpath:         optional filepath of a csv to save the table to
+
+    :return table:          list of dicts, one for each layer of each file, with keys
+                            "hdfpath", "index", "name", "subdataset", "rows", "cols",
+                            "bands", "datatype", "projection" and "geotransform".
+                            hdf_layer(**row) gives a layer which can read its pixels.
+    """
+
+    if isinstance(hdfpaths, str):
+        hdfpaths = [hdfpaths]
+    if isinstance(layer_indexs, int):
+        layer_indexs = [layer_indexs]
 
-        if layer_indexs is None:
-            layer_indexs = range(len(subdatasets))
-        elif isinstance(layer_indexs, int):
-            layer_indexs = [layer_indexs]
+    args = [(hdfpath, layer_indexs) for hdfpath in hdfpaths]
 
-        print("Contents of {0}".format(os.path.basename(hdfpath)))
-        for i, dataset_string in enumerate(subdatasets):
-            print("  {0}  {1}".format(i, dataset_string[1]))
-            if i in layer_indexs:
-                layer_names.append(dataset_string[1])
+    if processes > 1 and len(args) > 1:
+        pool = Pool(min(processes, len(args)))
+        try:
+            tables = pool.map(_scan_one, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        tables = [_scan_one(arg) for arg in args]
 
-        # give metadata info for the entire layer
-        out_info["MasterMetadata"] = hdf_dataset.GetMetadata_Dict()
+    table = [row for rows in tables for row in rows]
+    print("Scanned {0} layers in {1} files".format(len(table), len(hdfpaths)))
 
-        # perform operation on each of the desired layers
-        for i,layer in enumerate(layer_indexs):
-            subdataset   = gdal.Open(subdatasets[layer][0])
-            projection   = subdataset.GetProjection()
-            geotransform = subdataset.GetGeoTransform()
-            numpy_array  = subdataset.ReadAsArray()
-            datatype     = numpy_array.dtype
+    if outpath is not None:
+        with open(outpath, 'wb') as f:
+            writer = csv.DictWriter(f, _columns)
+            writer.writeheader()
+            writer.writerows(table)
 
-            out_info[subdataset] = [layer_names [i], projection, geotransform, numpy_array]
+    return table
 
-        return out_info
 
-    except:
-        raise Exception("this function doesn't yet work for HDF5s with just a single layer")
+def _subdatasets(hdf_dataset, hdfpath):
+    """ (path, description) of each layer. files of only one layer are their own layer """
+
+    subdatasets = hdf_dataset.GetSubDatasets()
+    if not subdatasets:
+        subdatasets = [(hdfpath, os.path.basename(hdfpath))]
+    return subdatasets
+
+
+def _scan_layer(hdfpath, index, dataset_string):
+    """ hdf_layer of one subdataset, opening it only to read its header """
+
+    import gdal
+
+    subdataset = gdal.Open(dataset_string[0])
+    if subdataset is None:
+        raise Exception("gdal could not open {0}".format(dataset_string[0]))
+
+    layer = hdf_layer(hdfpath, index, dataset_string[1], dataset_string[0],
+                      rows         = subdataset.RasterYSize,
+                      cols         = subdataset.RasterXSize,
+                      bands        = subdataset.RasterCount,
+                      datatype     = gdal.GetDataTypeName(subdataset.GetRasterBand(1).DataType)
+                                     if subdataset.RasterCount else None,
+                      projection   = subdataset.GetProjection(),
+                      geotransform = subdataset.GetGeoTransform())
+    subdataset = None
+    return layer
+
+
+def _scan_one(args):
+    """ table rows of one file, at the top level of the module so that Pool can pickle it """
+
+    import gdal
+
+    hdfpath, layer_indexs = args
+
+    try:
+        hdf_dataset = gdal.Open(hdfpath)
+        if hdf_dataset is None:
+            raise Exception("gdal could not open it")
+        subdatasets = _subdatasets(hdf_dataset, hdfpath)
+        hdf_dataset = None
+
+        indexs = range(len(subdatasets)) if layer_indexs is None else layer_indexs
+        return [_scan_layer(hdfpath, i, subdatasets[i]).as_row()
+                for i in indexs if i < len(subdatasets)]
 
+    except Exception as e:
+        print("Failed to scan {0}! {1}".format(hdfpath, e))
+        return []
 
 
 if __name__ == "__main__":
@@ -86,4 +250,4 @@ if __name__ == "__main__":
 
     # try something else?
     #rasterpath = r"C:\Users\jwely\Desktop\troubleshooting\AG100.v003.28.-098.0001.h5"
-    #print extract_HDF_layer_data(rasterpath)
\ No newline at end of file
+    #print extract_HDF_layer_data(rasterpath)
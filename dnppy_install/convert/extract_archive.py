@@ -4,11 +4,20 @@ import os
 import tarfile
 import gzip
 import zipfile
+import shutil
+import fnmatch
+import multiprocessing
 from dnppy import core
 
-__all__ = ["extract_archive"]
+__all__ = ["extract_archive",
+           "stream_to_file"]
 
-def extract_archive(filepaths):
+# decompressed data is copied in blocks of this many bytes, so memory use
+# does not grow with the size of the archive.
+_chunk_size = 1024 * 1024
+
+
+def extract_archive(filepaths, members = None, outdir = None, delete = False, processes = 1):
     """
     Input list of filepaths OR a directory path with compressed
     files in it. Attempts to decompress the following formats
@@ -18,43 +27,142 @@ def extract_archive(filepaths):
         .tar
         .gz
         .zip
+
+    :param filepaths:   list of archive filepaths or a directory containing them
+    :param members:     glob pattern or list of glob patterns such as ["*_B4.TIF", "*_MTL.txt"].
+                        only archive members whose name matches one of these are extracted.
+                        Leave as None to extract everything.
+    :param outdir:      directory to place extracted files in. By default each archive is
+                        extracted into a new folder next to it, named after the archive
+                        (single file .gz archives are extracted right next to the .gz).
+    :param delete:      set True to delete each archive after it is extracted.
+    :param processes:   number of archives to decompress at once in separate processes.
+                        On windows, scripts which use processes > 1 must be guarded by
+                        an 'if __name__ == "__main__":' block.
+
+    :return extracted:  list of filepaths to all extracted files.
+
+    Example Usage:
+        from dnppy import convert
+        convert.extract_archive(r"E:\Landsat", members = ["*_B4.TIF", "*_B5.TIF", "*_MTL.txt"],
+                                processes = 4)
     """
 
     filepaths = core.enf_filelist(filepaths)
 
-    for filepath in filepaths:
+    if members is not None:
+        members = core.enf_list(members)
 
-        head,tail = os.path.split(filepath)
+    args = [(filepath, members, outdir, delete) for filepath in filepaths]
 
-        if ".tar.gz" in filepath:
-            with tarfile.open(filepath, 'r:gz') as tfile:
-                outdir = os.path.join(head, tail.replace(".tar.gz",""))
-                tfile.extractall(outdir)
-
-        # gzip only compresses single files
-        elif ".gz" in filepath:
-            with gzip.open(filepath, 'rb') as gzfile:
-                outfile = os.path.join(head, tail.replace(".gz",""))
-                content = gzfile.read()
-                with open(outfile, 'wb') as of:
-                    of.write(content)
-
-        elif ".tar" in filepath:
-            with tarfile.open(filepath, 'r') as tfile:
-                outdir = os.path.join(head, tail.replace(".tar",""))
-                tfile.extractall(outdir)
-
-        elif ".zip" in filepath:
-            with zipfile.ZipFile(filepath, "r") as zipf:
-                outdir = os.path.join(head, tail.replace(".zip",""))
-                zipf.extractall(outdir)
+    if processes > 1 and len(args) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_extract_one_star, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_extract_one(*arg) for arg in args]
+
+    extracted = []
+    for result in results:
+        extracted += result
+    return extracted
+
+
+def _extract_one_star(args):
+    """ unpacks arguments for multiprocessing.Pool.map, which passes only one """
+    return _extract_one(*args)
+
+
+def _matches(name, members):
+    """ True if an archive member name matches any of the member glob patterns """
+
+    if members is None:
+        return True
+
+    basename = os.path.basename(name)
+    return any(fnmatch.fnmatch(basename, pattern) or fnmatch.fnmatch(name, pattern)
+               for pattern in members)
+
+
+def _extract_one(filepath, members = None, outdir = None, delete = False):
+    """
+    Extracts the members of a single archive. Returns a list of extracted filepaths,
+    which is empty if the file is not a supported archive format.
+    """
+
+    head, tail = os.path.split(filepath)
+    extracted  = []
 
+    if ".tar.gz" in filepath or ".tar" in filepath:
+        if ".tar.gz" in filepath:
+            archive_outdir = outdir or os.path.join(head, tail.replace(".tar.gz", ""))
+            mode = "r|gz"
         else:
-            return
+            archive_outdir = outdir or os.path.join(head, tail.replace(".tar", ""))
+            mode = "r|"
+
+        # stream mode reads the archive front to back once, which avoids re-decompressing
+        # the gz stream from the start for every seek to a selected member.
+        with tarfile.open(filepath, mode) as tfile:
+            for member in tfile:
+                if member.isfile() and _matches(member.name, members):
+                    tfile.extract(member, archive_outdir)
+                    extracted.append(os.path.join(archive_outdir, member.name))
+
+    # gzip only compresses single files
+    elif ".gz" in filepath:
+        outfile = os.path.join(outdir or head, tail.replace(".gz", ""))
+        stream_to_file(gzip.open(filepath, 'rb'), outfile)
+        extracted.append(outfile)
+
+    elif ".zip" in filepath:
+        archive_outdir = outdir or os.path.join(head, tail.replace(".zip", ""))
+
+        with zipfile.ZipFile(filepath, "r") as zipf:
+            for name in zipf.namelist():
+                if not name.endswith("/") and _matches(name, members):
+                    zipf.extract(name, archive_outdir)
+                    extracted.append(os.path.join(archive_outdir, name))
+
+    else:
+        return extracted
+
+    if delete:
+        os.remove(filepath)
+
+    print("Extracted {0}".format(filepath))
+    return extracted
+
+
+def stream_to_file(fileobj, outfile, chunk_size = _chunk_size):
+    """
+    Copies the contents of a readable file-like object to outfile in bounded
+    blocks, then closes the input object. Pass it a gzip.GzipFile or any other
+    decompressing stream to write the decompressed content without ever holding
+    all of it in memory.
+
+    :param fileobj:     a readable file-like object
+    :param outfile:     filepath to write the content to
+    :param chunk_size:  number of bytes to copy at a time
+
+    :return outfile:    the output filepath
+    """
+
+    head = os.path.dirname(outfile)
+    if head and not os.path.exists(head):
+        os.makedirs(head)
+
+    try:
+        with open(outfile, 'wb') as of:
+            shutil.copyfileobj(fileobj, of, chunk_size)
+    finally:
+        fileobj.close()
+
+    return outfile
 
-        #os.remove(filepath)
-        print("Extracted {0}".format(filepath))
-    return
 
 #testing area
 if __name__ == "__main__":
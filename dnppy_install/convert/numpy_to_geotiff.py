@@ -0,0 +1,79 @@
+__author__ = 'jwely'
+
+from _convert_dtype import _convert_dtype
+import os
+
+__all__ = ["numpy_to_geotiff"]
+
+
+def numpy_to_geotiff(numpy_array, outpath, geotransform, projection = 4326,
+                     nodata = None, options = None):
+    """
+    Writes a numpy array straight to a GeoTIFF with gdal, without arcpy.
+
+    :param numpy_array:     2d array of (rows, cols), or 3d array of (bands, rows, cols)
+    :param outpath:         output filepath of the tif
+    :param geotransform:    gdal style geotransform tuple of
+                            (left edge, pixel width, 0, top edge, 0, -pixel height)
+    :param projection:      EPSG code (int) or wkt string of the coordinate system.
+                            defaults to 4326, plain lat/lon on WGS84.
+    :param nodata:          optional nodata value to set on every band
+    :param options:         list of GTiff creation options. defaults to tiled and
+                            LZW compressed, switching to BigTIFF when needed.
+
+    :return outpath:        the output filepath
+    """
+
+    if numpy_array.ndim == 2:
+        numpy_array = numpy_array.reshape((1,) + numpy_array.shape)
+    bands, rows, cols = numpy_array.shape
+
+    dataset = _create_geotiff(outpath, rows, cols, bands, numpy_array.dtype,
+                              geotransform, projection, nodata, options)
+
+    for i in range(bands):
+        dataset.GetRasterBand(i + 1).WriteArray(numpy_array[i])
+
+    # dereferencing the dataset flushes it to disk
+    dataset.FlushCache()
+    dataset = None
+
+    return outpath
+
+
+def _create_geotiff(outpath, rows, cols, bands, dtype, geotransform, projection = 4326,
+                    nodata = None, options = None):
+    """
+    creates an empty georeferenced GeoTIFF and returns the open gdal dataset, for
+    callers which fill it in pieces. Set the dataset to None when done to close it.
+    """
+
+    import gdal
+    import osr
+
+    if options is None:
+        options = ["TILED=YES", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"]
+
+    # several threads may be writing into the same new directory
+    head = os.path.dirname(os.path.abspath(outpath))
+    if not os.path.exists(head):
+        try:
+            os.makedirs(head)
+        except OSError:
+            pass
+
+    driver  = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(outpath, cols, rows, bands, _convert_dtype(dtype), options)
+    dataset.SetGeoTransform(tuple(geotransform))
+
+    if isinstance(projection, int):
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(projection)
+        projection = srs.ExportToWkt()
+    dataset.SetProjection(projection)
+
+    if nodata is not None:
+        for i in range(bands):
+            dataset.GetRasterBand(i + 1).SetNoDataValue(nodata)
+
+    return dataset
@@ -0,0 +1,124 @@
+__author__ = 'jwely'
+
+import os
+import json
+import tarfile
+
+__all__ = ["tar_index",
+           "tar_member_path",
+           "read_tar_member"]
+
+
+def _is_gzipped(archive):
+    return archive.endswith(".gz") or archive.endswith(".tgz")
+
+
+def tar_index(archive, refresh = False):
+    """
+    Returns a dict of {member name : (data offset, size)} for every file in a
+    .tar or .tar.gz archive.
+
+    The index is cached in a small sidecar file next to the archive ("archive.idx")
+    and is only rebuilt when the archive changes size or modification time, so listing
+    a large archive a second time costs one small file read instead of a full scan.
+    Offsets are byte positions into the raw file for uncompressed tars, so any
+    member can be reached with a single seek. For .tar.gz archives the offsets refer
+    to the decompressed stream and are only useful for bookkeeping.
+
+    :param archive:     filepath to a .tar or .tar.gz archive
+    :param refresh:     set True to rebuild the index even if a valid cache exists
+
+    :return index:      dict of member names to (offset, size) tuples
+    """
+
+    stat      = os.stat(archive)
+    idx_path  = archive + ".idx"
+    signature = [stat.st_size, stat.st_mtime]
+
+    if not refresh and os.path.isfile(idx_path):
+        try:
+            with open(idx_path, 'r') as f:
+                cached = json.load(f)
+            if cached["signature"] == signature:
+                return dict((k, tuple(v)) for k, v in cached["members"].items())
+        except (ValueError, KeyError):
+            pass
+
+    mode = "r|gz" if _is_gzipped(archive) else "r|"
+    index = {}
+    with tarfile.open(archive, mode) as tfile:
+        for member in tfile:
+            if member.isfile():
+                index[member.name] = (member.offset_data, member.size)
+
+    # failing to write the cache (read only media, for example) is not an error
+    try:
+        with open(idx_path, 'w') as f:
+            json.dump({"signature": signature, "members": index}, f)
+    except IOError:
+        pass
+
+    return index
+
+
+def _find_member(archive, member):
+    """ finds a member of an archive by exact name or by basename """
+
+    index = tar_index(archive)
+    if member in index:
+        return member, index[member]
+
+    for name in index:
+        if os.path.basename(name) == member:
+            return name, index[name]
+
+    raise Exception("'{0}' could not be found in archive {1}".format(member, archive))
+
+
+def tar_member_path(archive, member):
+    """
+    Builds a GDAL virtual filesystem path to a file inside of a .tar or .tar.gz
+    archive, so that it may be opened with gdal.Open without extracting it.
+
+    Members of uncompressed tars are addressed with "/vsisubfile/" and their cached
+    byte offset, so GDAL reads the band directly without scanning the archive.
+    Members of .tar.gz archives are addressed through "/vsitar/".
+
+    :param archive:     filepath to a .tar or .tar.gz archive
+    :param member:      name (or basename) of the file inside the archive
+
+    :return vsi_path:   a path string gdal.Open will accept
+    """
+
+    name, (offset, size) = _find_member(archive, member)
+    archive = os.path.abspath(archive).replace("\\", "/")
+
+    if _is_gzipped(archive):
+        return "/vsitar/{0}/{1}".format(archive, name)
+    else:
+        return "/vsisubfile/{0}_{1},{2}".format(offset, size, archive)
+
+
+def read_tar_member(archive, member):
+    """
+    Returns the contents of a single file inside of a .tar or .tar.gz archive
+    without extracting anything to disk. Meant for small members such as metadata
+    text files.
+
+    :param archive:     filepath to a .tar or .tar.gz archive
+    :param member:      name (or basename) of the file inside the archive
+
+    :return contents:   string of file contents
+    """
+
+    name, (offset, size) = _find_member(archive, member)
+
+    if _is_gzipped(archive):
+        with tarfile.open(archive, "r|gz") as tfile:
+            for tmember in tfile:
+                if tmember.name == name:
+                    return tfile.extractfile(tmember).read()
+    else:
+        with open(archive, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
@@ -17,6 +17,7 @@ from enf_filelist import *
 from enf_list import *
 from exists import *
 from list_files import *
+from catalog import *
 from move import *
 from rename import *
 from install_from_wheel import *
@@ -0,0 +1,309 @@
+__author__ = 'jwely'
+
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+__all__ = ["catalog"]
+
+
+# attributes from raster.grab_info that get their own indexed column. Everything
+# else that grab_info returns is kept in the "attrs" json column.
+_indexed_atts = ["type", "product", "tile", "WRSpath", "WRSrow", "band", "suffix"]
+
+
+class catalog(object):
+    """
+    A persistent SQLite catalog of local data holdings.
+
+    Rather than calling list_files and grab_info over an entire archive every time
+    a workflow starts, a catalog stores the filepath, size, modification time and
+    parsed grab_info attributes of every file in a small database next to the data.
+    Rescans only re-parse files which are new or have changed, and queries by
+    product, tile and date range are answered through indexes.
+
+    Example Usage:
+        from dnppy import core
+        cat = core.catalog(r"E:\MODIS\holdings.db")
+        cat.scan(r"E:\MODIS")
+
+        filelist = cat.query(product = "MOD11A1", tile = "h11v05",
+                             start = datetime(2013,1,1), end = datetime(2013,12,31),
+                             suffix = "_day")
+    """
+
+    def __init__(self, db_path):
+        """
+        opens (or creates) the catalog database at db_path
+
+        :param db_path:     filepath to the sqlite database file. use ":memory:"
+                            for a catalog that is not persisted to disk.
+        """
+
+        self.db_path = db_path
+
+        if db_path != ":memory:":
+            head = os.path.dirname(os.path.abspath(db_path))
+            if not os.path.exists(head):
+                os.makedirs(head)
+
+        self.conn = sqlite3.connect(db_path)
+        self._build_tables()
+        return
+
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _build_tables(self):
+        """ creates the files table and its indexes if they do not already exist """
+
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path        TEXT PRIMARY KEY,
+                name        TEXT,
+                size        INTEGER,
+                mtime       REAL,
+                type        TEXT,
+                product     TEXT,
+                tile        TEXT,
+                WRSpath     TEXT,
+                WRSrow      TEXT,
+                band        TEXT,
+                suffix      TEXT,
+                date        INTEGER,
+                attrs       TEXT);
+
+            CREATE INDEX IF NOT EXISTS idx_product_tile_date ON files (product, tile, date);
+            CREATE INDEX IF NOT EXISTS idx_path_row_date ON files (WRSpath, WRSrow, date);
+            CREATE INDEX IF NOT EXISTS idx_type_date ON files (type, date);
+            CREATE INDEX IF NOT EXISTS idx_date ON files (date);
+            """)
+        self.conn.commit()
+        return
+
+
+    @staticmethod
+    def _parse(filepath):
+        """
+        returns a dict of column values for one file from raster.grab_info.
+        files that grab_info does not recognize are still recorded, so they are
+        not re-parsed on every rescan.
+        """
+
+        # imported here because the raster module itself depends on core
+        from dnppy import raster
+
+        row = dict((att, None) for att in _indexed_atts)
+        row["date"]  = None
+        row["attrs"] = None
+
+        try:
+            info = raster.grab_info(filepath)
+        except:
+            info = False
+
+        if not info:
+            return row
+
+        atts = dict((k, v) for k, v in vars(info).items()
+                    if isinstance(v, (str, unicode, int, float)))
+
+        for att in _indexed_atts:
+            if att in atts:
+                row[att] = str(atts[att])
+
+        # landsat products are catalogued by "L" + sensor + satellite, such as "LC8"
+        if row["type"] == "Landsat" and row["product"] is None:
+            row["product"] = "L{0}{1}".format(atts.get("sensor", ""), atts.get("satellite", ""))
+
+        # dates are stored as proleptic ordinals for fast integer range queries
+        try:
+            dto = datetime(int(atts["year"]), 1, 1) + timedelta(days = int(atts["j_day"]) - 1)
+            row["date"] = dto.toordinal()
+        except (KeyError, ValueError, TypeError):
+            pass
+
+        row["attrs"] = json.dumps(atts)
+        return row
+
+
+    def scan(self, directory, recursive = True, prune = True):
+        """
+        indexes all files in a directory, only parsing files which are new or
+        have changed size or modification time since the last scan.
+
+        :param directory:   directory to scan
+        :param recursive:   set False to ignore subdirectories
+        :param prune:       remove catalog entries for files under directory
+                            which no longer exist on disk.
+
+        :return (added, updated, removed):  counts of changed catalog entries
+        """
+
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            raise Exception("{0} is not a valid folder!".format(directory))
+
+        # LIKE narrows the select through the primary key, startswith drops the
+        # extra matches from "_" and "%" wildcard characters in the directory name.
+        prefix = os.path.join(directory, "")
+        known  = dict((path, (size, mtime)) for path, size, mtime in self.conn.execute(
+            "SELECT path, size, mtime FROM files WHERE path LIKE ?", (prefix + "%",))
+            if path.startswith(prefix))
+
+        if recursive:
+            walk = os.walk(directory)
+        else:
+            walk = [(directory, None, [f for f in os.listdir(directory)
+                                       if os.path.isfile(os.path.join(directory, f))])]
+
+        added   = 0
+        updated = 0
+        seen    = set()
+        for root, dirs, files in walk:
+            for basename in files:
+                filepath = os.path.join(root, basename)
+                if basename.endswith("sr.lock") or filepath == os.path.abspath(self.db_path):
+                    continue
+
+                stat = os.stat(filepath)
+                seen.add(filepath)
+
+                if known.get(filepath) == (stat.st_size, stat.st_mtime):
+                    continue
+
+                row = self._parse(filepath)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                    (filepath, basename, stat.st_size, stat.st_mtime, row["type"],
+                     row["product"], row["tile"], row["WRSpath"], row["WRSrow"],
+                     row["band"], row["suffix"], row["date"], row["attrs"]))
+
+                if filepath in known:
+                    updated += 1
+                else:
+                    added += 1
+
+        removed = 0
+        if prune:
+            gone = [(path,) for path in known if path not in seen]
+            if not recursive:
+                gone = [(path,) for (path,) in gone if os.path.dirname(path) == directory]
+            self.conn.executemany("DELETE FROM files WHERE path = ?", gone)
+            removed = len(gone)
+
+        self.conn.commit()
+        print("Catalog scan of {0}: {1} added, {2} updated, {3} removed".format(
+              directory, added, updated, removed))
+        return added, updated, removed
+
+
+    def query(self, product = None, tile = None, start = None, end = None,
+              suffix = None, contains = None, **kwargs):
+        """
+        returns a sorted list of filepaths matching all of the input criteria
+
+        :param product:     product name such as "MOD11A1" or "LC8" for landsat 8
+        :param tile:        MODIS tile or WELD tile such as "h11v05"
+        :param start:       datetime object, earliest date to include
+        :param end:         datetime object, latest date to include
+        :param suffix:      required filename suffix, such as "_day"
+        :param contains:    string or list of strings the filename must contain
+        :param kwargs:      any other grab_info attribute, for example
+                            type = "Landsat", WRSpath = "014", band = "B4"
+
+        :return filelist:   list of filepaths, sorted by date then path
+        """
+
+        return [row[0] for row in self._select(product, tile, start, end,
+                                               suffix, contains, **kwargs)]
+
+
+    def _select(self, product = None, tile = None, start = None, end = None,
+                suffix = None, contains = None, **kwargs):
+        """ returns (path, name, date, attrs) rows for query """
+
+        where  = []
+        params = []
+
+        for col, value in [("product", product), ("tile", tile), ("suffix", suffix)]:
+            if value is not None:
+                where.append("{0} = ?".format(col))
+                params.append(value)
+
+        if start is not None:
+            where.append("date >= ?")
+            params.append(start.toordinal())
+        if end is not None:
+            where.append("date <= ?")
+            params.append(end.toordinal())
+
+        if contains is not None:
+            if isinstance(contains, basestring):
+                contains = [contains]
+            for string in contains:
+                where.append("instr(name, ?) > 0")
+                params.append(string)
+
+        # non indexed attributes are checked against the json attrs after the select
+        extra = {}
+        for key, value in kwargs.items():
+            if key in _indexed_atts:
+                where.append("{0} = ?".format(key))
+                params.append(str(value))
+            else:
+                extra[key] = str(value)
+
+        sql = "SELECT path, name, date, attrs FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date, path"
+
+        rows = self.conn.execute(sql, params).fetchall()
+
+        if extra:
+            rows = [row for row in rows if row[3] is not None and
+                    all(str(json.loads(row[3]).get(k)) == v for k, v in extra.items())]
+        return rows
+
+
+    def query_dates(self, **query):
+        """
+        same as catalog.query, but returns a list of (filepath, datetime) tuples.
+        files without a parsable date are left out.
+        """
+
+        return [(row[0], datetime.fromordinal(row[2]))
+                for row in self._select(**query) if row[2] is not None]
+
+
+    def to_rast_series(self, name = "name", **query):
+        """
+        builds a time_series.rast_series_class from the results of a query.
+        accepts the same keyword arguments as catalog.query.
+        """
+
+        # imported here because the time_series module itself depends on core
+        from dnppy.time_series import rast_series_class
+
+        rs = rast_series_class(name = name)
+        rs.from_catalog(self, **query)
+        return rs
+
+
+    def close(self):
+        """ closes the database connection """
+
+        self.conn.close()
+        return
@@ -27,3 +27,7 @@ from fetch_TRMM import *
 
 from list_http_e4ftl01 import *
 from list_ftp import *
+from ftp_pool import *
+from list_cache import *
+from rate_limiter import *
+from manifest import *
@@ -0,0 +1,123 @@
+__author__ = 'jwely'
+
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+import calendar
+import threading
+
+__all__ = ["crawl_dates"]
+
+
+def crawl_dates(list_function, root, folder_fmt, start_dto, end_dto, threads = 8):
+    """
+    Lists only the remote folders which can hold data between two dates.
+
+    Most servers organize data into one folder per day or month, named by a date
+    format such as "2013.01.05" or "2013/01/05". Rather than listing every folder on
+    the server and filtering by date afterwards, the folder names are built straight
+    from the date range and folder_fmt, and only those folders are listed, several
+    at a time. If any of those folders turns out not to exist (for example, 8 day
+    composite products only have a folder every 8 days) the server is crawled level
+    by level instead, which still skips every folder outside of the date range.
+
+    :param list_function:   function which takes a folder url (or path) and returns a
+                            list of names in it. It must raise an exception if the folder
+                            does not exist. download.list_http_e4ftl01 is one example.
+    :param root:            url or path of the product folder the date folders are in
+    :param folder_fmt:      datetime format of the folder path below root, for example
+                            "%Y.%m.%d", "%Y/%m/%d" or "%Y%m". use "/" between levels.
+    :param start_dto:       datetime object, start of the date range
+    :param end_dto:         datetime object, end of the date range
+    :param threads:         number of folders to list at once
+
+    :return folders:        list of (folder datetime, folder url, list of names) tuples,
+                            sorted by date.
+    """
+
+    root = root.rstrip("/")
+
+    # build one candidate folder for every day in the range, duplicates are
+    # removed for formats coarser than one day (such as month folders)
+    candidates = []
+    day = datetime(start_dto.year, start_dto.month, start_dto.day)
+    while day <= end_dto:
+        name = day.strftime(folder_fmt)
+        if not candidates or candidates[-1] != name:
+            candidates.append(name)
+        day += timedelta(days = 1)
+
+    missing = threading.Event()
+
+    def list_candidate(name):
+        # once any folder is known to be missing, the rest are not worth asking for
+        if missing.is_set():
+            return None
+        try:
+            return list_function("/".join([root, name]))
+        except Exception:
+            missing.set()
+            return None
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        listings = pool.map(list_candidate, candidates)
+
+        if missing.is_set():
+            print("Not every date folder exists under {0}, crawling it instead".format(root))
+            candidates = _crawl(list_function, root, folder_fmt, start_dto, end_dto, pool)
+            listings   = pool.map(lambda name: list_function("/".join([root, name])), candidates)
+    finally:
+        pool.close()
+        pool.join()
+
+    folders = []
+    for name, listing in zip(candidates, listings):
+        folders.append((datetime.strptime(name, folder_fmt), "/".join([root, name]), listing))
+
+    return sorted(folders)
+
+
+def _crawl(list_function, root, folder_fmt, start_dto, end_dto, pool):
+    """
+    walks down the levels of folder_fmt, keeping only folders whose time period
+    overlaps the date range. returns folder paths relative to root.
+    """
+
+    levels = folder_fmt.split("/")
+    paths  = [""]
+
+    for depth in range(len(levels)):
+        partial_fmt = "/".join(levels[:depth + 1])
+
+        def list_level(path):
+            if path:
+                return [path + "/" + name for name in list_function("/".join([root, path]))]
+            return list(list_function(root))
+
+        new_paths = []
+        for listing in pool.map(list_level, paths):
+            for path in listing:
+                try:
+                    dto = datetime.strptime(path, partial_fmt)
+                except ValueError:
+                    continue
+
+                if dto <= end_dto and _period_end(dto, partial_fmt) >= start_dto:
+                    new_paths.append(path)
+        paths = new_paths
+
+    return sorted(paths)
+
+
+def _period_end(dto, fmt):
+    """ the last moment of the year, month or day that a folder named by fmt covers """
+
+    if any(code in fmt for code in ["%d", "%j"]):
+        return dto + timedelta(days = 1, microseconds = -1)
+
+    elif any(code in fmt for code in ["%m", "%b", "%B"]):
+        days = calendar.monthrange(dto.year, dto.month)[1]
+        return dto + timedelta(days = days, microseconds = -1)
+
+    else:
+        return datetime(dto.year + 1, 1, 1) - timedelta(microseconds = 1)
@@ -44,14 +44,14 @@ def download_filelist(ftptexts, filetypes = False, outdir = False):
         print("Saving all files to {0}".format(outdir))
 
         # perform the first attempt
-        failed = download_urls(sites, outdir, filetypes)
+        failed = download_urls(sites, outdir, filetypes).failed_urls
 
         # for 19 more times, if there are still items in the failed list, try again
         for i in range(1,19):
             if len(failed)>0:
                 print("retry number {0} to grab {1} failed downloads!".format(i,len(failed)))
                 time.sleep(60)
-                failed = download_urls(failed, filetypes, outdir)
+                failed = download_urls(failed, outdir, filetypes).failed_urls
 
         # once all tries are complete, print a list of files which repeatedly failed
         if len(failed)>0:
@@ -1,55 +1,416 @@
 __author__ = 'jwely'
 
-import urllib
-import ftplib
+from ftp_pool import ftp_pool
+from rate_limiter import rate_limiter
+from datetime import datetime
+import email.utils
+import calendar
+import urllib2
+import hashlib
+import zlib
 import os
 
-__all__ = ["download_url"]
+__all__ = ["download_url",
+           "download_bytes",
+           "remote_stat"]
 
+# files are written to disk in blocks of this many bytes as they arrive,
+# so memory use does not grow with the size of the file.
+_chunk_size = 256 * 1024
 
-def download_url(url, outname, username = None, password = None):
-    """Download a single file. input source url and output filename"""
+# first bytes of every gzip member
+_gzip_magic = b"\x1f\x8b"
+
+
+def download_url(url, outname, username = None, password = None, timeout = 60,
+                 md5 = None, gunzip = False, retries = None, manifest = None):
+    """
+    Download a single file. input source url and output filename
+
+    The file is streamed to disk in blocks rather than read into memory whole.
+    Data is written to "outname.part" and only renamed to outname once the
+    download is complete and verified, so a file at outname is always whole.
+    If a ".part" file is left over from an interrupted download, the transfer
+    resumes where it left off with an http Range request or an ftp REST command.
+
+    Requests are scheduled through the shared download.rate_limiter, which limits
+    how hard any one server is hit, and retries failed transfers. Raises an exception
+    if the download still fails, for example on an http 404, or if the file does not
+    match the size reported by the server or the md5.
+
+    :param url:         http or ftp url of the file to download
+    :param outname:     local filepath to save the file as
+    :param username:    optional username for ftp servers which require a login
+    :param password:    optional password for ftp servers which require a login
+    :param timeout:     seconds to wait on an unresponsive http server before giving up.
+                        ftp sessions use the timeout of the shared ftp_pool.
+    :param md5:         optional md5 hex digest the file must match. set to True to
+                        read the digest from a "url.md5" file published on the server.
+    :param gunzip:      set True to decompress a gzipped file as it arrives, so outname
+                        is written already decompressed and the .gz never touches disk.
+                        The size and md5 checks then apply to the compressed stream.
+                        gunzipped downloads can not be resumed.
+    :param retries:     number of times to retry a failed transfer. defaults to the
+                        retries setting of download.rate_limiter.shared
+    :param manifest:    optional download.manifest to record the completed file in, along
+                        with its size, the remote modification time and its md5
+    """
 
     head, tail = os.path.split(outname)
     if not os.path.exists(head) and head is not "":
         os.makedirs(head)
 
+    partname = outname + ".part"
+    limiter  = rate_limiter.shared
+
+    # retried transfers resume from the .part file where the last attempt stopped
     if "http" in url[:4]:
-        connection  = urllib.urlopen(url)
-        page        = connection.read()
+        stream_md5, remote_mtime, remote_size = limiter.call(url,
+                        lambda: _download_http(url, partname, timeout, gunzip), retries)
 
-        # escapes in the event of a 404 not found
-        if "404 Not Found" in page:
-            return
+    elif "ftp:" in url[:4]:
+        stream_md5, remote_mtime, remote_size = limiter.call(url,
+                        lambda: _download_ftp(url, partname, username, password, gunzip), retries)
+
+    else:
+        print("Unknown url protocol type, must be http or ftp")
+        return
+
+    if md5 is True:
+        md5 = limiter.call(url + ".md5", lambda: _published_md5(url, username, password, timeout), retries)
+
+    # the md5 of a file is only known from the stream if it arrived in one piece
+    digest = stream_md5
+    if (md5 or manifest is not None) and digest is None:
+        digest = _file_md5(partname)
+
+    if md5:
+        if digest.lower() != md5.lower():
+            os.remove(partname)
+            raise IOError("md5 of {0} is {1}, expected {2}".format(tail, digest, md5))
+
+    # windows will not rename over an existing file
+    if os.path.exists(outname):
+        os.remove(outname)
+    os.rename(partname, outname)
+
+    if manifest is not None:
+        manifest.record(url, outname, mtime = remote_mtime, md5 = digest, remote_size = remote_size)
+
+    return
+
+
+def download_bytes(url, username = None, password = None, timeout = 60, retries = None):
+    """
+    Downloads a single file into memory and returns its contents as a string,
+    for small files which are unpacked right away and never need to be on disk.
+    Requests go through download.rate_limiter exactly like download_url.
+
+    :param url:         http or ftp url of the file to download
+    :param username:    optional username for ftp servers which require a login
+    :param password:    optional password for ftp servers which require a login
+    :param timeout:     seconds to wait on an unresponsive http server before giving up
+    :param retries:     number of times to retry a failed transfer. defaults to the
+                        retries setting of download.rate_limiter.shared
+    """
+
+    def read_http():
+        connection = urllib2.urlopen(url, timeout = timeout)
+        try:
+            expected = connection.info().getheader("Content-Length", "")
+            blocks   = []
+            for block in iter(lambda: connection.read(_chunk_size), b""):
+                blocks.append(block)
+        finally:
+            connection.close()
+
+        data = b"".join(blocks)
+        if expected.isdigit():
+            _check_size(os.path.basename(url), len(data), int(expected))
+        return data
+
+    def read_ftp():
+        server = url.split("/")[2]
+        path   = "/".join(url.split("/")[3:-1])
+        blocks = []
 
-        writefile   = open(outname, 'wb+')
-        writefile.write(page)
-        writefile.close()
-        del connection
+        def retrieve(ftp):
+            del blocks[:]
+            ftp.cwd(path)
+            ftp.retrbinary("RETR " + os.path.basename(url), blocks.append, _chunk_size)
+
+        ftp_pool.shared.call(server, username, password, retrieve)
+        return b"".join(blocks)
+
+    if "http" in url[:4]:
+        return rate_limiter.shared.call(url, read_http, retries)
 
     elif "ftp:" in url[:4]:
-        filename = os.path.basename(url)
+        return rate_limiter.shared.call(url, read_ftp, retries)
+
+    raise ValueError("Unknown url protocol type, must be http or ftp")
+
+
+def remote_stat(url, username = None, password = None, timeout = 60):
+    """
+    size in bytes and modification time in seconds since the epoch of a file on
+    the server, from an http HEAD request or the ftp SIZE and MDTM commands, without
+    downloading it. Either is None if the server does not say.
+    """
+
+    def stat_http():
+        request = urllib2.Request(url)
+        request.get_method = lambda: "HEAD"
+        connection = urllib2.urlopen(request, timeout = timeout)
+        try:
+            size  = connection.info().getheader("Content-Length", "")
+            mtime = email.utils.parsedate_tz(connection.info().getheader("Last-Modified", ""))
+        finally:
+            connection.close()
+        return (int(size) if size.isdigit() else None,
+                email.utils.mktime_tz(mtime) if mtime else None)
+
+    def stat_ftp():
         server   = url.split("/")[2]
         path     = "/".join(url.split("/")[3:-1])
+        filename = os.path.basename(url)
+
+        def stat(ftp):
+            ftp.cwd(path)
+            ftp.voidcmd("TYPE I")
+            try:
+                size = ftp.size(filename)
+            except:
+                size = None
+            try:
+                stamp = ftp.sendcmd("MDTM " + filename).split()[-1][:14]
+                mtime = calendar.timegm(datetime.strptime(stamp, "%Y%m%d%H%M%S").timetuple())
+            except:
+                mtime = None
+            return size, mtime
 
-        ftp = ftplib.FTP(server)
+        return ftp_pool.shared.call(server, username, password, stat)
 
-        # log in to the server with user specified username and password
-        if username is not None and password is not None:
-            ftp.login(username, password)
-        elif username is not None:
-            ftp.login(username)
+    if "http" in url[:4]:
+        return rate_limiter.shared.call(url, stat_http)
+
+    elif "ftp:" in url[:4]:
+        return rate_limiter.shared.call(url, stat_ftp)
+
+    return None, None
+
+
+class _sink(object):
+    """
+    file-like target for downloaded blocks. Counts the bytes received and keeps
+    an md5 of them. If gunzip is True, blocks are decompressed on the way to disk.
+    """
+
+    def __init__(self, partname, mode, gunzip):
+        self.fileobj  = open(partname, mode)
+        self.gunzip   = gunzip
+        self.received = 0
+        self.md5      = hashlib.md5()
+        self.decomp   = zlib.decompressobj(16 + zlib.MAX_WBITS) if gunzip else None
+
+
+    def write(self, block):
+        self.received += len(block)
+        self.md5.update(block)
+        if not self.gunzip:
+            self.fileobj.write(block)
+            return
+
+        # anything after the last gzip member, such as zero padding, is ignored
+        if self.decomp is None:
+            return
+
+        self.fileobj.write(self.decomp.decompress(block))
+
+        # concatenated gzip members each need a fresh decompressor
+        while self.decomp.unused_data:
+            leftover    = self.decomp.unused_data
+
+            # the magic of the next member may be split across blocks
+            if len(leftover) < len(_gzip_magic) and _gzip_magic.startswith(leftover):
+                return
+
+            self.fileobj.write(self.decomp.flush())
+            if not leftover.startswith(_gzip_magic):
+                self.decomp = None
+                return
+
+            self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.fileobj.write(self.decomp.decompress(leftover))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        try:
+            if self.decomp is not None:
+                self.fileobj.write(self.decomp.flush())
+        finally:
+            self.fileobj.close()
+
+
+def _download_http(url, partname, timeout, gunzip = False):
+    """
+    streams an http url into partname, resuming from its current size.
+    returns the md5 hex digest of the whole stream (None if it was resumed), the
+    remote modification time in seconds since the epoch (None if unknown) and the
+    size of the file on the server.
+    """
+
+    offset = 0
+    if os.path.isfile(partname):
+        if gunzip:
+            os.remove(partname)
         else:
-            ftp.login()
+            offset = os.path.getsize(partname)
+
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header("Range", "bytes={0}-".format(offset))
+
+    try:
+        connection = urllib2.urlopen(request, timeout = timeout)
+
+    # 416 means the range starts at or beyond the end of the file on the server
+    except urllib2.HTTPError as e:
+        if e.code != 416:
+            raise
+        total = e.info().getheader("Content-Range", "").split("/")[-1]
+        if total.isdigit() and int(total) == offset:
+            return None, None, offset
+        os.remove(partname)
+        return _download_http(url, partname, timeout, gunzip)
+
+    try:
+        # servers which ignore the Range header send the whole file again
+        if connection.getcode() == 206:
+            mode     = 'ab'
+            expected = connection.info().getheader("Content-Range", "").split("/")[-1]
+        else:
+            mode     = 'wb'
+            offset   = 0
+            expected = connection.info().getheader("Content-Length", "")
+
+        with _sink(partname, mode, gunzip) as sink:
+            while True:
+                block = connection.read(_chunk_size)
+                if not block:
+                    break
+                sink.write(block)
+    finally:
+        connection.close()
+
+    if expected.isdigit():
+        _check_size(partname, offset + sink.received, int(expected))
+
+    remote_mtime = email.utils.parsedate_tz(connection.info().getheader("Last-Modified", ""))
+    if remote_mtime:
+        remote_mtime = email.utils.mktime_tz(remote_mtime)
+
+    if offset:
+        return None, remote_mtime or None, offset + sink.received
+    return sink.md5.hexdigest(), remote_mtime or None, sink.received
+
+
+def _download_ftp(url, partname, username, password, gunzip = False):
+    """
+    streams an ftp url into partname, resuming from its current size.
+    returns the md5 hex digest of the whole stream (None if it was resumed), the
+    remote modification time in seconds since the epoch (None if unknown) and the
+    size of the file on the server.
+    """
 
+    filename = os.path.basename(url)
+    server   = url.split("/")[2]
+    path     = "/".join(url.split("/")[3:-1])
+
+    def retrieve(ftp):
         ftp.cwd(path)
-        ftp.retrbinary("RETR " + filename, open(outname, 'wb').write)
-        ftp.quit()
+        ftp.voidcmd("TYPE I")
+        try:
+            expected = ftp.size(filename)
+        except:
+            expected = None
+
+        try:
+            stamp = ftp.sendcmd("MDTM " + filename).split()[-1][:14]
+            mtime = calendar.timegm(datetime.strptime(stamp, "%Y%m%d%H%M%S").timetuple())
+        except:
+            mtime = None
+
+        offset = os.path.getsize(partname) if os.path.isfile(partname) else 0
+        if gunzip or (expected is not None and offset > expected):
+            offset = 0
+
+        if offset and offset == expected:
+            return expected, offset, None, mtime
+
+        with _sink(partname, 'ab' if offset else 'wb', gunzip) as sink:
+            ftp.retrbinary("RETR " + filename, sink.write, _chunk_size, rest = offset or None)
+
+        digest = None if offset else sink.md5.hexdigest()
+        return expected, offset + sink.received, digest, mtime
+
+    # log in to the server with user specified username and password, or reuse
+    # an already logged in session from the shared pool.
+    expected, received, digest, mtime = ftp_pool.shared.call(server, username, password, retrieve)
+
+    if expected is not None:
+        _check_size(partname, received, expected)
+
+    return digest, mtime, received
+
+
+def _check_size(partname, size, expected):
+    """ raises an IOError if size bytes were received for partname instead of expected """
+
+    if size != expected:
+        raise IOError("{0} is {1} bytes, expected {2}. Download again to resume".format(
+            os.path.basename(partname), size, expected))
 
+
+def _published_md5(url, username, password, timeout):
+    """ reads the md5 digest from a "url.md5" file on the server """
+
+    if "http" in url[:4]:
+        connection = urllib2.urlopen(url + ".md5", timeout = timeout)
+        try:
+            text = connection.read()
+        finally:
+            connection.close()
     else:
-        print("Unknown url protocol type, must be http or ftp")
+        lines  = []
+        server = url.split("/")[2]
+        path   = "/".join(url.split("/")[3:-1])
+        name   = os.path.basename(url)
+
+        def retrieve(ftp):
+            ftp.cwd(path)
+            ftp.retrlines("RETR " + name + ".md5", lines.append)
+
+        ftp_pool.shared.call(server, username, password, retrieve)
+        text = "\n".join(lines)
+
+    # md5 files are formatted as "digest  filename"
+    return text.split()[0]
+
+
+def _file_md5(filepath):
+    """ md5 hex digest of a file, read in blocks """
+
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(_chunk_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
 
-    return
 
 if __name__ == "__main__":
 
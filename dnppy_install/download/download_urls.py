@@ -2,75 +2,161 @@ __author__ = 'jwely'
 
 from dnppy import core
 from download_url import download_url
-import os, time
+import os, time, threading, Queue
 
-__all__ = ["download_urls"]
+__all__ = ["download_urls",
+           "download_report"]
 
-def download_urls(url_list, outdir, filetypes = False):
 
+class download_report(object):
     """
-    Downloads a list of files. Retries failed downloads
+    Summary of a batch of downloads, as returned by download_urls.
+
+    download_urls used to return the list of urls which failed, so a report also
+    acts like that list. Iterating over it, len(), indexing, "in" and truth tests
+    all apply to failed_urls.
+
+    Attributes:
+        succeeded       list of (url, outname, seconds, bytes) tuples
+        failed          list of (url, error message) tuples
+        elapsed         total wall clock seconds for the whole batch
+    """
+
+    def __init__(self):
+        self.succeeded  = []
+        self.failed     = []
+        self.elapsed    = 0.0
+        self._lock      = threading.Lock()
+
+
+    def __str__(self):
+        mb = sum(s[3] for s in self.succeeded) / 1e6
+        rate = mb / self.elapsed if self.elapsed else 0.0
+        return "{0} downloaded, {1} failed, {2:.1f} MB in {3:.1f}s ({4:.2f} MB/s)".format(
+            len(self.succeeded), len(self.failed), mb, self.elapsed, rate)
+
+
+    def __iter__(self):
+        return iter(self.failed_urls)
+
+
+    def __len__(self):
+        return len(self.failed)
+
+
+    def __getitem__(self, index):
+        return self.failed_urls[index]
+
+
+    def __contains__(self, url):
+        return url in self.failed_urls
+
+
+    def __eq__(self, other):
+        if isinstance(other, download_report):
+            return self is other
+        return self.failed_urls == other
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    @property
+    def failed_urls(self):
+        """ list of just the urls which failed, ready to be retried """
+        return [url for url, error in self.failed]
+
+
+    def _add_success(self, url, outname, seconds):
+        size = os.path.getsize(outname) if os.path.isfile(outname) else 0
+        with self._lock:
+            self.succeeded.append((url, outname, seconds, size))
+
+
+    def _add_failure(self, url, error):
+        with self._lock:
+            self.failed.append((url, str(error)))
+
+
+def download_urls(url_list, outdir, filetypes = False, threads = 8, retries = 3,
+                  username = None, password = None):
+
+    """
+    Downloads a list of files concurrently. Retries failed downloads
 
      This script downloads a list of files and places it in the output directory. It was
      built to be nested within "Download_filelist" to allow loops to continuously retry
      failed files until they are successful or a retry limit is reached.
 
+     Files are fetched by a pool of worker threads. How many of them may talk to any one
+     server at a time, and how long a failed url waits before it is retried, is decided
+     by the shared download.rate_limiter, which backs off as soon as a server starts
+     rejecting requests and speeds back up while they succeed.
+
      Inputs:
        url_list        array of urls, probably as read from a text file
+       outdir          folder where files are to be placed after download
        filetypes       list of filetypes to download. Useful for excluding extraneous
                        metadata by only downloding 'hdf' or 'tif' for example. Please note
                        that often times, you actually NEED the metadata.
-       outdir          folder where files are to be placed after download
+       threads         maximum number of files to download at once
+       retries         number of times to retry each failed url before giving up on it
+       username        optional login for servers which require one
+       password        optional password for servers which require one
 
      Output:
-       failed          list of files which failed download
+       report          a download_report object. It acts like the list of files which
+                       failed download (also report.failed_urls), as was returned before.
     """
 
-    failed   = []
+    report   = download_report()
     url_list = core.enf_list(url_list)
 
     # creates output folder at desired path if it doesn't already exist
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
-    # establish a wait time that will increase when downloads fail. This helps to reduce
-    # the frequency of REVERB server rejections for requesting too many downloads
-    wait = 0
-
+    queue = Queue.Queue()
     for site in url_list:
-        download = False
-        url      = site.rstrip()
-        sub      = url.split("/")
-        leng     = len(sub)
-        name     = sub[leng-1]
+        url  = site.rstrip()
+        name = url.split("/")[-1]
 
         # Determine whether or not to download the file based on filetype.
         if filetypes:
-            for filetype in filetypes:
-                if filetype in name[-4:]:
-                    download = True
+            if any(filetype in name[-4:] for filetype in filetypes):
+                queue.put(url)
         else:
-            download = True
-
-        # attempt download of the file, or skip it.
-        if download:
+            queue.put(url)
 
+    def worker():
+        while True:
             try:
-                # wait for the wait time before attempting writing a file
-                time.sleep(wait)
-                download_url(url, os.path.join(outdir,name))
-                print("{0} is downloaded {1}".format(name, wait))
-
-                # reduce the wait time when downloads succeed.
-                if wait >= 1:
-                    wait -= wait
+                url = queue.get_nowait()
+            except Queue.Empty:
+                return
 
-            # add to the fail count if the download is unsuccessful and wait longer next time.
-            except:
-                print("{0} will be retried! {1}".format(sub[leng-1], wait))
-                wait += 5
-                failed.append(url)
+            name    = url.split("/")[-1]
+            outname = os.path.join(outdir, name)
 
-
-    print("Finished downloading urls!")
-    return failed
\ No newline at end of file
+            start = time.time()
+            try:
+                download_url(url, outname, username, password, retries = retries)
+                report._add_success(url, outname, time.time() - start)
+                print("{0} is downloaded".format(name))
+
+            except Exception as e:
+                print("{0} failed! {1}".format(name, e))
+                report._add_failure(url, e)
+
+    start   = time.time()
+    workers = [threading.Thread(target = worker) for _ in range(max(1, threads))]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    for w in workers:
+        w.join()
+    report.elapsed = time.time() - start
+
+    print("Finished downloading urls! {0}".format(report))
+    return report
@@ -3,6 +3,7 @@ __all__ = ["fetch_GPM_IMERG"]
 
 from list_ftp import list_ftp
 from download_url import download_url
+from crawl_dates import crawl_dates
 
 from datetime import datetime, timedelta
 import os
@@ -52,26 +53,14 @@ def fetch_GPM_IMERG(start_dto, end_dto, outdir, product = "gis", time_res = "1da
     # set product directory
     prod_server = "/".join(["NRTPUB/imerg", product])
 
-    # log in and list available month folders.
-    foldnames, foldpaths = list_ftp(site = pps_server,
-                                    dir = prod_server,
-                                    username = login,
-                                    password = login)
-
-    # perform a simple quick filtering of folders that definitely don't have data we want.
-    for foldname in foldnames:
-        try:
-            int(foldname)
-        except:
-            foldnames.remove(foldname)
-
-    for foldname in foldnames:
-        print("exploring directory '{0}'".format(foldname))
-        subdir = "/".join([prod_server, foldname])
-        filenames, filepaths = list_ftp(site = pps_server,
-                                        dir = subdir,
-                                        username = login,
-                                        password = login)
+    # list only the month folders which overlap the date range.
+    lister  = lambda path: list_ftp(site = pps_server, dir = path,
+                                    username = login, password = login)[0]
+    folders = crawl_dates(lister, prod_server, "%Y%m", start_dto, end_dto)
+
+    for month_dto, folder, filenames in folders:
+        print("exploring directory '{0}'".format(folder))
+        filepaths = ["/".join([pps_server, folder, filename]) for filename in filenames]
 
         for filepath in filepaths:
             filename = os.path.basename(filepath)
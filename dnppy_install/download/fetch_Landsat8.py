@@ -1,15 +1,16 @@
 __author__ = ['djjensen', 'jwely']
 
-from dnppy import textio
 from dnppy import core
 
 from download_url import download_url
+from rate_limiter import rate_limiter
 
 import datetime
-import urllib
-import site
+import urllib2
+import numpy
+import time
+import zlib
 import os
-import gzip
 
 __all__ = ["fetch_Landsat8"]
 
@@ -34,31 +35,24 @@ def fetch_Landsat8(path_row_pairs, start_dto, end_dto, outdir,
     path_row_pairs = core.enf_list(path_row_pairs)
     output_tilenames = []
 
-    for path_row_pair in path_row_pairs:
-        #format input strings
-        path, row = path_row_pair
-        path_str  = str(path).zfill(3)
-        row_str   = str(row).zfill(3)
+    # fetch an updated scene list index only once, for every path/row pair
+    index = fetch_Landsat8_scene_list()
 
-        # fetch an updated scene list with custom function.
-        scene_list = fetch_Landsat8_scene_list()
+    # find every scene of every path/row pair within the date range in one pass.
+    wanted  = [int(path) * 1000 + int(row) for path, row in path_row_pairs]
+    start   = int(start_dto.strftime("%Y%m%d%H%M%S"))
+    end     = int(end_dto.strftime("%Y%m%d%H%M%S"))
 
-        # loop through the scene list
-        # if the date for the given path/row scene is within the date range, download it with landsat_8_scene
+    matches = (numpy.in1d(index["path"].astype("int32") * 1000 + index["row"], wanted) &
+               (index["date"] >= start) & (index["date"] <= end) &
+               (index["cloud"] < max_cloud_cover))
 
-        for row in scene_list:
-            tilename    = row[0]
-            datestring  = row[1].split(".")[0] # removes fractional seconds from datestring
-            date        = datetime.datetime.strptime(datestring, "%Y-%m-%d %H:%M:%S")
-            pathrow_id  = "LC8{0}{1}".format(path_str, row_str)
-            cloud_cover = float(row[2])
-
-            if cloud_cover < max_cloud_cover:
-                if pathrow_id in row[0]:
-                    if start_dto <=  date  <= end_dto:
-                        amazon_url = row[-1]
-                        fetch_Landsat8_tile(amazon_url, tilename, outdir, bands)
-                        output_tilenames.append(os.path.join(outdir, tilename))
+    # download each matching tile with fetch_Landsat8_tile
+    for i in numpy.nonzero(matches)[0]:
+        tilename   = index["id"][i]
+        amazon_url = index["url"][i]
+        fetch_Landsat8_tile(amazon_url, tilename, outdir, bands)
+        output_tilenames.append(os.path.join(outdir, tilename))
 
     print("Finished retrieving landsat 8 data!")
     return output_tilenames
@@ -81,8 +75,8 @@ def fetch_Landsat8_tile(amazon_url, tilename, outdir, bands = None):
         bands = map(str, (core.enf_list(bands)))
 
     # create the scene name from the input parameters and use that to generate the scene's unique url
-    connection = urllib.urlopen(amazon_url)
-    page       = connection.read().split("\n")
+    read_page  = lambda: urllib2.urlopen(amazon_url, timeout = 60).read()
+    page       = rate_limiter.shared.call(amazon_url, read_page).split("\n")
 
     print("Downloading landsat tile {0}".format(tilename))
 
@@ -102,10 +96,9 @@ def fetch_Landsat8_tile(amazon_url, tilename, outdir, bands = None):
                 link     = amazon_url.replace("index.html",filename)
                 savename = os.path.join(outdir, tilename, filename)
 
-                # try twice if filepath doesn't already exist
+                # failed transfers are retried by download_url itself
                 if not os.path.isfile(savename):
-                    try:    download_url(link, savename)
-                    except: download_url(link, savename)
+                    download_url(link, savename)
                     print("\tDownloaded {0}".format(filename))
                 else:
                     print("\t Found {0}".format(filename))
@@ -113,31 +106,144 @@ def fetch_Landsat8_tile(amazon_url, tilename, outdir, bands = None):
     return
 
 
-def fetch_Landsat8_scene_list():
+def fetch_Landsat8_scene_list(max_age = 86400, refresh = False):
     """
-    Simple downloads the most recent version of the scene_list textfile for reference
+    Returns an index of the most recent version of the landsat 8 scene list
 
     http://landsat-pds.s3.amazonaws.com/scene_list.gz
+
+    The scene list has hundreds of thousands of rows, so it is streamed through
+    gzip as it downloads and parsed straight into a compact columnar index,
+    a dict of numpy arrays with keys
+        id      scene id such as "LC80440272015130LGN00"
+        path    WRS path (uint16)
+        row     WRS row (uint16)
+        date    acquisition time as an int64 of the form YYYYMMDDhhmmss
+        cloud   percent cloud cover (float32)
+        url     amazon url to the scene index.html
+
+    which is saved in the dnppy landsat/metadata folder. The index is reused
+    until it is older than max_age seconds. It is then refreshed with a
+    conditional request, so an unchanged scene list is not downloaded again,
+    and only rows for scenes not already in the index are parsed and added.
+
+    :param max_age:     seconds before a saved index is checked against the server
+    :param refresh:     set True to check the server no matter the index age
+
+    :return index:      dict of numpy arrays as described above
     """
 
+    directory  = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "landsat", "metadata")
+    index_path = os.path.join(directory, "scene_list_index.npz")
+    url        = "http://landsat-pds.s3.amazonaws.com/scene_list.gz"
+
+    index    = None
+    modified = None
+    if os.path.isfile(index_path):
+        with numpy.load(index_path) as saved:
+            index    = dict((key, saved[key]) for key in _scene_index_columns)
+            modified = str(saved["last_modified"])
+
+        if not refresh and time.time() - os.path.getmtime(index_path) < max_age:
+            return index
+
     print("Updating scene list")
-    # define save path for new scene list
-    directory  = site.getsitepackages()[1]
-    gz_path    = "{0}/dnppy/landsat/metadata/scene_list.gz".format(directory)
-    txt_path   = "{0}/dnppy/landsat/metadata/scene_list.txt".format(directory)
-
-    # download then extract the gz file to a txt file.
-    download_url("http://landsat-pds.s3.amazonaws.com/scene_list.gz", gz_path)
-    with gzip.open(gz_path,'rb') as gz:
-        content = gz.read()
-        with open(txt_path, 'wb+') as f:
-            f.writelines(content)
-
-    # build a new text data object from the fresh scene list
-    scene_list_text_data = textio.text_data()
-    scene_list_text_data.read_csv(txt_path, delim = ",", has_headers = True)
-
-    return scene_list_text_data
+    request = urllib2.Request(url)
+    if modified:
+        request.add_header("If-Modified-Since", modified)
+
+    try:
+        connection = urllib2.urlopen(request, timeout = 60)
+    except urllib2.HTTPError as e:
+        if e.code == 304 and index is not None:
+            os.utime(index_path, None)
+            return index
+        raise
+
+    try:
+        modified = connection.info().getheader("Last-Modified", "")
+        known    = set(index["id"]) if index is not None else set()
+        new_rows = _parse_scene_list(connection, known)
+    finally:
+        connection.close()
+
+    new_index = _scene_index_from_rows(new_rows)
+    if index is not None:
+        new_index = dict((key, numpy.concatenate([index[key], new_index[key]]))
+                         for key in _scene_index_columns)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    numpy.savez_compressed(index_path, last_modified = modified, **new_index)
+
+    print("Scene list index holds {0} scenes, {1} new".format(len(new_index["id"]), len(new_rows)))
+    return new_index
+
+
+_scene_index_columns = ["id", "path", "row", "date", "cloud", "url"]
+
+
+def _parse_scene_list(stream, known):
+    """
+    decompresses the gzipped scene list csv from a stream one block at a time,
+    returning (id, path, row, date, cloud, url) tuples for scenes not in known
+    """
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    rows    = []
+    header  = None
+    partial = ""
+
+    while True:
+        block = stream.read(256 * 1024)
+        if block:
+            text = partial + decompressor.decompress(block)
+        else:
+            text = partial + decompressor.flush()
+
+        lines   = text.split("\n")
+        partial = lines.pop() if block else ""
+
+        for line in lines:
+            fields = line.strip().split(",")
+            if len(fields) < 4:
+                continue
+
+            if header is None:
+                header = dict((name, i) for i, name in enumerate(fields))
+                continue
+
+            scene_id = fields[0]
+            if scene_id in known:
+                continue
+
+            # date strings such as "2015-01-01 15:10:20.123" become 20150101151020
+            # by slicing, which is much faster than datetime.strptime.
+            datestring = fields[1]
+            date = int(datestring[0:4] + datestring[5:7] + datestring[8:10] +
+                       datestring[11:13] + datestring[14:16] + datestring[17:19])
+
+            if "path" in header:
+                path = int(fields[header["path"]])
+                row  = int(fields[header["row"]])
+            else:
+                path = int(scene_id[3:6])
+                row  = int(scene_id[6:9])
+
+            rows.append((scene_id, path, row, date, float(fields[2]), fields[-1]))
+
+        if not block:
+            return rows
+
+
+def _scene_index_from_rows(rows):
+    """ turns a list of parsed scene list rows into a dict of numpy column arrays """
+
+    columns = zip(*rows) if rows else [[]] * len(_scene_index_columns)
+    dtypes  = ["S", "uint16", "uint16", "int64", "float32", "S"]
+    return dict((key, numpy.array(column, dtype = dtype))
+                for key, column, dtype in zip(_scene_index_columns, columns, dtypes))
 
 
 if __name__ == "__main__":
@@ -5,16 +5,17 @@ from dnppy import core
 
 from list_ftp import list_ftp
 from list_http_e4ftl01 import list_http_e4ftl01
-from download_url import download_url
+from manifest import download_pending
+from crawl_dates import crawl_dates
 
 import os
-from datetime import datetime
 
 __all__ = ["fetch_MODIS"]
 
 
 def fetch_MODIS(product, version, tiles, outdir, start_dto, end_dto,
-                                                force_overwrite = False):
+                force_overwrite = False, refresh = False, sync = False, threads = 8,
+                verify = False):
     """
     Fetch MODIS Land products from one of two servers. If this function
     runs and downloads 0 files, check that your inputs are consistent
@@ -32,13 +33,19 @@ def fetch_MODIS(product, version, tiles, outdir, start_dto, end_dto,
         start_dto       datetime object, the starting date of the range of data to download
         end_dto         datetime object, the ending date of the range of data to download
         force_overwrite will re-download files even if they already exist
+        refresh         set True to ignore cached server listings (see download.list_cache)
+        sync            set True to only download files which are not recorded as complete
+                        in the download.manifest of outdir. files which are missing or
+                        truncated, or which the server listing shows have changed since,
+                        are downloaded again, everything else is skipped.
+        threads         number of files to download at once
+        verify          set True to also ask the server for the size and modification
+                        time of every complete file in sync mode, one request per file.
 
     outputs:
         out_filepaths   list of filepaths to all files created by this function
     """
 
-    out_filepaths = []
-
     # check formats
     tiles = core.enf_list(tiles)
 
@@ -57,37 +64,35 @@ def fetch_MODIS(product, version, tiles, outdir, start_dto, end_dto,
     else:
         print("Connected to {0}".format(site))
 
-    # Depending on the type of connection (ftp vs http) populate the file list
+    # Depending on the type of connection (ftp vs http) list folders with ftp or http.
+    # how the listing describes each file is kept, so sync can tell what has changed.
+    stamps = {}
+    if isftp:
+        root   = Dir
+        def lister(path):
+            names, paths, sizes = list_ftp(site, False, False, path, refresh = refresh, stats = True)
+            stamps.update(zip(names, sizes))
+            return names
+    else:
+        root   = site
+        def lister(url):
+            rows = list_http_e4ftl01(url, refresh = refresh, stats = True)
+            stamps.update(rows)
+            return [name for name, stamp in rows]
+
+    # list only the date folders which fall within the date range
     try:
-        if isftp:
-            dates,_ = list_ftp(site, False, False, Dir)
-        else:
-            dates   = list_http_e4ftl01(site)
+        folders = crawl_dates(lister, root, "%Y.%m.%d", start_dto, end_dto)
     except:
         raise ValueError("Could not connect to {0}/{1}".format(site,Dir))
 
-    # refine contents down to just addresses of valid year and j_day
-    good_dates = []
-    for date in dates:
-        try:
-            date_dto = datetime.strptime(date, "%Y.%m.%d")
-            if start_dto <= date_dto <= end_dto:
-                good_dates.append(date)
-
-        except:
-            print("skipping non date folder name {0}".format(date))
-
-
-    print('Found {0} days within range'.format(len(good_dates)))
+    print('Found {0} days within range'.format(len(folders)))
 
     # for all folders within the desired date range,  map the subfolder contents.
-    for good_date in good_dates:
-
-        if isftp:
-            files,_ = list_ftp(site, False, False, Dir + '/' + good_date)
-
-        else:
-            files   = list_http_e4ftl01(site + '/' + good_date)
+    jobs    = []
+    listing = {}
+    for date_dto, folder, files in folders:
+        good_date = date_dto.strftime("%Y.%m.%d")
 
         for afile in files:
 
@@ -102,13 +107,14 @@ def fetch_MODIS(product, version, tiles, outdir, start_dto, end_dto,
                         else:
                             address='/'.join([site, good_date, afile])
 
-                        #download the file
                         outname = os.path.join(outdir, afile)
-                        out_filepaths.append(outname)
-                        if not os.path.isfile(outname) and not force_overwrite:
-                            download_url(address, outname)
+                        jobs.append((address, outname))
+                        listing[address] = stamps.get(afile)
 
-                        print('Downloaded {0}'.format(address))
+    # download everything new at once, skipping files which are already complete
+    done, _ = download_pending(jobs, outdir, sync, force_overwrite, threads,
+                               listing = listing, verify = verify)
+    out_filepaths = [outname for address, outname in done]
 
     print("Finished retrieving MODIS - {0} data!".format(product))
     print("Downloaded {0} files".format(len(out_filepaths)))
@@ -1,21 +1,39 @@
 __author__ = 'jwely'
 
-from dnppy import core
-from download_url import download_url
-import os
+from download_url import download_bytes, remote_stat
+from manifest import manifest
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+import threading
+import hashlib
+import urllib2
 import zipfile
+import numpy
+import math
+import os
+
+
+__all__ = ["fetch_SRTM"]
 
-try: import arcpy
-except: pass
 
+# value of void pixels in .hgt tiles, used as nodata in the mosaic
+_hgt_nodata = -32768
 
-def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic = None):
+
+def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic = None,
+               sync = False, threads = 8):
     """
     downloads data from the Shuttle Radar Topography Mission (SRTM)
     [http://e4ftl01.cr.usgs.gov/SRTM/]
 
     This data can be used to create DEMS of a variety of resolutions.
 
+    Tiles are downloaded several at a time straight into memory, and the .hgt file
+    is unzipped from the downloaded bytes and saved, so the zip never touches disk.
+    Each tile is written into the mosaic GeoTIFF with gdal as it arrives, so only
+    one tile is held in memory at a time however large the mosaic, and arcpy is
+    not needed.
+
     Inputs:
         ll_lat          latitude of lower left corner
         ll_lon          longitude of lower left corner
@@ -24,7 +42,12 @@ def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic =
         product         short name of product you want. See link below
                         https://lpdaac.usgs.gov/products/measures_products_table
         outdir          local directory to save downloaded files
-        mosaic          Set to TRUE to mosaic all downloaded DEM tiles.
+        mosaic          Set to TRUE to mosaic all downloaded DEM tiles into
+                        "SRTM_mosaic.tif" in outdir. Not available for SRTMGL30.
+        sync            set True to skip tiles which the download.manifest of outdir
+                        records as already downloaded and extracted, unless the
+                        tile has changed on the server since.
+        threads         number of tiles to download at once
 
     Returns:
         tif_list        a list of all successfully downloaded tif filepaths
@@ -34,19 +57,20 @@ def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic =
     turns out arcmap does some funky things when interpreting these files.
     """
 
-    # build empty return list
-    tif_list = []
+    if outdir is None:
+        outdir = os.getcwd()
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
 
-    # build list of lat/lon pairs from input corners
+    # build list of lat/lon pairs of the tiles covering the input corners. each tile
+    # is named for its lower left corner.
     lat_lon_pairs = []
-    for i in range(int(ll_lat), int(ur_lat + 1) + 1):
-        for j in range(int(ll_lon), int(ur_lon + 1) + 1):
+    for i in range(int(math.floor(ll_lat)), max(int(math.ceil(ur_lat)), int(math.floor(ll_lat)) + 1)):
+        for j in range(int(math.floor(ll_lon)), max(int(math.ceil(ur_lon)), int(math.floor(ll_lon)) + 1)):
             lat_lon_pairs.append((i, j))
 
-    print lat_lon_pairs
-
     # determine product version
-    if product is "SRTMGL30":
+    if product == "SRTMGL30":
         print("Download of product SRTMGL30 is supported, but arcmap does not support this filetype")
         format_string = "{2}{3}{0}{1}.{4}.dem.zip"
         version = "002"
@@ -57,11 +81,11 @@ def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic =
 
 
     host = "http://e4ftl01.cr.usgs.gov/SRTM"
-    subhost = "{0}/{1}.{2}/2000.02.11/".format(host, product, version)
+    subhost = "{0}/{1}.{2}/2000.02.11".format(host, product, version)
 
     print("Connecting to host at {0}".format(subhost))
 
-
+    jobs = []
     for lat_lon_pair in lat_lon_pairs:
         lat, lon = lat_lon_pair
 
@@ -76,7 +100,7 @@ def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic =
         else:
             EW = "W"
 
-        if product is "SRTMGL30":
+        if product == "SRTMGL30":
 
             if abs(lon) <= 20:
                 lon = 20
@@ -103,43 +127,165 @@ def fetch_SRTM(ll_lat, ll_lon, ur_lat, ur_lon, product, outdir = None, mosaic =
                                         product)
 
         filelink = "{0}/{1}".format(subhost, filename)
+        itemname = "{0}{1}{2}{3}.hgt".format(NS, str(abs(lat)).zfill(2),
+                                             EW, str(abs(lon)).zfill(3))
+
+        # several corners share one SRTMGL30 tile
+        if all(job[0] != filelink for job in jobs):
+            jobs.append((filelink, itemname, lat_lon_pair))
+
+    m      = manifest(outdir)
+    canvas = None
+    if mosaic is True and product != "SRTMGL30":
+        canvas = _hgt_canvas(lat_lon_pairs, os.path.join(outdir, "SRTM_mosaic.tif"))
+
+    def fetch_tile(job):
+        filelink, itemname, lat_lon_pair = job
+
+        # tiles skipped by sync were extracted on an earlier run, and are unchanged on the server
+        if sync and m.is_complete(filelink):
+            try:
+                remote_size, remote_mtime = remote_stat(filelink)
+            except Exception:
+                remote_size, remote_mtime = None, None
+
+            if m.is_complete(filelink, remote_size, remote_mtime):
+                paths = [m.local_path(filelink)]
+                if canvas is not None:
+                    with open(paths[0], 'rb') as f:
+                        canvas.add(lat_lon_pair, f.read())
+                return paths
+
+        try:
+            data = download_bytes(filelink)
+        except urllib2.HTTPError as e:
+            # tiles which are entirely ocean were never produced
+            if e.code == 404:
+                print("No tile at {0}".format(filelink))
+                return []
+            raise
+
+        # unzip just the elevation data out of the zip bytes, in memory
+        archive = zipfile.ZipFile(StringIO(data))
+        names   = [name for name in archive.namelist()
+                   if name.lower().endswith((".hgt", ".dem")) or name == itemname]
+
+        paths = []
+        for name in names or archive.namelist():
+            outpath = os.path.join(outdir, os.path.basename(name))
+            member  = archive.read(name)
+            with open(outpath, 'wb') as f:
+                f.write(member)
+            paths.append(outpath)
+
+            if canvas is not None and name.lower().endswith(".hgt"):
+                canvas.add(lat_lon_pair, member)
+
+        m.record(filelink, paths[0], md5 = hashlib.md5(data).hexdigest(), remote_size = len(data))
+        print("Downloaded and extracted {0}".format(os.path.basename(filelink)))
+        return paths
+
+    def fetch_tile_safe(job):
+        try:
+            return fetch_tile(job)
+        except Exception as e:
+            print("Failed to download {0}! {1}".format(job[0], e))
+            return []
+
+    print("Downloading and extracting {0} tiles".format(len(jobs)))
+    pool = ThreadPool(max(1, min(threads, len(jobs))))
+    try:
+        tif_list = sum(pool.map(fetch_tile_safe, jobs), [])
+    finally:
+        pool.close()
+        pool.join()
+        m.save()
+        if canvas is not None:
+            canvas.close()
+
+    if canvas is not None and canvas.count:
+        print("Saved mosaic of {0} tiles to {1}".format(canvas.count, canvas.outpath))
 
-        # decide where to put the file, then download it
-        if outdir is not None:
-            outpath  = os.path.join(outdir, filename)
-        else:
-            outpath = filename
+    print("Finished download and extraction of SRTM data")
 
-        print("Downloading and extracting  {0}".format(filename))
-        download_url(filelink, outpath)
+    return tif_list
 
-        # unzip the file and reassemble descriptive name
-        with zipfile.ZipFile(outpath, "r") as z:
 
-            itemname = "{0}{1}{2}{3}.hgt".format(NS, str(abs(lat)).zfill(2),
-                                                 EW, str(abs(lon)).zfill(3))
-            z.extract(itemname, outdir)
-            z.close()
+class _hgt_canvas(object):
+    """
+    GeoTIFF mosaic of .hgt tiles. hgt files are headerless, square, big endian int16
+    grids whose edge rows and columns overlap their neighbors, so each tile is
+    viewed in place as a ">i2" array and written (byteswapping on the way) into its
+    slot of one GeoTIFF covering every tile. Slots without a tile stay nodata.
+    """
 
-        # clean up and add this file to output list
-        os.remove(outpath)
-        tif_list.append(os.path.join(outdir,itemname))
+    def __init__(self, lat_lon_pairs, outpath):
+        self.min_lat = min(lat for lat, lon in lat_lon_pairs)
+        self.max_lat = max(lat for lat, lon in lat_lon_pairs)
+        self.min_lon = min(lon for lat, lon in lat_lon_pairs)
+        self.max_lon = max(lon for lat, lon in lat_lon_pairs)
+        self.outpath = outpath
+        self.size    = None         # pixels on a side of each tile, 3601 or 1201
+        self.dataset = None
+        self.count   = 0
+        self._lock   = threading.Lock()
 
-    if mosaic is True:
 
-        arcpy.MosaicToNewRaster_management(tif_list, outdir, "SRTM_mosaic.tif",
-                                           number_of_bands = 1, pixel_type = "32_BIT_SIGNED")
+    def add(self, lat_lon_pair, hgt_bytes):
+        """ writes one tile, given as the raw contents of its .hgt file, into the mosaic """
 
-    print("Finished download and extraction of SRTM data")
+        size = int(round(math.sqrt(len(hgt_bytes) / 2)))
+        if size * size * 2 != len(hgt_bytes):
+            raise ValueError("{0} bytes is not a square .hgt tile".format(len(hgt_bytes)))
 
-    return tif_list
+        tile = numpy.frombuffer(hgt_bytes, dtype = ">i2").reshape(size, size).astype(numpy.int16)
+
+        lat, lon = lat_lon_pair
+        row = (self.max_lat - lat) * (size - 1)
+        col = (lon - self.min_lon) * (size - 1)
+
+        # gdal datasets are not thread safe, so tiles are written one at a time.
+        # tiles fill disjoint slots apart from shared edges, which hold the same values
+        with self._lock:
+
+            # the first tile to arrive decides the resolution of the whole mosaic
+            if self.dataset is None:
+                from dnppy.convert.numpy_to_geotiff import _create_geotiff
+
+                self.size = size
+                rows = (self.max_lat - self.min_lat + 1) * (size - 1) + 1
+                cols = (self.max_lon - self.min_lon + 1) * (size - 1) + 1
+                self.dataset = _create_geotiff(self.outpath, rows, cols, 1, numpy.int16,
+                                               self.geotransform(), 4326, _hgt_nodata)
+                self.dataset.GetRasterBand(1).Fill(_hgt_nodata)
+
+            elif size != self.size:
+                raise ValueError("tiles of {0} and {1} pixels can not be mosaicked".format(size, self.size))
+
+            self.dataset.GetRasterBand(1).WriteArray(tile, col, row)
+            self.count += 1
 
 
+    def close(self):
+        """ flushes the mosaic to disk. returns its filepath, or None if no tile was added """
+
+        with self._lock:
+            if self.dataset is None:
+                return None
+            self.dataset.FlushCache()
+            self.dataset = None
+        return self.outpath
+
+
+    def geotransform(self):
+        """ gdal geotransform of the mosaic. hgt pixels are centered on whole degrees """
+
+        res = 1.0 / (self.size - 1)
+        return (self.min_lon - res / 2, res, 0.0, self.max_lat + 1 + res / 2, 0.0, -res)
+
 
 
 if __name__ == "__main__":
 
     testdir = r"D:\dh_dev"
     fetch_SRTM(44, -123, 47, -118, "SRTMGL1", testdir, mosaic = True)
-
-
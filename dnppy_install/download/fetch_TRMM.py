@@ -3,9 +3,9 @@ __author__ = ['jwely']
 # import modules
 from download_url import download_url
 from list_ftp import list_ftp
-from datetime import datetime, timedelta
+from crawl_dates import crawl_dates
+from datetime import datetime
 import os
-import gzip
 
 
 __all__ = ["fetch_TRMM"]
@@ -31,45 +31,29 @@ def fetch_TRMM(start_dto, end_dto, outdir, product_string):
     """
 
     # set up empty structure
-    dates = []
     output_files = []
     ftpsite =  "ftp://pps.gsfc.nasa.gov"
     un      =  "develop.programming14@gmail.com"
 
-    date_delta = end_dto - start_dto
+    # list the year/month/day folders of each date in the range
+    lister  = lambda path: list_ftp(site = ftpsite, dir = path, username = un, password = un)[0]
+    folders = crawl_dates(lister, "trmmdata/ByDate/V07", "%Y/%m/%d", start_dto, end_dto)
 
-    for i in range(date_delta.days +1):
-        dates.append(start_dto + timedelta(days = i))
-
-    for date in dates:
-
-        # navigate to path of desired year/month/day
-        workdir = '/'.join(['trmmdata','ByDate','V07',
-                            str(date.year),
-                            str(date.month).zfill(2),
-                            str(date.day).zfill(2)])
-
-        filenames, filepaths = list_ftp(site = ftpsite,
-                                        dir = workdir,
-                                        username = un,
-                                        password = un)
+    for date, workdir, filenames in folders:
 
         for filename in filenames:
+            filepath = "/".join([ftpsite, workdir, filename])
 
             if product_string in filename:
                 try:
+                    # gz files are decompressed as they arrive, so the .gz is never saved
+                    gunzip  = filename.endswith(".gz")
                     outname = os.path.join(outdir, os.path.basename(filename))
-                    download_url(ftpsite + filename, outname, username = un, password = un)
-                    output_files.append(outname)
-
-                    # now extract it out of its GZ format
-                    with gzip.open(outname, 'rb') as gz:
-                        with open(outname.replace(".gz",""), 'wb') as f:
-                            content = gz.read()
-                            f.write(content)
-
-                    os.remove(outname)
+                    if gunzip:
+                        outname = outname[:-3]
 
+                    download_url(filepath, outname, username = un, password = un, gunzip = gunzip)
+                    output_files.append(outname)
 
                     print("downloaded and extracted {0}".format(os.path.basename(filename)))
                 except:
@@ -3,13 +3,16 @@ __author__ = 'jwely'
 
 from dnppy import core
 from list_http_e4ftl01 import list_http_e4ftl01
-from download_url import download_url
+from manifest import download_pending
+from crawl_dates import crawl_dates
+from datetime import datetime
 import os
 
 __all__ = ["fetch_Landsat_WELD"]
 
 
-def fetch_Landsat_WELD(product, tiles, years, outdir):
+def fetch_Landsat_WELD(product, tiles, years, outdir, refresh = False, sync = False, threads = 8,
+                       verify = False):
 
     """
      Fetch WELD data from the server at [http://e4ftl01.cr.usgs.gov/WELD]
@@ -24,10 +27,19 @@ def fetch_Landsat_WELD(product, tiles, years, outdir):
        tiles       list of tiles to grab such as ['h11v12','h11v11']
        years       list of years to grab such as range(2001,2014)
        outdir      output directory to save downloaded files
+       refresh     set True to ignore cached server listings (see download.list_cache)
+       sync        set True to only download files which are not recorded as complete
+                   in the download.manifest of outdir, or which the server listing shows
+                   have changed since, instead of every file which does not exist yet.
+       threads     number of files to download at once
+       verify      set True to also ask the server for the size and modification time
+                   of every complete file in sync mode, one request per file.
+
+     Returns:
+       out_filepaths   list of filepaths of all files downloaded or already present
     """
 
     # check formats
-    global dates
     tiles = core.enf_list(tiles)
     years = core.enf_list(years)
     years = [str(year) for year in years]
@@ -39,28 +51,33 @@ def fetch_Landsat_WELD(product, tiles, years, outdir):
 
     print '{Fetch_Landsat_WELD} Connecting to servers!'
 
-    # Map the contents of the directory
+    # Map the contents of just the date folders within the desired year range.
     site= 'http://e4ftl01.cr.usgs.gov/WELD/WELD'+product+'.001'
+    start = datetime(min(int(year) for year in years), 1, 1)
+    end   = datetime(max(int(year) for year in years), 12, 31)
+
+    # how the listing describes each file is kept, so sync can tell what has changed
+    stamps = {}
+    def lister(url):
+        rows = list_http_e4ftl01(url, refresh = refresh, stats = True)
+        stamps.update(rows)
+        return [name for name, stamp in rows]
+
     try:
-        dates = list_http_e4ftl01(site)
+        folders = crawl_dates(lister, site, "%Y.%m.%d", start, end)
     except:
         print '{Fetch_Landsat_WELD} Could not connect to site! check inputs!'
+        return
 
-    # find just the folders within the desired year range.
-    good_dates=[]
-    for date in dates:
-        try:
-            y, m, d = date.split(".")
-            if y in years:
-                good_dates.append(date)
-        except: pass
+    folders = [folder for folder in folders if str(folder[0].year) in years]
 
-    print 'Found ' + str(len(good_dates)) + ' days within year range'
+    print 'Found ' + str(len(folders)) + ' days within year range'
 
     # for all folders within the desired date range,  map the subfolder contents.
-    for good_date in good_dates:
-
-        files = list_http_e4ftl01(site+'/'+good_date)
+    jobs    = []
+    listing = {}
+    for date_dto, folder, files in folders:
+        good_date = date_dto.strftime("%Y.%m.%d")
 
         for afile in files:
             # only list files with desired tilenames and not preview jpgs
@@ -70,9 +87,11 @@ def fetch_Landsat_WELD(product, tiles, years, outdir):
 
                         # assemble the address
                         address = '/'.join([site,good_date,afile])
-                        print '{Fetch_Landsat_WELD} Downloading' + address
-
-                        #download the file.
                         outname = os.path.join(outdir,tile,afile)
-                        download_url(address, outname)
-    return
+                        jobs.append((address, outname))
+                        listing[address] = stamps.get(afile)
+
+    # download everything new at once, skipping files which are already complete
+    done, _ = download_pending(jobs, outdir, sync, threads = threads,
+                               listing = listing, verify = verify)
+    return [outname for address, outname in done]
@@ -0,0 +1,177 @@
+__author__ = 'jwely'
+
+import ftplib
+import socket
+import threading
+
+__all__ = ["ftp_pool"]
+
+# errors which mean an ftp session has gone stale and should be replaced
+_dropped_errors = (EOFError, socket.error, ftplib.error_temp, ftplib.error_reply)
+
+
+class ftp_pool(object):
+    """
+    Keeps authenticated ftp sessions alive for reuse.
+
+    Logging in to servers such as the NASA PPS servers can take longer than
+    transferring a small file, so rather than opening, logging in to and quitting
+    a new ftplib.FTP for every listing and every download, sessions are checked out
+    of this pool by (host, username), used, and returned for the next caller.
+    Sessions which have been dropped by the server are replaced transparently.
+
+    All dnppy download functions share one pool, available as ftp_pool.shared.
+
+    Example Usage:
+        from dnppy import download
+        pool = download.ftp_pool.shared
+        with pool.session("pps.gsfc.nasa.gov", user, user) as ftp:
+            ftp.dir("trmmdata")
+    """
+
+    shared = None       # set to the module wide pool below the class definition
+
+
+    def __init__(self, max_idle = 4, timeout = 60):
+        """
+        :param max_idle:    maximum number of idle sessions to keep per (host, username)
+        :param timeout:     socket timeout in seconds for new sessions
+        """
+
+        self.max_idle   = max_idle
+        self.timeout    = timeout
+        self._idle      = {}                # {(host, username): [ftplib.FTP, ...]}
+        self._lock      = threading.Lock()
+
+
+    @staticmethod
+    def _key(host, username):
+        host = host.replace("ftp://", "").split("/")[0]
+        return host, username or None
+
+
+    def _connect(self, host, username, password):
+        """ opens and logs in a new session """
+
+        ftp = ftplib.FTP(host, timeout = self.timeout)
+
+        if username and password:
+            ftp.login(username, password)
+        elif username:
+            ftp.login(username)
+        else:
+            ftp.login()
+
+        # remember the login directory, since reused sessions may have wandered off
+        ftp.home = ftp.pwd()
+        return ftp
+
+
+    def checkout(self, host, username = None, password = None):
+        """
+        returns a logged in ftplib.FTP session in its login directory, reusing an
+        idle session if a live one is available. Return it with checkin when done.
+        """
+
+        key = self._key(host, username)
+
+        while True:
+            with self._lock:
+                idle = self._idle.get(key, [])
+                ftp  = idle.pop() if idle else None
+
+            if ftp is None:
+                return self._connect(key[0], username, password)
+
+            try:
+                ftp.cwd(ftp.home)
+                return ftp
+            except _dropped_errors + (ftplib.error_perm,):
+                self._close(ftp)
+
+
+    def checkin(self, ftp, host, username = None):
+        """ returns a healthy session to the pool for reuse """
+
+        key = self._key(host, username)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(ftp)
+                return
+        self._close(ftp)
+
+
+    def session(self, host, username = None, password = None):
+        """ context manager form of checkout and checkin """
+        return _pooled_session(self, host, username, password)
+
+
+    def call(self, host, username, password, function):
+        """
+        runs function(ftp) on a pooled session and returns its result. If the
+        session turns out to have been dropped by the server, the call is
+        repeated once on a brand new session.
+        """
+
+        for attempt in range(2):
+            ftp = self.checkout(host, username, password)
+            try:
+                result = function(ftp)
+            except _dropped_errors:
+                self._close(ftp)
+                if attempt == 1:
+                    raise
+
+            # permanent errors such as "550 no such directory" leave the session usable
+            except ftplib.error_perm:
+                self.checkin(ftp, host, username)
+                raise
+            except:
+                self._close(ftp)
+                raise
+            else:
+                self.checkin(ftp, host, username)
+                return result
+
+
+    def close_all(self):
+        """ logs out of every idle session """
+
+        with self._lock:
+            sessions   = [ftp for idle in self._idle.values() for ftp in idle]
+            self._idle = {}
+        for ftp in sessions:
+            self._close(ftp)
+
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except:
+            ftp.close()
+
+
+class _pooled_session(object):
+    """ context manager returned by ftp_pool.session """
+
+    def __init__(self, pool, host, username, password):
+        self.pool       = pool
+        self.host       = host
+        self.username   = username
+        self.password   = password
+        self.ftp        = None
+
+    def __enter__(self):
+        self.ftp = self.pool.checkout(self.host, self.username, self.password)
+        return self.ftp
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.pool.checkin(self.ftp, self.host, self.username)
+        else:
+            self.pool._close(self.ftp)
+
+
+ftp_pool.shared = ftp_pool()
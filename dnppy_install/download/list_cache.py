@@ -0,0 +1,154 @@
+__author__ = 'jwely'
+
+import os
+import re
+import json
+import time
+import hashlib
+import calendar
+from datetime import datetime, timedelta
+
+__all__ = ["list_cache"]
+
+
+# patterns for dates in remote folder paths, in the order they are checked.
+#   e4ftl01 style       .../MOD11A1.005/2013.01.05
+#   by date folders     .../trmmdata/ByDate/V07/2013/01/05
+#   year/julian day     .../2013/005
+#   month folders       .../imerg/gis/201301
+_date_patterns = [(re.compile(r"(\d{4})\.(\d{2})\.(\d{2})(?:/|$)"),  "%Y%m%d"),
+                  (re.compile(r"/(\d{4})/(\d{2})/(\d{2})(?:/|$)"),   "%Y%m%d"),
+                  (re.compile(r"/(\d{4})/(\d{3})(?:/|$)"),           "%Y%j"),
+                  (re.compile(r"/(\d{4})(\d{2})(?:/|$)"),            "%Y%m")]
+
+
+class list_cache(object):
+    """
+    An on-disk cache of remote directory listings, keyed by url.
+
+    Most remote data folders never change once they are published, so repeat
+    or incremental fetches do not need to list them again. A cached listing is
+    used until it is older than "ttl" seconds. Listings of folders whose path
+    contains a date more than "immutable_days" in the past are treated as
+    final and never expire.
+
+    All dnppy listing functions share one cache, available as list_cache.shared.
+    Adjust its behavior with, for example
+
+        from dnppy import download
+        download.list_cache.shared.ttl = 600
+        download.list_cache.shared.immutable_days = 30
+
+    or bypass it by passing refresh = True to any listing or fetch function.
+    """
+
+    shared = None       # set to the module wide cache below the class definition
+
+
+    def __init__(self, cache_dir = None, ttl = 3600, immutable_days = 14):
+        """
+        :param cache_dir:       directory to keep cached listings in. defaults to
+                                a ".dnppy/list_cache" folder in the user home directory
+        :param ttl:             seconds a cached listing of a mutable folder stays valid
+        :param immutable_days:  folders dated more than this many days ago never expire.
+                                set to None to expire every listing after ttl.
+        """
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".dnppy", "list_cache")
+
+        self.cache_dir      = cache_dir
+        self.ttl            = ttl
+        self.immutable_days = immutable_days
+
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.md5(url.encode("utf-8")).hexdigest() + ".json")
+
+
+    @staticmethod
+    def folder_date(url):
+        """ returns a datetime for the date in a folder url, or None if it has none """
+
+        for pattern, fmt in _date_patterns:
+            matches = pattern.findall(url)
+            if matches:
+                try:
+                    dto = datetime.strptime("".join(matches[-1]), fmt)
+                except ValueError:
+                    continue
+
+                # a month folder may be added to until its last day
+                if fmt == "%Y%m":
+                    dto = dto.replace(day = calendar.monthrange(dto.year, dto.month)[1])
+                return dto
+        return None
+
+
+    def is_immutable(self, url):
+        """ True if url is a folder dated long enough ago to no longer change """
+
+        if self.immutable_days is None:
+            return False
+
+        dto = self.folder_date(url)
+        return dto is not None and dto + timedelta(days = self.immutable_days) < datetime.now()
+
+
+    def get(self, url):
+        """ returns the cached listing for url, or None if it is missing or expired """
+
+        try:
+            with open(self._path(url), 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if entry.get("url") != url:
+            return None
+
+        if entry.get("immutable") or time.time() - entry["time"] < self.ttl:
+            return entry["listing"]
+        return None
+
+
+    def put(self, url, listing):
+        """ stores a listing (any json serializable object) for url """
+
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                pass
+
+        # an empty listing may be a transient server error, so it always expires
+        entry = {"url":       url,
+                 "time":      time.time(),
+                 "immutable": bool(listing) and self.is_immutable(url),
+                 "listing":   listing}
+
+        # write then rename, so concurrent readers never see half a file
+        path    = self._path(url)
+        tmppath = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with open(tmppath, 'w') as f:
+                json.dump(entry, f)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            pass
+        return
+
+
+    def clear(self):
+        """ deletes every cached listing """
+
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+        return
+
+
+list_cache.shared = list_cache()
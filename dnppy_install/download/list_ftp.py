@@ -1,55 +1,82 @@
 __author__ = 'jwely'
 
-import ftplib
+from ftp_pool import ftp_pool
+from list_cache import list_cache
+from rate_limiter import rate_limiter
 import socket
 
 __all__ = ["list_ftp"]
 
-def list_ftp(site, username = None , password = None, dir = None):
+def list_ftp(site, username = None , password = None, dir = None, refresh = False, stats = False):
     """
     lists contents of typical FTP download site
 
     Returns two lists, the first is of filenames, the second is of full filepaths
     (including filenames) that one could patch through to the "download_url" function.
+    With stats = True a third list is returned, of the size in bytes of each file as
+    listed by the server, or None where the listing does not show it. The size of a
+    file changes when it is republished, see download.manifest.
 
     returns False if the server has rejected our connection
+
+    listings are cached on disk by download.list_cache. set refresh = True
+    to ignore any cached listing and ask the server again.
     """
 
     # ftplib does not like the ftp address out front for some reason
     if "ftp://" in site:
         site = site.replace("ftp://", "")
 
-    try:
-        ftp = ftplib.FTP(site)
-    except EOFError:
-        return [], []
+    if dir is None:
+        dir = ""
+
+    def list_dir(ftp):
+        ftp.cwd(dir)
+        rawdata = []
+        ftp.dir(rawdata.append)
+        return rawdata
 
-    except socket.gaierror:
-        raise Exception("Socket.gaierror indicates this ftp address '{0}' does not exist".format(site))
+    cache_key = "ftp://" + "/".join([site, dir]).replace("//","/")
+    rows      = None if refresh else list_cache.shared.get(cache_key)
 
+    # sessions are reused from the shared pool, so repeat listings skip the login
+    if rows is None:
+        try:
+            rawdata = rate_limiter.shared.call(site,
+                        lambda: ftp_pool.shared.call(site, username, password, list_dir))
+        except EOFError:
+            return ([], [], []) if stats else ([], [])
 
-    if username is not None and password is not None:
-        ftp.login(username, password)
-    elif username is not None:
-        ftp.login(username)
-    else:
-        ftp.login()
+        except socket.gaierror:
+            raise Exception("Socket.gaierror indicates this ftp address '{0}' does not exist".format(site))
 
-    if dir is not None:
-        ftp.cwd(dir)
-    else:
-        ftp.cwd("")
-        dir = ""
+        rows = [[i.split()[-1], _listed_size(i)] for i in rawdata]
 
-    rawdata = []
-    ftp.dir(rawdata.append)
-    filenames = [i.split()[-1] for i in rawdata]
+        # an empty reply may be a transient server error, so it is never cached
+        if rows:
+            list_cache.shared.put(cache_key, rows)
+
+    # listings cached before sizes were kept are lists of names
+    rows = [row if isinstance(row, list) else [row, None] for row in rows]
+
+    filenames = [name for name, size in rows]
     filepaths = ["ftp://"+"/".join([site, dir, afile]).replace("//","/") for afile in filenames]
-    ftp.quit()
 
+    if stats:
+        return filenames, filepaths, [size for name, size in rows]
     return filenames, filepaths
 
 
+def _listed_size(line):
+    """ size in bytes of a unix style "ls -l" line of an ftp listing, or None """
+
+    # -rw-r--r--   1 ftp  ftp  4194304 Jan 05 12:30 MOD10A1.A2015005.h11v05.005.hdf
+    parts = line.split()
+    if len(parts) >= 9 and parts[4].isdigit():
+        return int(parts[4])
+    return None
+
+
 # testin area
 if __name__ == "__main__":
     filenames, filepaths = list_ftp("n5eil01u.ecs.nsidc.org")
@@ -1,22 +1,60 @@
 __author__ = 'jwely'
 
-import urllib
+from list_cache import list_cache
+from rate_limiter import rate_limiter
+import urllib2
+import re
 
 __all__ = ["list_http_e4ftl01"]
 
-def list_http_e4ftl01(site):
+def list_http_e4ftl01(site, refresh = False, stats = False):
     """
     Lists contents of  http download site at [http://e4ftl01.cr.usgs.gov]
     which hosts select MODIS products, landsat WELD, and SRTM data.
+
+    listings are cached on disk by download.list_cache. set refresh = True
+    to ignore any cached listing and ask the server again.
+
+    set stats = True to list (name, stamp) pairs instead of names, where the
+    stamp is the modification time and size the index page shows for the file,
+    such as "2015-01-03 04:12 4.1M", or None if it shows none. The stamp of a
+    file changes when it is republished, see download.manifest.
+
+    raises urllib2.HTTPError if the folder does not exist.
     """
 
-    website = urllib.urlopen(site)
-    string  = website.readlines()
+    rows = None if refresh else list_cache.shared.get(site)
+
+    if rows is None:
+        def read_listing():
+            website = urllib2.urlopen(site)
+            try:
+                return website.readlines()
+            finally:
+                website.close()
+
+        string = rate_limiter.shared.call(site, read_listing)
+
+        rows = []
+        for line in string:
+            try:
+                name = line.replace('/','').split('"')[5]
+            except:
+                continue
+
+            # whatever follows the link is the date and size columns of the index
+            stamp = None
+            if "</a>" in line:
+                stamp = " ".join(re.sub("<[^>]*>", " ", line.split("</a>")[-1]).split()) or None
+            rows.append([name, stamp])
+
+        # an empty reply may be a transient error page, so it is never cached
+        if rows:
+            list_cache.shared.put(site, rows)
+
+    # listings cached before stamps were kept are lists of names
+    rows = [row if isinstance(row, list) else [row, None] for row in rows]
 
-    files = []
-    for line in string:
-        try:
-            files.append(line.replace('/','').split('"')[5])
-        except:
-            pass
-    return files
\ No newline at end of file
+    if stats:
+        return [(name, stamp) for name, stamp in rows]
+    return [name for name, stamp in rows]
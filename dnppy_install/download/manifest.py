@@ -0,0 +1,296 @@
+__author__ = 'jwely'
+
+from download_url import download_url, remote_stat
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+import json
+import os
+
+__all__ = ["manifest"]
+
+
+class manifest(object):
+    """
+    A record of every file completely downloaded into one output directory.
+
+    Each entry is keyed by url and holds the local filepath, its size in bytes,
+    the size and modification time of the file on the server, how the server listing
+    described it, its md5 and when it was downloaded. The manifest is kept as a small json file in the output directory.
+    It is saved every "save_every" new entries and by save(), so an interrupted run
+    loses at most a few entries, whose files are then simply downloaded again.
+
+    A file only counts as complete if it has an entry, still exists, and is still
+    exactly the recorded size, so truncated or partially written files are
+    downloaded again. Given the current size or modification time of the file on
+    the server, or how the server listing describes it now, it is also not complete
+    if the server copy has changed since. The fetch functions use this for their
+    "sync" mode, where only urls which are new or changed according to the manifest
+    and the listings they already pull are downloaded.
+
+    Example Usage:
+        from dnppy import download
+        m = download.manifest(r"E:\MODIS\MOD11A1")
+        m.pending(url_list)         # urls without a complete local copy
+    """
+
+    filename   = "dnppy_manifest.json"
+    save_every = 100
+
+
+    def __init__(self, outdir):
+        """
+        :param outdir:      directory the manifest file is kept in. file paths within
+                            this directory are stored relative to it.
+        """
+
+        self.outdir  = os.path.abspath(outdir)
+        self.path    = os.path.join(self.outdir, self.filename)
+        self.entries = {}
+        self.unsaved = 0
+        self._lock   = threading.Lock()
+
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print("Manifest {0} is unreadable, starting a new one".format(self.path))
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __contains__(self, url):
+        return url in self.entries
+
+
+    def _abspath(self, path):
+        return os.path.normpath(os.path.join(self.outdir, path))
+
+
+    def _relpath(self, path):
+        path = os.path.abspath(path)
+        if path.startswith(self.outdir + os.sep):
+            return os.path.relpath(path, self.outdir)
+        return path
+
+
+    def record(self, url, path, mtime = None, md5 = None, remote_size = None):
+        """
+        records url as completely downloaded to path. The manifest is saved every
+        save_every records, call save() once all files are downloaded.
+
+        :param url:         url the file was downloaded from
+        :param path:        local filepath of the complete file
+        :param mtime:       modification time of the file on the server, in seconds since the epoch
+        :param md5:         md5 hex digest of the file as served
+        :param remote_size: size of the file on the server, if it differs from the local file
+        """
+
+        size  = os.path.getsize(path)
+        entry = {"path":        self._relpath(path),
+                 "size":        size,
+                 "remote_size": size if remote_size is None else remote_size,
+                 "mtime":       mtime,
+                 "md5":         md5,
+                 "downloaded":  time.time()}
+
+        with self._lock:
+            self.entries[url] = entry
+            self.unsaved += 1
+            if self.unsaved >= self.save_every:
+                self._save()
+        return
+
+
+    def relink(self, url, path):
+        """
+        points the entry for url at a different local file, such as a file extracted
+        from the downloaded archive, keeping its remote mtime and md5.
+        """
+
+        with self._lock:
+            entry = self.entries[url]
+            entry.setdefault("remote_size", entry["size"])
+            entry["path"] = self._relpath(path)
+            entry["size"] = os.path.getsize(path)
+            self.unsaved += 1
+        return
+
+
+    def mark_listed(self, url, listed):
+        """
+        records how the server listing describes the file of url, such as its size
+        and modification time as listed, so a later listing shows when it changes.
+        Call it only once the local copy is known to match the server.
+        """
+
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is not None and listed is not None and entry.get("listed") != listed:
+                entry["listed"] = listed
+                self.unsaved += 1
+        return
+
+
+    def local_path(self, url):
+        """ absolute filepath recorded for url, or None if it has no entry """
+
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        return self._abspath(entry["path"])
+
+
+    def is_complete(self, url, remote_size = None, remote_mtime = None, listed = None):
+        """
+        True if url has an entry and its local file still exists at the recorded size.
+        When the current size or modification time of the file on the server, or how
+        the server listing describes it, are given, they must also match the entry, so
+        files republished under the same url are not complete.
+        """
+
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+
+        path = self._abspath(entry["path"])
+        if not (os.path.isfile(path) and os.path.getsize(path) == entry["size"]):
+            return False
+
+        if listed is not None and entry.get("listed") is not None and listed != entry["listed"]:
+            return False
+        if remote_size is not None and remote_size != entry.get("remote_size", entry["size"]):
+            return False
+        if remote_mtime is not None and entry.get("mtime") is not None:
+            return int(remote_mtime) == int(entry["mtime"])
+        return True
+
+
+    def pending(self, urls):
+        """ the urls from a list which do not have a complete local copy """
+        return [url for url in urls if not self.is_complete(url)]
+
+
+    def save(self):
+        """ writes the manifest to disk, if any entries were added since it was last saved """
+
+        with self._lock:
+            if self.unsaved:
+                self._save()
+        return
+
+
+    def _save(self):
+        """ writes the manifest, then renames it into place so it is never half written """
+
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+
+        tmppath = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmppath, 'w') as f:
+            json.dump(self.entries, f, indent = 1, sort_keys = True)
+
+        # windows will not rename over an existing file
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmppath, self.path)
+        self.unsaved = 0
+
+
+def download_pending(jobs, outdir, sync = False, force_overwrite = False, threads = 8,
+                     username = None, password = None, listing = None, verify = False):
+    """
+    downloads a list of (url, outname) jobs several at a time, skipping any which
+    are already done, and records each completed file in the manifest of outdir.
+
+    A job is skipped when force_overwrite is False and
+        sync is True    and the manifest says the url is complete, and the server
+                        listing still describes the file as it did when it was
+                        downloaded
+        sync is False   and a file already exists at outname
+
+    In sync mode no requests are made for files the listing describes, so a run
+    with nothing new only costs the listings. Files without a listing stamp, or
+    every file when verify is True, are checked with one request each for their
+    size and modification time on the server instead.
+
+    :param listing:     dict of {url : stamp} of how the server listing describes each
+                        file, such as the size or modification time it shows. any json
+                        value which changes when the file is republished will do.
+    :param verify:      set True to check every complete file on the server in sync mode
+
+    :return done:       list of (url, outname) for every job which was skipped or
+                        downloaded successfully, in the order of jobs.
+    :return m:          the manifest of outdir
+    """
+
+    m = manifest(outdir)
+    if listing is None:
+        listing = {}
+
+    def stat(job):
+        try:
+            return remote_stat(job[0], username, password)
+        except Exception as e:
+            print("Could not check {0} on the server, keeping the local copy! {1}".format(job[0], e))
+            return None, None
+
+    def fetch(job):
+        url, outname = job
+        try:
+            download_url(url, outname, username = username, password = password, manifest = m)
+            print("Downloaded {0}".format(url))
+            return True
+        except Exception as e:
+            print("Failed to download {0}! {1}".format(url, e))
+            return False
+
+    pool    = ThreadPool(max(1, min(threads, len(jobs))))
+    failed  = set()
+    current = set()
+    try:
+        if force_overwrite:
+            todo = list(jobs)
+
+        # local copies are checked against the listing, or the server where the
+        # listing does not say, so files republished under the same url are downloaded again
+        elif sync:
+            local   = [job for job in jobs if m.is_complete(job[0])]
+            checks  = [job for job in local if verify or listing.get(job[0]) is None]
+            if checks:
+                print("Checking {0} files on the server".format(len(checks)))
+            stats   = dict(zip(checks, pool.map(stat, checks)))
+
+            for job in local:
+                size, mtime = stats.get(job, (None, None))
+                if m.is_complete(job[0], size, mtime, listing.get(job[0])):
+                    current.add(job)
+
+            todo = [job for job in jobs if job not in current]
+            if len(current) < len(local):
+                print("{0} files have changed on the server".format(len(local) - len(current)))
+
+        else:
+            todo = [(url, outname) for url, outname in jobs if not os.path.isfile(outname)]
+
+        print("{0} of {1} files need to be downloaded".format(len(todo), len(jobs)))
+
+        for job, success in zip(todo, pool.map(fetch, todo)):
+            if not success:
+                failed.add(job)
+            else:
+                current.add(job)
+    finally:
+        pool.close()
+        pool.join()
+
+        # only files known to match the server take on the stamp of the listing
+        for url, outname in current:
+            m.mark_listed(url, listing.get(url))
+        m.save()
+
+    done = [job for job in jobs if job not in failed]
+    return done, m
@@ -0,0 +1,243 @@
+__author__ = 'jwely'
+
+import email.utils
+import threading
+import urllib2
+import random
+import socket
+import ftplib
+import time
+
+__all__ = ["rate_limiter"]
+
+
+class rate_limiter(object):
+    """
+    Adaptive per-host request scheduler shared by every dnppy download function.
+
+    Each server host gets a token bucket, which caps how many requests per second
+    are started, and a concurrency limit, which caps how many requests are open at
+    once. The concurrency limit adapts the same way TCP does (AIMD): it grows by
+    about one every time a full round of requests succeeds, and is cut in half
+    when the server pushes back with an http 429 or 5xx, an ftp 4xx or a timeout.
+    A "Retry-After" header pauses every request to that host for as long as the
+    server asks. Transfers therefore settle at about the fastest rate a server
+    such as e4ftl01 or PPS will sustain, without getting our address banned.
+
+    All dnppy download functions share one limiter, available as rate_limiter.shared.
+    Adjust its behavior with, for example
+
+        from dnppy import download
+        download.rate_limiter.shared.rate = 2.0
+        download.rate_limiter.shared.max_limit = 4
+    """
+
+    shared = None       # set to the module wide limiter below the class definition
+
+
+    def __init__(self, rate = 10.0, burst = 10, start_limit = 4, min_limit = 1,
+                 max_limit = 16, retries = 3, backoff = 2.0, max_wait = 600):
+        """
+        :param rate:            requests per second allowed to start for each host
+        :param burst:           number of requests which may start at once after a quiet spell
+        :param start_limit:     simultaneous requests allowed to a host before any feedback
+        :param min_limit:       the concurrency limit is never cut below this
+        :param max_limit:       the concurrency limit never grows above this
+        :param retries:         default number of times "call" retries a failed request
+        :param backoff:         seconds to wait before the first retry when the server does
+                                not say how long to wait. doubles for each retry.
+        :param max_wait:        longest wait in seconds honored for any single retry
+        """
+
+        self.rate           = rate
+        self.burst          = burst
+        self.start_limit    = start_limit
+        self.min_limit      = min_limit
+        self.max_limit      = max_limit
+        self.retries        = retries
+        self.backoff        = backoff
+        self.max_wait       = max_wait
+        self._hosts         = {}
+        self._lock          = threading.Lock()
+
+
+    @staticmethod
+    def _key(url):
+        """ host name of a url, or of a bare ftp site name such as "pps.gsfc.nasa.gov" """
+
+        if "://" in url:
+            url = url.split("://", 1)[1]
+        return url.split("/")[0].lower()
+
+
+    def _host(self, url):
+        key = self._key(url)
+        with self._lock:
+            if key not in self._hosts:
+                self._hosts[key] = _host_state(self.burst, self.start_limit)
+            return self._hosts[key]
+
+
+    def limit(self, url):
+        """ the current concurrency limit for the host of url """
+        return int(self._host(url).limit)
+
+
+    def acquire(self, url):
+        """
+        blocks until a request to the host of url may start. Every acquire
+        must be followed by exactly one release.
+        """
+
+        host = self._host(url)
+        with host.cond:
+            while True:
+                now = time.time()
+                host.tokens = min(self.burst, host.tokens + (now - host.stamp) * self.rate)
+                host.stamp  = now
+
+                if now < host.paused_until:
+                    wait = host.paused_until - now
+                elif host.active >= int(host.limit):
+                    wait = None                             # until a release
+                elif host.tokens < 1:
+                    wait = (1 - host.tokens) / self.rate
+                else:
+                    host.tokens -= 1
+                    host.active += 1
+                    return
+
+                host.cond.wait(wait)
+
+
+    def release(self, url, throttled = False, retry_after = None):
+        """
+        marks a request to the host of url as finished.
+
+        :param throttled:       True if the server pushed back on the request
+        :param retry_after:     seconds the server asked us to wait before trying again
+        """
+
+        host = self._host(url)
+        with host.cond:
+            now = time.time()
+            host.active -= 1
+
+            if throttled:
+                # all the requests in flight when a server pushes back tend to fail
+                # together, so the limit is only cut once per round trip of requests
+                if now - host.last_cut > min(host.round_trip, 10.0):
+                    host.limit    = max(self.min_limit, host.limit / 2.0)
+                    host.last_cut = now
+                if retry_after:
+                    host.paused_until = max(host.paused_until, now + min(retry_after, self.max_wait))
+            else:
+                host.limit = min(self.max_limit, host.limit + 1.0 / host.limit)
+
+            host.cond.notify_all()
+
+
+    def call(self, url, function, retries = None):
+        """
+        runs function() as a request to the host of url and returns its result.
+        Failed requests are retried up to "retries" times, waiting as long as the
+        server asks or for an exponentially growing and randomly jittered number
+        of seconds. Errors which will not go away by trying again, such as an http
+        404 or an ftp 550, are raised right away.
+        """
+
+        if retries is None:
+            retries = self.retries
+        name = url.split("/")[-1] or url
+
+        for attempt in range(retries + 1):
+            self.acquire(url)
+            start = time.time()
+            kind, retry_after = None, None
+
+            # the slot is released whatever happens, even on KeyboardInterrupt
+            try:
+                result = function()
+                self._host(url).round_trip = time.time() - start
+                return result
+            except Exception as e:
+                kind, retry_after = _classify(e)
+                if kind == "permanent" or attempt == retries:
+                    raise
+                error = e
+            finally:
+                self.release(url, throttled = kind == "throttled", retry_after = retry_after)
+
+            # a Retry-After pauses the whole host inside acquire, otherwise only this url waits
+            if not retry_after:
+                wait = min(self.max_wait, self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                print("{0} will be retried in {1:.1f}s! {2}".format(name, wait, error))
+                time.sleep(wait)
+            else:
+                print("{0} will be retried in {1:.1f}s! {2}".format(name, retry_after, error))
+
+
+    def reset(self):
+        """ forgets everything learned about every host """
+
+        with self._lock:
+            self._hosts = {}
+
+
+class _host_state(object):
+    """ token bucket and concurrency limit for a single host """
+
+    def __init__(self, burst, limit):
+        self.cond           = threading.Condition()
+        self.tokens         = float(burst)
+        self.stamp          = time.time()
+        self.limit          = float(limit)
+        self.active         = 0
+        self.paused_until   = 0.0
+        self.last_cut       = 0.0
+        self.round_trip     = 1.0
+
+
+def _classify(error):
+    """
+    sorts an exception into "throttled" (the server wants us to slow down),
+    "permanent" (retrying will not help) or "transient" (worth another try).
+    Also returns the seconds to wait from any "Retry-After" header, or None.
+    """
+
+    if isinstance(error, urllib2.HTTPError):
+        retry_after = _retry_after(error.info().getheader("Retry-After") if error.info() else None)
+
+        if error.code in (408, 429) or error.code >= 500:
+            return "throttled", retry_after
+        return "permanent", retry_after
+
+    if isinstance(error, urllib2.URLError) and isinstance(error.reason, socket.timeout):
+        return "throttled", None
+
+    if isinstance(error, (socket.timeout, ftplib.error_temp)):
+        return "throttled", None
+
+    if isinstance(error, ftplib.error_perm):
+        return "permanent", None
+
+    return "transient", None
+
+
+def _retry_after(value):
+    """ seconds to wait from a Retry-After header, given either in seconds or as an http date """
+
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed:
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+    return None
+
+
+rate_limiter.shared = rate_limiter()
@@ -25,4 +25,9 @@ from surface_reflectance import *
 from surface_temp import *
 from toa_radiance import *
 from toa_reflectance import *
+from toa_numpy import *
+from qa_bits import *
+from acca import *
+from process_scene import *
+from surface_temp_numpy import *
 from fetch_test_data import *
@@ -0,0 +1,154 @@
+"""
+block by block raster reading and writing with gdal, used by the numpy functions
+of the landsat module so that whole scenes never need to be held in memory.
+"""
+
+__author__ = ["Jeffry Ely, jeff.ely.08@gmail.com"]
+
+from dnppy import convert
+from dnppy import core
+from dnppy.convert.numpy_to_geotiff import _create_geotiff
+from grab_meta import _is_archive
+import numpy
+import gdal
+import os
+
+
+# default nodata value of outputs written by _block_writer
+_nodata = -9999
+
+
+class _block_reader(object):
+    """
+    reads several single band rasters of the same size in blocks of whole rows,
+    such as all the bands of one landsat scene.
+    """
+
+    def __init__(self, paths):
+        """
+        :param paths:   dict of {key : filepath}, keys are used to ask for blocks
+        """
+
+        self.paths    = paths
+        self.datasets = {}
+
+        for key, path in paths.items():
+            dataset = gdal.Open(path)
+            if dataset is None:
+                raise Exception("gdal could not open {0}".format(path))
+            self.datasets[key] = dataset
+
+        first = self.datasets[list(paths)[0]]
+        self.rows         = first.RasterYSize
+        self.cols         = first.RasterXSize
+        self.geotransform = first.GetGeoTransform()
+        self.projection   = first.GetProjection()
+
+        for key, dataset in self.datasets.items():
+            if (dataset.RasterYSize, dataset.RasterXSize) != (self.rows, self.cols):
+                raise Exception("{0} is not the same size as the other bands".format(paths[key]))
+
+
+    def blocks(self, block_rows = 512):
+        """ yields (first row, number of rows) of each block, top to bottom """
+
+        for row in range(0, self.rows, block_rows):
+            yield row, min(block_rows, self.rows - row)
+
+
+    def read(self, key, row, nrows):
+        """ numpy array of rows [row, row + nrows) of one raster """
+
+        return self.datasets[key].GetRasterBand(1).ReadAsArray(0, row, self.cols, nrows)
+
+
+    def close(self):
+        self.datasets = {}
+
+
+class _block_writer(object):
+    """
+    writes a float array to a GeoTIFF in blocks of whole rows. NaN values are
+    written as nodata, and outputs may be saved as int16 scaled by int16_scale.
+    """
+
+    def __init__(self, outpath, like, dtype = "float32", int16_scale = None, nodata = _nodata):
+        """
+        :param outpath:         filepath of the output tif
+        :param like:            _block_reader with the size and georeferencing of the output
+        :param dtype:           numpy data type of the output, when int16_scale is None
+        :param int16_scale:     multiply values by int16_scale and save them as int16,
+                                such as 10000 for reflectance, to halve the output size
+        :param nodata:          value written in place of NaN
+        """
+
+        self.outpath     = outpath
+        self.int16_scale = int16_scale
+        self.nodata      = nodata
+        self.dtype       = numpy.dtype("int16" if int16_scale else dtype)
+
+        self.dataset = _create_geotiff(outpath, like.rows, like.cols, 1, self.dtype,
+                                       like.geotransform, like.projection, nodata)
+        self.band    = self.dataset.GetRasterBand(1)
+
+
+    def write(self, row, array):
+        """ writes a block of rows starting at row. array is left unchanged """
+
+        nodata = numpy.isnan(array) if array.dtype.kind == "f" else None
+
+        if self.int16_scale:
+            array = numpy.round(array * self.int16_scale)
+            numpy.clip(array, -32767, 32767, out = array)
+
+        out = array.astype(self.dtype)
+        if nodata is not None:
+            out[nodata] = self.nodata
+        self.band.WriteArray(out, 0, row)
+
+
+    def close(self):
+        self.dataset.FlushCache()
+        self.band    = None
+        self.dataset = None
+        return self.outpath
+
+
+def _band_filename(meta, band_num):
+    """ file name of a band, as listed in the MTL file """
+
+    band_num = str(band_num)
+    if band_num in ["QA", "BQA"]:
+        return getattr(meta, "FILE_NAME_BAND_QUALITY", getattr(meta, "FILE_NAME_QUALITY_L1_PIXEL", None))
+
+    return getattr(meta, "FILE_NAME_BAND_{0}".format(band_num),
+                   getattr(meta, "BAND{0}_FILE_NAME".format(band_num), None))
+
+
+def _band_path(meta, band_num):
+    """
+    filepath of a band of the scene an MTL file describes, from the file names it
+    lists. Bands inside of archives get GDAL virtual paths.
+    """
+
+    mtl_path = meta.FILEPATH
+    filename = _band_filename(meta, band_num)
+
+    if _is_archive(mtl_path):
+        return convert.tar_member_path(mtl_path, filename)
+
+    if filename is None:
+        return mtl_path.replace("MTL.txt", "B{0}.tif".format(band_num))
+    return os.path.join(os.path.dirname(os.path.abspath(mtl_path)), filename)
+
+
+def _outname(meta, band_num, suffix, outdir = False):
+    """ output filepath for a band product, beside the MTL file unless outdir is given """
+
+    if outdir:
+        folder = os.path.abspath(outdir)
+    else:
+        folder = os.path.dirname(os.path.abspath(meta.FILEPATH))
+
+    filename = _band_filename(meta, band_num) or "{0}_B{1}".format(meta.LANDSAT_SCENE_ID, band_num)
+    return core.create_outname(folder, os.path.basename(filename), suffix, "tif")
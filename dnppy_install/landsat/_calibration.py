@@ -0,0 +1,155 @@
+"""
+radiometric calibration coefficients of landsat bands, gathered once from the MTL
+metadata, and numpy conversions of digital numbers with them.
+"""
+
+__author__ = ["Jeffry Ely, jeff.ely.08@gmail.com"]
+
+import numpy
+import math
+
+
+# solar exoatmospheric irradiances of the reflective TM and ETM+ bands, by band number
+_esun = {"LANDSAT_4": {"1": 1957.0, "2": 1825.0, "3": 1557.0, "4": 1033.0, "5": 214.9, "7": 80.72},
+         "LANDSAT_5": {"1": 1957.0, "2": 1826.0, "3": 1554.0, "4": 1036.0, "5": 215.0, "7": 80.67},
+         "LANDSAT_7": {"1": 1969.0, "2": 1840.0, "3": 1551.0, "4": 1044.0, "5": 255.700,
+                       "7": 82.07, "8": 1368.00}}
+
+# thermal conversion constants (K1, K2) of the TM and ETM+ thermal bands
+_thermal_k = {"LANDSAT_4": (607.76, 1260.56),
+              "LANDSAT_5": (607.76, 1260.56),
+              "LANDSAT_7": (666.09, 1282.71)}
+
+_oli_bands  = ["1", "2", "3", "4", "5", "6", "7", "8", "9"]
+_tirs_bands = ["10", "11"]
+_tm_bands   = ["1", "2", "3", "4", "5", "7", "8"]
+
+
+class _band_calibration(object):
+    """
+    the radiance, reflectance and brightness temperature coefficients of one band.
+    Digital numbers of 0 are fill, and convert to NaN.
+
+    Every conversion is a function of the digital number alone, so convert() can
+    instead look each pixel up in a table of the conversion of every possible
+    uint8 or uint16 digital number, built once per band and kind of conversion.
+    """
+
+    def __init__(self, meta, band_num):
+
+        self.band_num   = str(band_num)
+        self.spacecraft = meta.SPACECRAFT_ID
+        self.rad_gain, self.rad_bias = _radiance_coefficients(meta, self.band_num)
+
+        # reflectance of landsat 8 comes from the MTL, for the others from radiance
+        self.ref_gain = self.ref_bias = None
+        if self.spacecraft == "LANDSAT_8":
+            if self.band_num in _oli_bands:
+                sin_sea = math.sin(meta.SUN_ELEVATION * math.pi / 180)
+                self.ref_gain = getattr(meta, "REFLECTANCE_MULT_BAND_{0}".format(self.band_num)) / sin_sea
+                self.ref_bias = getattr(meta, "REFLECTANCE_ADD_BAND_{0}".format(self.band_num)) / sin_sea
+
+        elif self.band_num in _esun.get(self.spacecraft, {}):
+            esun   = _esun[self.spacecraft][self.band_num]
+            cos_sz = math.cos((90.0 - meta.SUN_ELEVATION) * math.pi / 180)
+            factor = math.pi * meta.EARTH_SUN_DISTANCE ** 2 / (esun * cos_sz)
+            self.ref_gain = self.rad_gain * factor
+            self.ref_bias = self.rad_bias * factor
+
+        # thermal constants
+        self.K1 = self.K2 = None
+        if self.band_num in _tirs_bands:
+            self.K1 = getattr(meta, "K1_CONSTANT_BAND_{0}".format(self.band_num))
+            self.K2 = getattr(meta, "K2_CONSTANT_BAND_{0}".format(self.band_num))
+        elif self.band_num.startswith("6") and self.spacecraft in _thermal_k:
+            self.K1, self.K2 = _thermal_k[self.spacecraft]
+
+        self._luts = {}
+
+
+    def radiance(self, dn):
+        """ float32 top of atmosphere radiance of an array of digital numbers """
+        return _linear(dn, self.rad_gain, self.rad_bias)
+
+
+    def reflectance(self, dn):
+        """ float32 top of atmosphere reflectance of an array of digital numbers """
+
+        if self.ref_gain is None:
+            raise Exception("Band {0} of {1} is not a reflective band".format(self.band_num, self.spacecraft))
+        return _linear(dn, self.ref_gain, self.ref_bias)
+
+
+    def bright_temp(self, dn):
+        """ float32 at satellite brightness temperature in Kelvin of an array of digital numbers """
+
+        if self.K1 is None:
+            raise Exception("Band {0} of {1} is not a thermal band".format(self.band_num, self.spacecraft))
+
+        # K2 / ln(K1 / L + 1), computed in place
+        out = self.radiance(dn)
+        numpy.divide(self.K1, out, out)
+        out += 1
+        numpy.log(out, out)
+        numpy.divide(self.K2, out, out)
+        return out
+
+
+    def lut(self, kind, dtype = "uint16"):
+        """
+        float32 lookup table of a conversion ("radiance", "reflectance" or "bright_temp")
+        of every digital number of an unsigned integer dtype, 65536 entries for uint16.
+        """
+
+        size = numpy.iinfo(dtype).max + 1
+        if (kind, size) not in self._luts:
+            with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                self._luts[(kind, size)] = getattr(self, kind)(numpy.arange(size, dtype = dtype))
+        return self._luts[(kind, size)]
+
+
+    def convert(self, kind, dn, lut = True):
+        """
+        float32 conversion ("radiance", "reflectance" or "bright_temp") of an array of
+        digital numbers, with one numpy.take from a lookup table when lut is True and
+        the digital numbers are uint8 or uint16.
+        """
+
+        if lut and dn.dtype in (numpy.uint8, numpy.uint16):
+            return numpy.take(self.lut(kind, dn.dtype), dn)
+        return getattr(self, kind)(dn)
+
+
+def _radiance_coefficients(meta, band_num):
+    """
+    (gain, bias) of radiance from digital numbers. The August 29, 2012 change of the
+    4/5/7 MTL format is detected from the metadata already read, rather than the text.
+    """
+
+    if meta.SPACECRAFT_ID == "LANDSAT_8":
+        return (getattr(meta, "RADIANCE_MULT_BAND_{0}".format(band_num)),
+                getattr(meta, "RADIANCE_ADD_BAND_{0}".format(band_num)))
+
+    if hasattr(meta, "PRODUCT_CREATION_TIME"):
+        LMax    = getattr(meta, "LMAX_BAND{0}".format(band_num))
+        LMin    = getattr(meta, "LMIN_BAND{0}".format(band_num))
+        QCalMax = getattr(meta, "QCALMAX_BAND{0}".format(band_num))
+        QCalMin = getattr(meta, "QCALMIN_BAND{0}".format(band_num))
+    else:
+        LMax    = getattr(meta, "RADIANCE_MAXIMUM_BAND_{0}".format(band_num))
+        LMin    = getattr(meta, "RADIANCE_MINIMUM_BAND_{0}".format(band_num))
+        QCalMax = getattr(meta, "QUANTIZE_CAL_MAX_BAND_{0}".format(band_num))
+        QCalMin = getattr(meta, "QUANTIZE_CAL_MIN_BAND_{0}".format(band_num))
+
+    gain = (LMax - LMin) / (QCalMax - QCalMin)
+    return gain, LMin - gain * QCalMin
+
+
+def _linear(dn, gain, bias):
+    """ float32 gain * dn + bias, computed in place, with NaN where dn is 0 """
+
+    out = dn.astype(numpy.float32)
+    out *= numpy.float32(gain)
+    out += numpy.float32(bias)
+    out[dn == 0] = numpy.nan
+    return out
@@ -0,0 +1,308 @@
+#standard imports
+from _blocks import _block_reader, _block_writer
+from dnppy import core
+import numpy
+import os
+
+__all__=['make_cloud_mask_457_numpy']
+
+
+# classes of pixels after the first pass of the filters
+_clear = 0
+_cold  = 1      # cold cloud
+_warm  = 2      # warm cloud
+_amb   = 3      # ambiguous
+
+# temperature histograms have bins of 0.01 Kelvin from 100 to 400 Kelvin
+_hist_min   = 100.0
+_hist_width = 0.01
+_hist_bins  = 30000
+
+
+def make_cloud_mask_457_numpy(B2_TOA_Ref, outdir = False, Filter5Thresh = 2.0, Filter6Thresh = 2.0,
+                              block_rows = 512):
+    """
+    Creates a binary mask raster for removal of cloud-covered pixels in raw Landsat 4, 5, and 7 bands,
+    with the same ACCA filters as make_cloud_mask_457, but with numpy and gdal instead of arcpy.
+
+    Bands are read a block of rows at a time. The first pass evaluates all of the filters and
+    gathers the scene statistics, including histograms of cloud and ambiguous pixel temperatures
+    from which the percentiles and skew are taken, so no temporary files are written. The second
+    pass applies the thresholds and writes the mask.
+
+    Inputs are the same as those of make_cloud_mask_457, bands 2, 3, 4, and 5 processed with
+    toa_reflectance_457 (or toa_reflectance_numpy) and band 6 with atsat_bright_temp_457 (or
+    atsat_bright_temp_numpy), all in the same folder.
+
+    Inputs:
+      B2_TOA_Ref        The full filepath to the band 2 top-of-atmosphere reflectance tiff file
+      outdir            Output directory to the cloud mask
+      Filter5Thresh     Optional threshold value for Filter #5, default set at 2
+      Filter6Thresh     Optional threshold value for Filter #6, default set at 2
+      block_rows        number of rows to read at once
+
+    Returns:
+      outname           filepath to the cloud mask, 1 = good data and 0 = cloud
+    """
+
+    B2_path = os.path.abspath(B2_TOA_Ref)
+    name    = os.path.basename(B2_path)
+
+    #discern if Landsat 4/5 or 7 for band 6
+    if "LE7" in name:
+        band_6 = "6_VCID_1"
+    else:
+        band_6 = "6"
+
+    paths = {"2": B2_path}
+    for band_num in ["3", "4", "5"]:
+        paths[band_num] = B2_path.replace("B2_TOA_Ref.tif", "B{0}_TOA_Ref.tif".format(band_num))
+    paths["6"] = B2_path.replace("B2_TOA_Ref.tif", "B{0}_ASBTemp.tif".format(band_6))
+
+    if outdir:
+        folder = os.path.abspath(outdir)
+    else:
+        folder = os.path.dirname(B2_path)
+    outname = core.create_outname(folder, name.replace("_B2_TOA_Ref.tif", ""), "Mask", "tif")
+
+    reader = _block_reader(paths)
+    acca   = _acca(Filter5Thresh, Filter6Thresh)
+
+    print("First pass underway")
+    for row, nrows in reader.blocks(block_rows):
+        acca.accumulate(*[reader.read(band, row, nrows) for band in ["2", "3", "4", "5", "6"]])
+    acca.solve()
+
+    writer = _block_writer(outname, reader, dtype = "uint8", nodata = 255)
+    for row, nrows in reader.blocks(block_rows):
+        writer.write(row, acca.mask(*[reader.read(band, row, nrows) for band in ["2", "3", "4", "5", "6"]]))
+
+    reader.close()
+    print("Cloud mask saved at {0}".format(outname))
+    return writer.close()
+
+
+class _acca(object):
+    """
+    The Automated Cloud Cover Assessment of make_cloud_mask_457, over blocks of TOA
+    reflectance of bands 2, 3, 4, 5 and brightness temperature of band 6. Blocks of a
+    whole scene are given to accumulate(), then solve() works out the second pass
+    thresholds, then mask() gives the cloud mask of each block.
+    """
+
+    def __init__(self, Filter5Thresh = 2.0, Filter6Thresh = 2.0):
+
+        self.Filter5Thresh = Filter5Thresh
+        self.Filter6Thresh = Filter6Thresh
+
+        # pixel counts of the first pass
+        self.data   = 0
+        self.desert = 0
+        self.snow   = 0
+
+        # temperature histograms of each class, by number and by summed temperature
+        self.counts = dict((c, numpy.zeros(_hist_bins, dtype = numpy.int64)) for c in [_cold, _warm, _amb])
+        self.sums   = dict((c, numpy.zeros(_hist_bins, dtype = numpy.float64)) for c in [_cold, _warm, _amb])
+
+        # sums of powers of cloud temperatures less 250 Kelvin, for the mean, std and skew
+        self.moments = dict((c, numpy.zeros(4, dtype = numpy.float64)) for c in [_cold, _warm])
+
+        self.solved = False
+
+
+    def classify(self, Band2, Band3, Band4, Band5, Band6):
+        """ (classes, data, desert, snow) arrays of the first pass filters of one block """
+
+        Band2, Band3, Band4, Band5, Band6 = [numpy.asarray(b, dtype = numpy.float32)
+                                             for b in [Band2, Band3, Band4, Band5, Band6]]
+
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+
+            #Establishing location of gaps in data
+            data = (Band2 > 0) & (Band3 > 0) & (Band4 > 0) & (Band5 > 0) & (Band6 > 0)
+
+            #Filter 1 - Brightness Threshold
+            Cloudmask = (Band3 > .08) & data
+
+            #Filter 2 - Normalized Snow Difference Index
+            NDSI = (Band2 - Band5) / (Band2 + Band5)
+            Snow = (NDSI > .6) & Cloudmask
+            Cloudmask &= NDSI < .6
+            del NDSI
+
+            #Filter 3 - Temperature Threshold
+            Cloudmask &= Band6 < 300
+
+            #Filter 4 - Band 5/6 Composite
+            Composite = (1 - Band5) * Band6
+            Cloudmask &= Composite < 225
+            Amb = (Composite > 225) & data
+
+            #Filter 5 - Band 4/3 Ratio (eliminates vegetation)
+            Ratio = Band4 / Band3
+            Cloudmask &= Ratio < self.Filter5Thresh
+            Amb &= Ratio > self.Filter5Thresh
+
+            #Filter 6 - Band 4/2 Ratio (eliminates vegetation)
+            numpy.divide(Band4, Band2, Ratio)
+            Cloudmask &= Ratio < self.Filter6Thresh
+            Amb &= Ratio > self.Filter6Thresh
+
+            #Filter 7 - Band 4/5 Ratio (Eliminates desert features)
+            numpy.divide(Band4, Band5, Ratio)
+            Desert = (Ratio > 1.0) & data
+            Cloudmask &= Desert
+            Amb &= Ratio < 1.0
+
+            #Filter 8  Band 5/6 Composite (Seperates warm and cold clouds)
+            classes = numpy.zeros(Band6.shape, dtype = numpy.uint8)
+            classes[Amb] = _amb
+            classes[Cloudmask & (Composite < 210)] = _cold
+            classes[Cloudmask & (Composite >= 210)] = _warm
+
+        return classes, data, Desert, Snow
+
+
+    def accumulate(self, Band2, Band3, Band4, Band5, Band6):
+        """ first pass over one block, gathering the statistics of the scene """
+
+        classes, data, desert, snow = self.classify(Band2, Band3, Band4, Band5, Band6)
+
+        self.data   += numpy.count_nonzero(data)
+        self.desert += numpy.count_nonzero(desert)
+        self.snow   += numpy.count_nonzero(snow)
+
+        for c in [_cold, _warm, _amb]:
+            temps = numpy.asarray(Band6, dtype = numpy.float64)[classes == c]
+            if temps.size == 0:
+                continue
+
+            bins = numpy.clip(((temps - _hist_min) / _hist_width).astype(numpy.int64), 0, _hist_bins - 1)
+            self.counts[c] += numpy.bincount(bins, minlength = _hist_bins)
+            self.sums[c]   += numpy.bincount(bins, weights = temps, minlength = _hist_bins)
+
+            if c in self.moments:
+                temps -= 250.0
+                self.moments[c] += [temps.size, temps.sum(), (temps ** 2).sum(), (temps ** 3).sum()]
+
+
+    def solve(self):
+        """ works out the thresholds of the second pass from the statistics of the first """
+
+        data = float(max(self.data, 1))
+        DesertIndex   = self.desert / data
+        ColdCloudMean = self.counts[_cold].sum() / data
+        SnowPerc      = self.snow / data
+
+        #If snow is present the Warm Clouds are reclassfied as ambigious
+        self.SnowPresent = SnowPerc > .01
+        if self.SnowPresent:
+            clouds  = self.counts[_cold]
+            moments = self.moments[_cold]
+            amb_counts = self.counts[_amb] + self.counts[_warm]
+            amb_sums   = self.sums[_amb] + self.sums[_warm]
+        else:
+            clouds  = self.counts[_cold] + self.counts[_warm]
+            moments = self.moments[_cold] + self.moments[_warm]
+            amb_counts = self.counts[_amb]
+            amb_sums   = self.sums[_amb]
+
+        self.use_warm_amb = False
+        self.use_cold_amb = False
+        self.solved       = True
+
+        n = moments[0]
+        if n == 0:
+            print("No cloud pixels were found in the first pass")
+            return
+
+        #Statistics of cloud pixel temperatures
+        mean = moments[1] / n
+        m2   = moments[2] / n - mean ** 2
+        m3   = moments[3] / n - 3 * mean * moments[2] / n + 2 * mean ** 3
+        TempMean   = mean + 250.0
+        TempStd    = numpy.sqrt(max(m2, 0))
+        TempSkew   = m3 / m2 ** 1.5 if m2 > 0 else 0.0
+        Temp98perc = _hist_percentile(clouds, 98.75)
+        Temp97perc = _hist_percentile(clouds, 97.50)
+        Temp82perc = _hist_percentile(clouds, 82.50)
+
+        #Pass 2 is run if the following conditionals are met
+        if not (ColdCloudMean > .004 and DesertIndex > .5 and TempMean < 295):
+            return
+
+        print("Second pass underway")
+
+        #Adjusting Temperature thresholds based on skew
+        if TempSkew > 0:
+            if TempSkew > 1:
+                shift = TempStd
+            else:
+                shift = TempStd * TempSkew
+        else: shift = 0
+        Temp97perc += shift
+        Temp82perc += shift
+        if Temp97perc > Temp98perc:
+            Temp82perc = Temp82perc -(Temp97perc - Temp98perc)
+            Temp97perc = Temp98perc
+
+        self.Temp97perc = Temp97perc
+        self.Temp82perc = Temp82perc
+
+        # ambiguous pixels between the thresholds, from the ambiguous temperature histogram
+        upper = _hist_bin(Temp97perc)
+        lower = _hist_bin(Temp82perc)
+
+        warm_count = amb_counts[lower:upper].sum()
+        cold_count = amb_counts[:lower].sum()
+        ThermEffect1 = warm_count / data
+        ThermEffect2 = cold_count / data
+        warmAmbMean  = amb_sums[lower:upper].sum() / warm_count if warm_count else 0
+        coldAmbMean  = amb_sums[:lower].sum() / cold_count if cold_count else 0
+
+        if ThermEffect1 < .4 and warmAmbMean < 295 and not self.SnowPresent:
+            self.use_warm_amb = True
+            self.use_cold_amb = True
+            print("Upper Threshold Used")
+        elif ThermEffect2 < .4 and coldAmbMean < 295:
+            self.use_cold_amb = True
+            print("Lower Threshold Used")
+
+
+    def mask(self, Band2, Band3, Band4, Band5, Band6):
+        """ uint8 cloud mask of one block, 1 = good data and 0 = cloud """
+
+        if not self.solved:
+            raise Exception("solve() must be called after accumulating every block")
+
+        classes = self.classify(Band2, Band3, Band4, Band5, Band6)[0]
+
+        Cloudmask = classes == _cold
+        if self.SnowPresent:
+            Amb = (classes == _amb) | (classes == _warm)
+        else:
+            Amb = classes == _amb
+            Cloudmask |= classes == _warm
+
+        if self.use_cold_amb:
+            with numpy.errstate(invalid = "ignore"):
+                Band6 = numpy.asarray(Band6, dtype = numpy.float32)
+                Cloudmask |= Amb & (Band6 < self.Temp82perc) & (Band6 > 0)
+                if self.use_warm_amb:
+                    Cloudmask |= Amb & (Band6 < self.Temp97perc) & (Band6 > self.Temp82perc)
+
+        #switch legend to 1=good data 0 = cloud pixel
+        return (~Cloudmask).astype(numpy.uint8)
+
+
+def _hist_bin(temp):
+    """ index of the temperature histogram bin of a temperature """
+    return int(min(max((temp - _hist_min) / _hist_width, 0), _hist_bins))
+
+
+def _hist_percentile(counts, percent):
+    """ percentile of the values of a histogram, to the nearest bin """
+
+    cumulative = numpy.cumsum(counts)
+    index = numpy.searchsorted(cumulative, cumulative[-1] * percent / 100.0)
+    return _hist_min + (index + 0.5) * _hist_width
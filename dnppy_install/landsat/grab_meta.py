@@ -1,4 +1,7 @@
 
+# local imports
+from dnppy import convert
+
 # standard imports
 from datetime import datetime
 import math
@@ -17,7 +20,8 @@ def grab_meta(filename):
                         aquisition (in Z time!)
     
     Inputs:
-       filename    the filepath to a landsat MTL file.
+       filename    the filepath to a landsat MTL file, or to a landsat .tar.gz or .tar
+                   archive, in which case the MTL is read from inside the archive.
 
     Returns:
         meta        class object with all metadata attributes
@@ -35,8 +39,15 @@ def grab_meta(filename):
     meta = landsat_metadata_obj()
 
     if filename:
-        metafile = open(filename,'r')
-        metadata = metafile.readlines()
+        if _is_archive(filename):
+            mtl_name = [name for name in convert.tar_index(filename) if name.endswith("_MTL.txt")]
+            if not mtl_name:
+                raise Exception("No MTL file could be found in archive {0}".format(filename))
+            metadata = convert.read_tar_member(filename, mtl_name[0]).splitlines(True)
+
+        else:
+            metafile = open(filename,'r')
+            metadata = metafile.readlines()
 
     for line in metadata:
         # skips lines that contain "bad flags" denoting useless data AND lines
@@ -87,5 +98,10 @@ def grab_meta(filename):
     return(meta)
 
 
+def _is_archive(filename):
+    """ True if filename looks like a landsat tar or tar.gz archive """
+    return any(filename.endswith(ext) for ext in [".tar.gz", ".tgz", ".tar"])
+
+
 if __name__ == "__main__":
     m = grab_meta(r"C:\Users\Jeff\Desktop\Github\dnppy\dnppy_install\landsat\test_meta\LT50140342011307EDC00_MTL.txt")
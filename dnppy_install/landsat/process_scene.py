@@ -0,0 +1,352 @@
+#standard imports
+from grab_meta import grab_meta
+from _blocks import _block_reader, _block_writer, _band_path, _outname
+from _calibration import _band_calibration
+from qa_bits import _cloud_mask, _cloud_flags, qa_spec as _qa_spec
+from acca import _acca
+from dnppy import core
+import numpy
+import os
+
+__all__=['process_scene']
+
+
+# bands of each sensor used by the products of process_scene
+_sensor_bands = {
+    "LANDSAT_8": {"reflective": ["1", "2", "3", "4", "5", "6", "7", "9"],
+                  "thermal":    ["10", "11"],
+                  "red": "4", "nir": "5"},
+    "LANDSAT_7": {"reflective": ["1", "2", "3", "4", "5", "7"],
+                  "thermal":    ["6_VCID_1", "6_VCID_2"],
+                  "red": "3", "nir": "4"},
+    "LANDSAT_5": {"reflective": ["1", "2", "3", "4", "5", "7"],
+                  "thermal":    ["6"],
+                  "red": "3", "nir": "4"},
+    "LANDSAT_4": {"reflective": ["1", "2", "3", "4", "5", "7"],
+                  "thermal":    ["6"],
+                  "red": "3", "nir": "4"}}
+
+_product_names = ["TOA_Rad", "TOA_Ref", "ASBTemp", "NDVI", "SAVI", "Mask", "LAI", "Emissivity", "Surf_Temp"]
+
+
+def process_scene(meta_path, products = ("TOA_Ref", "ASBTemp", "NDVI", "Mask"), outdir = False,
+                  band_nums = None, L = 0.5, path_rad = 0, nbt = 1, sky_rad = 0, int16_scale = None,
+                  qa_spec = None, lut = True, block_rows = 512):
+    """
+    Computes several products of one Landsat 4, 5, 7 or 8 scene in a single pass.
+
+    Running toa_reflectance_8, atsat_bright_temp_8, ndvi_8 and make_cloud_mask_8 one
+    after another writes full scene tifs which the next step reads back in. Instead,
+    this reads each band the requested products need just once, a block of rows at a
+    time, computes every product from that block in memory (sharing intermediates,
+    such as the reflectance of the red band for both TOA_Ref and NDVI), and writes
+    only the requested outputs.
+
+    Inputs:
+      meta_path     The full filepath to the MTL file of the scene, or to a landsat
+                    .tar.gz or .tar archive of the scene
+      products      list of products to make, out of
+                        "TOA_Rad"   top of atmosphere radiance of each band in band_nums
+                        "TOA_Ref"   top of atmosphere reflectance of each band in band_nums
+                        "ASBTemp"   at satellite brightness temperature of the thermal bands
+                        "NDVI"      normalized difference vegetation index, from TOA reflectance
+                        "SAVI"      soil adjusted vegetation index, from TOA reflectance
+                        "Mask"      cloud mask, 1 for clear pixels and 0 for clouds. From the
+                                    BQA band for landsat 8, and from the ACCA filters of
+                                    make_cloud_mask_457 for landsat 4, 5 and 7, which need
+                                    one more pass over bands 2 to 6 first.
+                        "LAI"       leaf area index, from SAVI
+                        "Emissivity" narrow band emissivity, from LAI
+                        "Surf_Temp" surface temperature, as surface_temp_8 and _457, with
+                                    the average of bands 10 and 11 for landsat 8
+      outdir        Output directory to save products in. If left False they will be saved
+                    in the same directory as the MTL file.
+      band_nums     bands to make TOA_Rad and TOA_Ref products for. Defaults to every
+                    reflective band except the panchromatic band, which is a different size.
+      L             Soil brightness correction factor of SAVI, between 0 and 1
+      path_rad      Path Radiance constant of the surface temperature
+      nbt           Narrowband Transmissivity constant of the surface temperature
+      sky_rad       Sky Radiance constant of the surface temperature
+      int16_scale   Set to a number (such as 10000) to save TOA_Ref, NDVI and SAVI as int16
+                    values times int16_scale instead of float32.
+      qa_spec       layout of the BQA bits of a landsat 8 scene for the Mask product,
+                    "pre-collection", "collection1" or "collection2". By default it is
+                    read from the COLLECTION_NUMBER of the MTL file.
+      lut           When True, digital numbers are converted by looking them up in a
+                    table of every possible digital number, built once per band.
+      block_rows    number of rows to read and process at once
+
+    Returns:
+      outputs       dict of {product name : filepath, or list of filepaths for per band products}
+    """
+
+    meta    = grab_meta(meta_path)
+    sensor  = _sensor_bands[meta.SPACECRAFT_ID]
+    scene   = getattr(meta, "LANDSAT_SCENE_ID", os.path.basename(meta.FILEPATH).split("_")[0])
+    folder  = os.path.abspath(outdir) if outdir else os.path.dirname(os.path.abspath(meta.FILEPATH))
+
+    if band_nums is None:
+        band_nums = sensor["reflective"]
+    band_nums = map(str, core.enf_list(band_nums))
+
+    # each job is (product, outname, function of a _block_cache, writer options)
+    jobs = []
+    for product in core.enf_list(products):
+        product = _match_product(product)
+
+        if product == "TOA_Rad":
+            for band in band_nums:
+                jobs.append((product, _outname(meta, band, product, outdir),
+                             lambda c, b = band: c.radiance(b), {}))
+
+        elif product == "TOA_Ref":
+            for band in band_nums:
+                jobs.append((product, _outname(meta, band, product, outdir),
+                             lambda c, b = band: c.reflectance(b), {"int16_scale": int16_scale}))
+
+        elif product == "ASBTemp":
+            for band in sensor["thermal"]:
+                jobs.append((product, _outname(meta, band, product, outdir),
+                             lambda c, b = band: c.bright_temp(b), {}))
+
+        elif product == "NDVI":
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.ndvi(), {"int16_scale": int16_scale}))
+
+        elif product == "SAVI":
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.savi(L), {"int16_scale": int16_scale}))
+
+        elif product == "LAI":
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.lai(L), {}))
+
+        elif product == "Emissivity":
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.emissivity(L), {}))
+
+        elif product == "Surf_Temp":
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.surface_temp(L, path_rad, nbt, sky_rad), {}))
+
+        elif product == "Mask":
+            if qa_spec is None and meta.SPACECRAFT_ID == "LANDSAT_8":
+                qa_spec = _qa_spec(meta)
+            jobs.append((product, core.create_outname(folder, scene, product, "tif"),
+                         lambda c: c.cloud_mask(qa_spec), {"dtype": "uint8", "nodata": 255}))
+
+    # a dry run on a tiny fake block finds every band the products need
+    calibrations = {}
+    probe = _block_cache(meta, sensor, calibrations, None, 0, 0, False)
+    with numpy.errstate(all = "ignore"):
+        for product, outname, function, options in jobs:
+            function(probe)
+
+    paths  = dict((band, _band_path(meta, band)) for band in probe.used)
+    reader = _block_reader(paths)
+    print("Processing {0} outputs of {1} from {2} bands".format(len(jobs), scene, len(paths)))
+
+    # the ACCA cloud mask needs statistics of the whole scene before any block of it
+    acca = None
+    if "Mask" in [job[0] for job in jobs] and meta.SPACECRAFT_ID != "LANDSAT_8":
+        acca = _acca()
+        print("First pass of the cloud mask underway")
+        for row, nrows in reader.blocks(block_rows):
+            acca.accumulate(*_block_cache(meta, sensor, calibrations, reader, row, nrows, lut).acca_bands())
+        acca.solve()
+
+    writers = [_block_writer(outname, reader, **options) for product, outname, function, options in jobs]
+
+    for row, nrows in reader.blocks(block_rows):
+        cache = _block_cache(meta, sensor, calibrations, reader, row, nrows, lut, acca)
+        for (product, outname, function, options), writer in zip(jobs, writers):
+            writer.write(row, function(cache))
+
+    reader.close()
+
+    outputs = {}
+    for (product, outname, function, options), writer in zip(jobs, writers):
+        writer.close()
+        print("Saved {0} at {1}".format(product, outname))
+        if product in ["TOA_Rad", "TOA_Ref", "ASBTemp"]:
+            outputs.setdefault(product, []).append(outname)
+        else:
+            outputs[product] = outname
+
+    return outputs
+
+
+class _block_cache(object):
+    """
+    the bands and intermediate products of one block of a scene, each computed at most
+    once. With no reader, it only records which bands are used, on a 1 by 1 fake block.
+    The dict of _band_calibration objects, and so their lookup tables, is shared by
+    every block of the scene, as is the solved _acca of landsat 4, 5 and 7 cloud masks.
+    """
+
+    def __init__(self, meta, sensor, calibrations, reader, row, nrows, lut = True, acca = None):
+        self.meta         = meta
+        self.sensor       = sensor
+        self.calibrations = calibrations
+        self.reader       = reader
+        self.row          = row
+        self.nrows        = nrows
+        self.lut          = lut
+        self.acca         = acca
+        self.used         = set()
+        self._cache       = {}
+
+
+    def _memo(self, key, function):
+        if key not in self._cache:
+            self._cache[key] = function()
+        return self._cache[key]
+
+
+    def calibration(self, band):
+        if band not in self.calibrations:
+            self.calibrations[band] = _band_calibration(self.meta, band)
+        return self.calibrations[band]
+
+
+    def _convert(self, kind, band):
+        return self._memo((kind, band), lambda: self.calibration(band).convert(kind, self.dn(band), self.lut))
+
+
+    def dn(self, band):
+        """ digital numbers of a band """
+
+        self.used.add(band)
+        if self.reader is None:
+            return numpy.ones((1, 1), dtype = numpy.uint16)
+        return self._memo(("dn", band), lambda: self.reader.read(band, self.row, self.nrows))
+
+
+    def radiance(self, band):
+        return self._convert("radiance", band)
+
+
+    def reflectance(self, band):
+        return self._convert("reflectance", band)
+
+
+    def bright_temp(self, band):
+        return self._convert("bright_temp", band)
+
+
+    def ndvi(self):
+        return self._memo("ndvi", lambda: self.savi(0.0))
+
+
+    def savi(self, L):
+        """ soil adjusted vegetation index, (1 + L)(nir - red) / (nir + red + L) """
+
+        def savi():
+            red = self.reflectance(self.sensor["red"])
+            nir = self.reflectance(self.sensor["nir"])
+            with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                out = nir - red
+                out *= (1 + L)
+                out /= (nir + red + L)
+            return out
+
+        return self._memo(("savi", L), savi)
+
+
+    def lai(self, L):
+        """ leaf area index from SAVI, 0 where SAVI is below 0.1 and 6 where it is above 0.687 """
+
+        def lai():
+            savi = self.savi(L)
+            with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                out = 0.69 - savi
+                out /= 0.59
+                numpy.log(out, out)
+                out /= -0.91
+                out[savi >= 0.687] = 6
+                out[savi < 0.1] = 0
+            return out
+
+        return self._memo(("lai", L), lai)
+
+
+    def emissivity(self, L):
+        """ narrow band emissivity from the leaf area index, 0.98 where it is above 3 """
+
+        def emissivity():
+            lai = self.lai(L)
+            out = lai * 0.0033
+            out += 0.97
+            with numpy.errstate(invalid = "ignore"):
+                out[lai > 3] = 0.98
+            return out
+
+        return self._memo(("nbe", L), emissivity)
+
+
+    def surface_temp(self, L, path_rad = 0, nbt = 1, sky_rad = 0):
+        """
+        surface temperature in Kelvin, averaged over bands 10 and 11 of landsat 8. The
+        emissivity is worked out once and used for every thermal band.
+        """
+
+        def surface_temp():
+            nbe   = self.emissivity(L)
+            bands = self.sensor["thermal"] if self.meta.SPACECRAFT_ID == "LANDSAT_8" else self.sensor["thermal"][:1]
+
+            # (1 - nbe) * sky_rad, the sky radiance term shared by every band
+            sky = 1 - nbe
+            sky *= sky_rad
+
+            out = None
+            with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                for band in bands:
+                    calibration = self.calibration(band)
+
+                    # corrected thermal radiance, then K2 / ln(nbe * K1 / ctr + 1)
+                    st = self.radiance(band) - path_rad
+                    st /= nbt
+                    st -= sky
+                    numpy.divide(nbe * calibration.K1, st, st)
+                    st += 1
+                    numpy.log(st, st)
+                    numpy.divide(calibration.K2, st, st)
+                    st[self.dn(band) <= 1] = numpy.nan
+
+                    if out is None:
+                        out = st
+                    else:
+                        out += st
+
+            out /= len(bands)
+            return out
+
+        return self._memo(("st", L, path_rad, nbt, sky_rad), surface_temp)
+
+
+    def acca_bands(self):
+        """ reflectance of bands 2, 3, 4 and 5 and brightness temperature of band 6 """
+
+        return [self.reflectance(band) for band in ["2", "3", "4", "5"]] + \
+               [self.bright_temp(self.sensor["thermal"][0])]
+
+
+    def cloud_mask(self, qa_spec = "pre-collection"):
+        """ 1 for clear pixels, 0 for clouds and 255 for fill. qa_spec is the layout of landsat 8 BQA bits """
+
+        if self.meta.SPACECRAFT_ID == "LANDSAT_8":
+            return self._memo("mask", lambda: _cloud_mask(self.dn("QA"), _cloud_flags, qa_spec))
+
+        bands = self.acca_bands()
+        if self.reader is None:
+            return bands[0]
+        return self._memo("mask", lambda: self.acca.mask(*bands))
+
+
+def _match_product(product):
+    """ the product name matching a product, ignoring case """
+
+    for name in _product_names:
+        if product.lower() == name.lower():
+            return name
+    raise Exception("'{0}' is not a product, choose from {1}".format(product, _product_names))
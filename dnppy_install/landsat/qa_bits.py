@@ -0,0 +1,239 @@
+#standard imports
+from _blocks import _block_reader, _block_writer
+from grab_meta import grab_meta
+from dnppy import core
+import numpy
+import os
+
+__all__=['decode_qa',
+         'qa_field',
+         'qa_spec',
+         'make_cloud_mask_8_numpy']
+
+
+# (first bit, number of bits) of each field of the landsat 8 quality assessment band.
+# two bit fields are confidences, 0 = not determined, 1 = low, 2 = medium, 3 = high
+_qa_specs = {
+    # level 1 products made before collection 1, such as those of the test data
+    "pre-collection": {"fill":              (0, 1),
+                       "dropped_frame":     (1, 1),
+                       "terrain_occlusion": (2, 1),
+                       "water":             (4, 2),
+                       "snow":              (10, 2),
+                       "cirrus":            (12, 2),
+                       "cloud":             (14, 2)},
+
+    # collection 1 level 1 products
+    "collection1":    {"fill":              (0, 1),
+                       "terrain_occlusion": (1, 1),
+                       "saturation":        (2, 2),
+                       "cloud_bit":         (4, 1),
+                       "cloud":             (5, 2),
+                       "cloud_shadow":      (7, 2),
+                       "snow":              (9, 2),
+                       "cirrus":            (11, 2)},
+
+    # collection 2 level 1 products, the QA_PIXEL band
+    "collection2":    {"fill":              (0, 1),
+                       "dilated_cloud":     (1, 1),
+                       "cirrus_bit":        (2, 1),
+                       "cloud_bit":         (3, 1),
+                       "cloud_shadow_bit":  (4, 1),
+                       "snow_bit":          (5, 1),
+                       "clear":             (6, 1),
+                       "water":             (7, 1),
+                       "cloud":             (8, 2),
+                       "cloud_shadow":      (10, 2),
+                       "snow":              (12, 2),
+                       "cirrus":            (14, 2)}}
+
+# spec of each COLLECTION_NUMBER of the MTL file, which pre-collection files do not have
+_collection_specs = {0: "pre-collection", 1: "collection1", 2: "collection2"}
+
+_confidence = {"low": 1, "medium": 2, "high": 3}
+
+# flags of make_cloud_mask_8_numpy, the bits the value ranges of make_cloud_mask_8 stand for
+_cloud_flags = {"cloud": "high", "cirrus": "high"}
+
+# lookup tables already built, by kind of table, spec and flags
+_luts = {}
+
+
+def decode_qa(qa, flags, spec = "pre-collection"):
+    """
+    Decodes an array of landsat 8 quality assessment values into a boolean array
+    that is True where any one of the flags is set.
+
+    The flags are worked out once for each of the 65536 possible values, and that
+    table is cached, so decoding a block of a scene is a single numpy.take.
+
+    :param qa:      uint16 numpy array of BQA band values
+    :param flags:   dict of {field : level}, such as {"cloud": "high", "fill": True}.
+                    Two bit confidence fields are set at or above a level of "low",
+                    "medium" or "high", other fields when they are not 0.
+    :param spec:    "pre-collection", "collection1" or "collection2", the layout of the
+                    BQA bits. qa_spec(meta) gives the layout of a scene.
+
+    :return:        boolean numpy array the shape of qa
+    """
+
+    return numpy.take(_flags_lut(flags, spec), qa)
+
+
+def qa_field(qa, field, spec = "pre-collection"):
+    """
+    Value of one bit field of an array of landsat 8 quality assessment values, such
+    as 0 to 3 for the cloud confidence.
+
+    :param qa:      uint16 numpy array of BQA band values
+    :param field:   name of the field, such as "cloud", "cirrus" or "snow"
+    :param spec:    "pre-collection", "collection1" or "collection2", the layout of the
+                    BQA bits. qa_spec(meta) gives the layout of a scene.
+
+    :return:        uint8 numpy array the shape of qa
+    """
+
+    return numpy.take(_field_lut(field, spec), qa)
+
+
+def qa_spec(meta):
+    """
+    The layout of the BQA bits of a scene, "pre-collection", "collection1" or "collection2",
+    from the COLLECTION_NUMBER of its metadata.
+
+    :param meta:    metadata object of the scene from grab_meta, or the filepath to its MTL file
+    """
+
+    if not hasattr(meta, "SPACECRAFT_ID"):
+        meta = grab_meta(meta)
+
+    collection = int(getattr(meta, "COLLECTION_NUMBER", 0))
+    if collection not in _collection_specs:
+        raise Exception("BQA bits of collection {0} are not known".format(collection))
+    return _collection_specs[collection]
+
+
+def make_cloud_mask_8_numpy(BQA_path, outdir = False, flags = None, spec = None,
+                            block_rows = 512):
+    """
+    Creates a cloud mask tiff file from the Landsat 8 Quality Assessment Band (BQA) file,
+    with numpy and gdal instead of arcpy.
+
+    Where make_cloud_mask_8 reclassifies ranges of BQA values, this decodes the bits
+    of each value, so other flags such as snow or cloud shadow may be masked as well.
+    The mask is 1 for clear pixels, 0 for masked pixels and 255 (nodata) for fill.
+
+    Inputs:
+      BQA_path    The full filepath to the BQA file for the raw Landsat 8 dataset
+      outdir      Output directory to save the cloud mask in. If left False it is saved
+                  in the same directory as the BQA file.
+      flags       dict of {field : level} of pixels to mask, defaults to high confidence
+                  clouds and cirrus, {"cloud": "high", "cirrus": "high"}. See decode_qa.
+      spec        "pre-collection", "collection1" or "collection2", the layout of the BQA
+                  bits. By default it is read from the MTL file beside the BQA file, or
+                  worked out from the name of the BQA file.
+      block_rows  number of rows to read and decode at once
+
+    Returns:
+      CloudMask_path  filepath to the cloud mask tif
+    """
+
+    if flags is None:
+        flags = _cloud_flags
+
+    BQA_path = os.path.abspath(BQA_path)
+    TileName = os.path.splitext(os.path.basename(BQA_path))[0].replace("_BQA", "")
+
+    if spec is None:
+        spec = _file_spec(BQA_path)
+        print("Decoding {0} as a {1} BQA band".format(os.path.basename(BQA_path), spec))
+
+    if outdir:
+        folder = os.path.abspath(outdir)
+    else:
+        folder = os.path.dirname(BQA_path)
+    CloudMask_path = core.create_outname(folder, TileName, "Mask", "tif")
+
+    reader = _block_reader({"QA": BQA_path})
+    writer = _block_writer(CloudMask_path, reader, dtype = "uint8", nodata = 255)
+
+    for row, nrows in reader.blocks(block_rows):
+        writer.write(row, _cloud_mask(reader.read("QA", row, nrows), flags, spec))
+
+    reader.close()
+    print("Saved cloud mask at {0}".format(CloudMask_path))
+    return writer.close()
+
+
+def _file_spec(BQA_path):
+    """
+    layout of the bits of a BQA file, from the MTL file beside it if there is one, otherwise
+    from its name. Collection files are named like LC08_L1TP_014034_20141213_20170416_01_T1_BQA.TIF
+    """
+
+    name  = os.path.basename(BQA_path)
+    parts = name.split("_")
+
+    for suffix in ["_BQA", "_QA_PIXEL"]:
+        if suffix in name:
+            mtl_path = os.path.join(os.path.dirname(BQA_path), name.split(suffix)[0] + "_MTL.txt")
+            if os.path.isfile(mtl_path):
+                return qa_spec(mtl_path)
+
+    if len(parts) > 5 and parts[5].isdigit() and int(parts[5]) in _collection_specs:
+        return _collection_specs[int(parts[5])]
+    return "pre-collection"
+
+
+def _cloud_mask(qa, flags, spec = "pre-collection"):
+    """ uint8 mask of an array of BQA values, 1 for clear, 0 for flagged and 255 for fill """
+
+    return numpy.take(_mask_lut(flags, spec), qa)
+
+
+def _flag_key(flags, spec):
+    """ hashable form of a dict of flags, with confidence names as numbers """
+
+    if spec not in _qa_specs:
+        raise Exception("spec must be one of {0}".format(_qa_specs.keys()))
+
+    key = []
+    for field, level in sorted(flags.items()):
+        if field not in _qa_specs[spec]:
+            raise Exception("'{0}' is not a field of {1} BQA bands, choose from {2}".format(
+                            field, spec, sorted(_qa_specs[spec])))
+        key.append((field, _confidence[level] if level in _confidence else int(level)))
+    return spec, tuple(key)
+
+
+def _field_lut(field, spec):
+    """ uint8 table of the value of one field, for every uint16 value """
+
+    if ("field", spec, field) not in _luts:
+        first, nbits = _qa_specs[spec][field]
+        values = numpy.arange(65536, dtype = numpy.uint32)
+        _luts[("field", spec, field)] = ((values >> first) & ((1 << nbits) - 1)).astype(numpy.uint8)
+    return _luts[("field", spec, field)]
+
+
+def _flags_lut(flags, spec):
+    """ boolean table of whether any flag is set, for every uint16 value """
+
+    key = _flag_key(flags, spec)
+    if ("flags",) + key not in _luts:
+        lut = numpy.zeros(65536, dtype = numpy.bool_)
+        for field, level in key[1]:
+            lut |= _field_lut(field, spec) >= max(level, 1)
+        _luts[("flags",) + key] = lut
+    return _luts[("flags",) + key]
+
+
+def _mask_lut(flags, spec):
+    """ uint8 table of the cloud mask value, for every uint16 value """
+
+    key = _flag_key(flags, spec)
+    if ("mask",) + key not in _luts:
+        lut = numpy.where(_flags_lut(flags, spec), 0, 1).astype(numpy.uint8)
+        lut[_field_lut("fill", spec) == 1] = 255
+        _luts[("mask",) + key] = lut
+    return _luts[("mask",) + key]
@@ -1,5 +1,8 @@
 # local imports
 from grab_meta import *
+from grab_meta import _is_archive
+from dnppy import convert
+from dnppy import raster
 
 import os
 import arcpy
@@ -43,6 +46,11 @@ class scene:
         In some cases, users may have their MTL file located somewhere other than
         their landsat data. In this instance, users should input the path to
         the landsat images as tif_dir.
+
+        MTL_path may also be a landsat .tar.gz or .tar archive straight from
+        the USGS. The MTL is then read from inside the archive and the band
+        filepaths are GDAL virtual paths to members of the archive, which
+        can be read with the "to_numpy" method without extracting anything.
         """
 
         self.mtl_dir    = os.path.dirname(MTL_path) # directory of MTL file
@@ -50,7 +58,14 @@ class scene:
         self.in_paths   = {}                        # dict of filepaths to tifs
         self.rasts      = {}                        # dict of arcpy raster objects
 
-        if not tif_dir:
+        if _is_archive(MTL_path):
+            self.archive = MTL_path                 # archive holding the bands
+        else:
+            self.archive = None
+
+        if tif_dir:
+            self.tif_dir = tif_dir
+        else:
             self.tif_dir = self.mtl_dir
 
         self._find_bands()   
@@ -60,12 +75,25 @@ class scene:
     def __getitem__(self, index):
         """ returns arcpy.raster objects from getitem indices """
 
+        if self.archive is not None:
+            raise Exception("arcpy cannot read bands from inside archive {0}, "
+                            "use scene.to_numpy instead".format(self.archive))
+
         if not "B{0}".format(index) in self.rasts:
             self.rasts["B{0}".format(index)] = arcpy.Raster(self.in_paths["B{0}".format(index)])
 
         return self.rasts["B{0}".format(index)]
 
 
+    def to_numpy(self, index, numpy_datatype = None):
+        """
+        returns a (numpy array, metadata) pair for a band of this scene, exactly
+        as raster.to_numpy does. Works for scenes built from archives.
+        """
+
+        return raster.to_numpy(self.in_paths["B{0}".format(index)], numpy_datatype)
+
+
     def __iter__(self):
         """ defines iterative behavior when cast on a scene object"""
 
@@ -91,7 +119,7 @@ class scene:
 
             # add in landsat 8s QA band with shortened name
             QA_name = self.meta.FILE_NAME_BAND_QUALITY
-            self.in_paths["BQA"] = os.path.join(self.tif_dir,QA_name)
+            self.in_paths["BQA"] = self._band_path(QA_name)
 
         elif self.meta.SPACECRAFT_ID == "LANDSAT_7":
             bandlist = [1,2,3,4,5,"6_VCID_1","6_VCID_2",7,8]
@@ -105,12 +133,20 @@ class scene:
         # populate self.bands dict
         for band in bandlist:
             filename = getattr(self.meta, "FILE_NAME_BAND_{0}".format(band))
-            filepath = os.path.join(self.tif_dir, filename)
-            self.in_paths["B{0}".format(band)] = filepath
+            self.in_paths["B{0}".format(band)] = self._band_path(filename)
                 
         return
 
 
+    def _band_path(self, filename):
+        """ filepath to a band on disk, or a GDAL virtual path into the archive """
+
+        if self.archive is not None:
+            return convert.tar_member_path(self.archive, filename)
+        else:
+            return os.path.join(self.tif_dir, filename)
+
+
     def get_cloud_mask(self):
         """ wraps dnppy.landsat.cloud_mask functions and applies them to this scene"""
         pass
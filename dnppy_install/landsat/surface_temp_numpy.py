@@ -0,0 +1,54 @@
+#standard imports
+from process_scene import process_scene
+
+__all__=['surface_temp_numpy']
+
+
+def surface_temp_numpy(meta_path, path_rad = 0, nbt = 1, sky_rad = 0, outdir = False, L = 0.5,
+                       lai = False, emissivity = False, lut = True, block_rows = 512):
+    """
+    Calculates surface temperature from Landsat 4/5 TM, 7 ETM+ or 8 OLI and TIRS data,
+    with numpy and gdal instead of arcpy, straight from the raw bands of the scene.
+
+    Each block of rows is read once. SAVI, the Leaf Area Index and the Narrowband Emissivity
+    are computed once per block and used for every thermal band, and for landsat 8 the
+    temperatures of bands 10 and 11 are averaged in place. The LAI and emissivity can be
+    saved from the same pass. See process_scene for more products of the same pass.
+
+    *Note: if the default values of 0, 1, and 0 are used for the Path Radiance, Narrowband Transmissivity, and Sky Radiance constants,
+    atmospheric conditions will not be accounted for and the surface values may be off. Values are attainable using MODTRAN.
+
+    Inputs:
+        meta_path       Filepath to the metadata file (ending in _MTL.txt), or to a landsat
+                        .tar.gz or .tar archive of the scene
+        path_rad        Path Radiance constant
+                        *default 0
+        nbt             Narrowband Transmissivity constant
+                        *default 1
+        sky_rad         Sky Radiance constant
+                        *default 0
+        outdir          Path to the desired output folder
+                        *if left False the output tiffs will be placed in meta_path's folder
+        L               Soil brightness correction factor, between 0 and 1
+                        *used to calculate Soil Adjusted Vegetation Index
+                        *default L = 0.5 works well in most situations
+                        *when L = 0, SAVI = NDVI
+        lai             Set to True to also save the Leaf Area Index
+        emissivity      Set to True to also save the Narrowband Emissivity
+        lut             When True, digital numbers are converted by looking them up in a
+                        table of every possible digital number, built once per band.
+        block_rows      number of rows to read and process at once
+
+    Returns:
+        outputs         dict of {"Surf_Temp" : filepath}, with "LAI" and "Emissivity" filepaths
+                        when they are saved too
+    """
+
+    products = ["Surf_Temp"]
+    if lai:
+        products.append("LAI")
+    if emissivity:
+        products.append("Emissivity")
+
+    return process_scene(meta_path, products, outdir = outdir, L = L, path_rad = path_rad,
+                         nbt = nbt, sky_rad = sky_rad, lut = lut, block_rows = block_rows)
@@ -0,0 +1,163 @@
+#standard imports
+from grab_meta import grab_meta
+from _blocks import _block_reader, _block_writer, _band_path, _outname
+from _calibration import _band_calibration, _oli_bands, _tirs_bands, _tm_bands
+from dnppy import core
+from multiprocessing.pool import ThreadPool
+
+__all__=['toa_radiance_numpy',
+         'toa_reflectance_numpy',
+         'atsat_bright_temp_numpy']
+
+
+def toa_radiance_numpy(band_nums, meta_path, outdir = False, int16_scale = None,
+                       lut = True, threads = 4, block_rows = 512):
+    """
+    Top of Atmosphere radiance (in Watts/(square meter * steradians * micrometers))
+    conversion for Landsat 4, 5, 7 or 8 data, with numpy and gdal instead of arcpy.
+
+    Each band is read, converted and written a block of rows at a time, in float32
+    and in place, so memory use stays at a few blocks per band. Several bands are
+    converted at once. Outputs are named like those of toa_radiance_8 and _457.
+
+    Inputs:
+      band_nums     A list of desired band numbers such as [3, 4, 5]
+      meta_path     The full filepath to the metadata file for those bands, or to a
+                    landsat .tar.gz or .tar archive of the scene
+      outdir        Output directory to save converted files. If left False it will save
+                    output files in the same directory as the metadata file.
+      int16_scale   Set to a number (such as 100) to save outputs as int16 values of
+                    radiance times int16_scale instead of float32.
+      lut           When True, each pixel is converted by looking its digital number up
+                    in a table of the conversion of all 65536 possible digital numbers,
+                    built once per band.
+      threads       number of bands to convert at once
+      block_rows    number of rows to read and convert at once
+
+    Returns:
+      outlist       list of filepaths to the output tifs
+    """
+
+    return _convert_bands(band_nums, meta_path, "radiance", "TOA_Rad", outdir,
+                          int16_scale, lut, threads, block_rows)
+
+
+def toa_reflectance_numpy(band_nums, meta_path, outdir = False, int16_scale = None,
+                          lut = True, threads = 4, block_rows = 512):
+    """
+    Converts Landsat 4, 5, 7 or 8 bands to Top-of-Atmosphere reflectance, with numpy
+    and gdal instead of arcpy.
+
+    The gain and offset of each band, with the sun elevation term (and for landsat 4,
+    5 and 7 the Earth-Sun distance and solar irradiance terms) folded in, are worked
+    out once from the MTL file. Each band is then read, converted and written a block
+    of rows at a time, in float32 and in place, and several bands are converted at once.
+    Outputs are named like those of toa_reflectance_8 and _457.
+
+    Inputs:
+      band_nums     A list of desired band numbers such as [3, 4, 5]
+      meta_path     The full filepath to the metadata file for those bands, or to a
+                    landsat .tar.gz or .tar archive of the scene
+      outdir        Output directory to save converted files. If left False it will save
+                    output files in the same directory as the metadata file.
+      int16_scale   Set to a number (such as 10000) to save outputs as int16 values of
+                    reflectance times int16_scale instead of float32.
+      lut           When True, each pixel is converted by looking its digital number up
+                    in a table of the conversion of all 65536 possible digital numbers,
+                    built once per band.
+      threads       number of bands to convert at once
+      block_rows    number of rows to read and convert at once
+
+    Returns:
+      outlist       list of filepaths to the output tifs
+    """
+
+    return _convert_bands(band_nums, meta_path, "reflectance", "TOA_Ref", outdir,
+                          int16_scale, lut, threads, block_rows)
+
+
+def atsat_bright_temp_numpy(meta_path, outdir = False, lut = True, threads = 4, block_rows = 512):
+    """
+    Converts the thermal bands of Landsat 4, 5, 7 or 8 (band 6, bands 6 VCID 1 and 2,
+    or bands 10 and 11) to at satellite brightness temperature in Kelvins, with numpy
+    and gdal instead of arcpy.
+
+    K2 / ln(K1 / L + 1) needs a divide and a log of every pixel, but is a function of
+    the digital number alone, so by default it is worked out once for each of the 65536
+    possible digital numbers and each pixel is looked up in that table. Outputs are
+    named like those of atsat_bright_temp_8 and _457.
+
+    Inputs:
+      meta_path     The full filepath to the metadata file for those bands, or to a
+                    landsat .tar.gz or .tar archive of the scene
+      outdir        Output directory to save converted files. If left False it will save
+                    output files in the same directory as the metadata file.
+      lut           Set to False to compute the conversion of every pixel instead of
+                    looking it up.
+      threads       number of bands to convert at once
+      block_rows    number of rows to read and convert at once
+
+    Returns:
+      outlist       list of filepaths to the output tifs
+    """
+
+    meta = grab_meta(meta_path)
+    if meta.SPACECRAFT_ID == "LANDSAT_8":
+        band_nums = _tirs_bands
+    elif meta.SPACECRAFT_ID == "LANDSAT_7":
+        band_nums = ["6_VCID_1", "6_VCID_2"]
+    else:
+        band_nums = ["6"]
+
+    return _convert_bands(band_nums, meta, "bright_temp", "ASBTemp", outdir,
+                          None, lut, threads, block_rows)
+
+
+def _convert_bands(band_nums, meta_path, kind, suffix, outdir, int16_scale, lut, threads, block_rows):
+    """ converts several bands of one scene with a _band_calibration method, in parallel """
+
+    band_nums = map(str, core.enf_list(band_nums))
+    meta      = meta_path if hasattr(meta_path, "SPACECRAFT_ID") else grab_meta(meta_path)
+
+    if meta.SPACECRAFT_ID == "LANDSAT_8":
+        thermal, reflective = _tirs_bands, _oli_bands
+    else:
+        thermal, reflective = ["6", "6_VCID_1", "6_VCID_2"], _tm_bands
+
+    valid = {"radiance": reflective + thermal, "reflectance": reflective, "bright_temp": thermal}[kind]
+
+    jobs = []
+    for band_num in band_nums:
+        if band_num in valid:
+            jobs.append((meta, band_num, kind, _outname(meta, band_num, suffix, outdir),
+                         int16_scale, lut, block_rows))
+        else:
+            print("Can only perform {0} conversion on bands {1}".format(kind, valid))
+            print("Skipping band {0}".format(band_num))
+
+    pool = ThreadPool(max(1, min(threads, len(jobs))))
+    try:
+        outlist = pool.map(_convert_band, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return outlist
+
+
+def _convert_band(args):
+    """ converts one band, block by block """
+
+    meta, band_num, kind, outname, int16_scale, lut, block_rows = args
+
+    calibration = _band_calibration(meta, band_num)
+
+    reader = _block_reader({band_num: _band_path(meta, band_num)})
+    writer = _block_writer(outname, reader, int16_scale = int16_scale)
+
+    for row, nrows in reader.blocks(block_rows):
+        writer.write(row, calibration.convert(kind, reader.read(band_num, row, nrows), lut))
+
+    reader.close()
+    print("Saved output at {0}".format(outname))
+    return writer.close()
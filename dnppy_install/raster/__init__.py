@@ -15,6 +15,7 @@ __author__ = ["jwely",
 from apply_linear_correction import *
 from clip_and_snap import *
 from clip_to_shape import *
+from cube_store import *
 from degree_days import *
 from degree_days_accum import *
 from enf_rastlist import *
@@ -0,0 +1,278 @@
+__author__ = 'jwely'
+
+from dnppy import core
+from multiprocessing.pool import ThreadPool
+from datetime import datetime
+import bisect
+import json
+import re
+import numpy
+import gdal
+import os
+
+__all__ = ["cube_store",
+           "to_cube_store"]
+
+
+# name of the metadata sidecar within a cube store directory
+_meta_name = "cube.json"
+_date_fmt  = "%Y-%m-%dT%H:%M:%S"
+
+
+class cube_store(object):
+    """
+    A chunked, compressed, on disk cube of a raster time series.
+
+    The series is held as a (time, rows, cols) cube split into chunks, such as 32
+    time steps by 256 by 256 pixels, each saved as a compressed .npz file named by
+    its chunk indices ("0.1.2.npz"), with the shape, data type, nodata value,
+    georeferencing and dates of the cube kept in a "cube.json" sidecar. Reads of any
+    time and space window only load the chunks which intersect that window, so the
+    time series of a small area is read without touching a full raster per date.
+    Chunks which are entirely nodata are never written.
+
+    Build a store with to_cube_store, or rast_series_class.to_cube_store.
+
+    Example Usage:
+        cube = raster.cube_store(r"E:\MODIS\LST_cube")
+        stack = cube.read(times = (datetime(2013,6,1), datetime(2013,8,31)),
+                          rows = (1000, 1100), cols = (500, 600))
+    """
+
+    def __init__(self, cubedir):
+        """
+        :param cubedir:     directory of a cube store built by to_cube_store
+        """
+
+        self.cubedir = cubedir
+
+        with open(os.path.join(cubedir, _meta_name), 'r') as f:
+            meta = json.load(f)
+
+        self.shape        = tuple(meta["shape"])
+        self.chunks       = tuple(meta["chunks"])
+        self.dtype        = numpy.dtype(meta["dtype"])
+        self.nodata       = meta["nodata"]
+        self.geotransform = tuple(meta["geotransform"])
+        self.projection   = meta["projection"]
+        self.filepaths    = meta["filepaths"]
+        self.dates        = [datetime.strptime(d, _date_fmt) if d else None for d in meta["dates"]]
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def read(self, times = None, rows = None, cols = None):
+        """
+        reads a window of the cube into a numpy array
+
+        :param times:   (start, stop) index range or slice of time steps, or a
+                        (start datetime, end datetime) pair, inclusive of both ends.
+                        defaults to every time step.
+        :param rows:    (start, stop) index range or slice of rows
+        :param cols:    (start, stop) index range or slice of cols
+
+        :return:        (time, rows, cols) numpy array of the window
+        """
+
+        window = [self._slice(times, 0), self._slice(rows, 1), self._slice(cols, 2)]
+        out = numpy.empty([w.stop - w.start for w in window], dtype = self.dtype)
+        out.fill(self.nodata if self.nodata is not None else 0)
+
+        # chunk index ranges which intersect the window
+        ranges = [range(w.start // c, (w.stop - 1) // c + 1) if w.stop > w.start else []
+                  for w, c in zip(window, self.chunks)]
+
+        for ti in ranges[0]:
+            for yi in ranges[1]:
+                for xi in ranges[2]:
+                    chunk = self._load(ti, yi, xi)
+                    if chunk is None:
+                        continue
+
+                    # overlap of the chunk and the window, in cube coordinates
+                    src = []
+                    dst = []
+                    for w, c, i in zip(window, self.chunks, (ti, yi, xi)):
+                        start = max(w.start, i * c)
+                        stop  = min(w.stop, (i + 1) * c)
+                        src.append(slice(start - i * c, stop - i * c))
+                        dst.append(slice(start - w.start, stop - w.start))
+
+                    out[tuple(dst)] = chunk[tuple(src)]
+        return out
+
+
+    def pixel(self, row, col, times = None):
+        """ 1d numpy array of the time series at one pixel """
+
+        return self.read(times, (row, row + 1), (col, col + 1))[:, 0, 0]
+
+
+    def window_dates(self, times = None):
+        """ list of the dates of the time steps within a times window, as used by read """
+
+        return self.dates[self._slice(times, 0)]
+
+
+    def _slice(self, index_range, axis):
+        """ slice with a step of one, within the cube, of a window along an axis """
+
+        size = self.shape[axis]
+        if index_range is None:
+            return slice(0, size)
+
+        if isinstance(index_range, slice):
+            start, stop, step = index_range.indices(size)
+            if step != 1:
+                raise ValueError("windows of a cube_store must have a step of 1")
+            return slice(start, max(start, stop))
+
+        start, stop = index_range
+        if axis == 0 and isinstance(start, datetime):
+            if None in self.dates:
+                raise ValueError("{0} has no dates to select by".format(self.cubedir))
+            start = bisect.bisect_left(self.dates, start)
+            stop  = bisect.bisect_right(self.dates, stop)
+
+        start = min(max(int(start), 0), size)
+        stop  = min(max(int(stop), start), size)
+        return slice(start, stop)
+
+
+    def _load(self, ti, yi, xi):
+        """ numpy array of one chunk, or None if it holds only nodata """
+
+        path = _chunk_path(self.cubedir, ti, yi, xi)
+        if not os.path.exists(path):
+            return None
+        with numpy.load(path) as npz:
+            return npz["chunk"]
+
+
+def to_cube_store(rasters, cubedir, chunks = (32, 256, 256), dates = None, threads = 4):
+    """
+    Converts a raster time series into a chunked, compressed cube_store.
+
+    Rasters are read with gdal a band of chunk rows at a time, so memory use is
+    bounded by one row of chunks (chunks[0] rasters by chunks[1] rows) no matter
+    how many rasters are in the series.
+
+    :param rasters:     a time_series.rast_series_class, or a list of raster filepaths
+                        which all have the same size and georeferencing
+    :param cubedir:     directory to save the cube store in
+    :param chunks:      (time, rows, cols) size of each chunk
+    :param dates:       optional list of datetime objects, one for each raster. taken
+                        from the time domain of a rast_series_class.
+    :param threads:     number of chunks to compress and save at once
+
+    :return:            the cube_store
+    """
+
+    # pull the filepaths and dates out of a rast_series_class
+    if hasattr(rasters, "col_data"):
+        filepaths = list(rasters.col_data["filepaths"])
+        if dates is None and rasters.time_dom:
+            dates = list(rasters.time_dom)
+    else:
+        filepaths = core.enf_list(rasters)
+
+    if dates is not None and len(dates) != len(filepaths):
+        raise ValueError("{0} dates were given for {1} rasters".format(len(dates), len(filepaths)))
+
+    if not os.path.exists(cubedir):
+        os.makedirs(cubedir)
+    else:
+        _clear(cubedir)
+
+    # the first raster sets the shape and georeferencing of the whole cube
+    dataset = _open(filepaths[0])
+    band    = dataset.GetRasterBand(1)
+    rows, cols   = dataset.RasterYSize, dataset.RasterXSize
+    nodata       = band.GetNoDataValue()
+    geotransform = dataset.GetGeoTransform()
+    projection   = dataset.GetProjection()
+    dtype        = band.ReadAsArray(0, 0, 1, 1).dtype
+    dataset      = None
+
+    shape  = (len(filepaths), rows, cols)
+    chunks = tuple(int(min(c, s)) for c, s in zip(chunks, shape))
+    print("Building {0} cube of {1} in chunks of {2}".format(dtype, shape, chunks))
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        for ti, t0 in enumerate(range(0, shape[0], chunks[0])):
+            t_paths  = filepaths[t0:t0 + chunks[0]]
+            datasets = [_open(path) for path in t_paths]
+
+            for path, ds in zip(t_paths, datasets):
+                if (ds.RasterYSize, ds.RasterXSize) != (rows, cols):
+                    raise ValueError("{0} is not the same size as {1}".format(path, filepaths[0]))
+
+            for yi, y0 in enumerate(range(0, rows, chunks[1])):
+                nrows = min(chunks[1], rows - y0)
+                block = numpy.array([ds.GetRasterBand(1).ReadAsArray(0, y0, cols, nrows)
+                                     for ds in datasets], dtype = dtype)
+
+                jobs = [(cubedir, ti, yi, xi, block[:, :, x0:x0 + chunks[2]], nodata)
+                        for xi, x0 in enumerate(range(0, cols, chunks[2]))]
+                pool.map(_save_chunk, jobs)
+
+            datasets = None
+            print("Stored rasters {0} to {1} of {2}".format(t0 + 1, t0 + len(t_paths), shape[0]))
+    finally:
+        pool.close()
+        pool.join()
+
+    # the sidecar is written last, so a store without one was never finished
+    meta = {"shape":        shape,
+            "chunks":       chunks,
+            "dtype":        dtype.str,
+            "nodata":       nodata,
+            "geotransform": geotransform,
+            "projection":   projection,
+            "filepaths":    [os.path.abspath(path) for path in filepaths],
+            "dates":        [d.strftime(_date_fmt) for d in dates] if dates else [None] * shape[0]}
+
+    with open(os.path.join(cubedir, _meta_name), 'w') as f:
+        json.dump(meta, f, indent = 1)
+
+    return cube_store(cubedir)
+
+
+def _open(filepath):
+    """ opens a raster with gdal, or raises an error """
+
+    dataset = gdal.Open(filepath)
+    if dataset is None:
+        raise Exception("gdal could not open {0}".format(filepath))
+    return dataset
+
+
+def _clear(cubedir):
+    """ removes the sidecar and chunks of an earlier cube store in cubedir """
+
+    if os.path.exists(os.path.join(cubedir, _meta_name)):
+        os.remove(os.path.join(cubedir, _meta_name))
+
+    for name in os.listdir(cubedir):
+        if re.match(r"^\d+\.\d+\.\d+\.npz$", name):
+            os.remove(os.path.join(cubedir, name))
+
+
+def _chunk_path(cubedir, ti, yi, xi):
+    return os.path.join(cubedir, "{0}.{1}.{2}.npz".format(ti, yi, xi))
+
+
+def _save_chunk(args):
+    """ compresses and saves one chunk, unless it is all nodata """
+
+    cubedir, ti, yi, xi, chunk, nodata = args
+    path = _chunk_path(cubedir, ti, yi, xi)
+
+    if nodata is not None and numpy.all(chunk == nodata):
+        return None
+
+    numpy.savez_compressed(path, chunk = chunk)
+    return path
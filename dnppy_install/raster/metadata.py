@@ -10,7 +10,7 @@ class metadata:
         arrays for data manipulation.
         """
 
-        def __init__(self, raster = None, xs = None, ys = None, zs = None):
+        def __init__(self, raster = None, xs = None, ys = None, zs = None, band = 1):
 
             # sets geometry information
             if zs is None:
@@ -22,15 +22,21 @@ class metadata:
 
             # if a filepath to existing raster is input, build metadata from it
             if raster is not None:
-                self.get_atts_from_raster(raster)
+                self.get_atts_from_raster(raster, band)
             return
 
 
-        def get_atts_from_raster(self, raster):
+        def get_atts_from_raster(self, raster, band = 1):
             """
-            sets all required metadata attributes from an existing raster image
+            sets all required metadata attributes from an existing raster image.
+            band is the band of a multiband GDAL virtual path to describe, arcpy
+            rasters are given as paths to the band itself.
             """
 
+            # GDAL virtual paths (such as bands inside of archives) are invisible to arcpy
+            if raster.startswith("/vsi"):
+                return self._get_atts_from_gdal(raster, band)
+
             desc = arcpy.Describe(raster)
             self.cellWidth      = desc.meanCellWidth
             self.cellHeight     = desc.meanCellHeight
@@ -53,6 +59,57 @@ class metadata:
             return
 
 
+        def _get_atts_from_gdal(self, raster, band = 1):
+            """
+            sets all required metadata attributes from a raster gdal can open.
+            projection is set to a WKT string rather than an arcpy spatial reference.
+            """
+
+            import gdal
+
+            dataset = gdal.Open(raster)
+            if dataset is None:
+                raise Exception("gdal could not open {0}".format(raster))
+
+            band = dataset.GetRasterBand(band)
+            x0, cell_x, _, y0, _, cell_y = dataset.GetGeoTransform()
+
+            if self.Xsize is None:
+                self.Xsize = dataset.RasterXSize
+            if self.Ysize is None:
+                self.Ysize = dataset.RasterYSize
+
+            self.cellWidth      = cell_x
+            self.cellHeight     = abs(cell_y)
+            self.Xmin           = x0
+            self.Ymax           = y0
+            self.Xmax           = self.Xmin + (self.Xsize * self.cellWidth)
+            self.Ymin           = self.Ymax - (self.Ysize * self.cellHeight)
+
+            # translate gdal type names like "UInt16" into arcpy style pixelType "U16"
+            type_name           = gdal.GetDataTypeName(band.DataType)
+            bits                = "".join(c for c in type_name if c.isdigit())
+            if type_name == "Byte":
+                self.desc_pixelType = "U8"
+            elif type_name.startswith("UInt"):
+                self.desc_pixelType = "U" + bits
+            elif type_name.startswith("Float"):
+                self.desc_pixelType = "F" + bits
+            else:
+                self.desc_pixelType = "S" + bits
+            self.pixel_type     = self._get_pixel_type
+            self.numpy_datatype = self._get_numpy_datatype
+
+            self.rectangle      = ' '.join([str(self.Xmin),
+                                            str(self.Ymin),
+                                            str(self.Xmax),
+                                            str(self.Ymax)])
+
+            self.projection     = dataset.GetProjection()
+            self.NoData_Value   = band.GetNoDataValue()
+            return
+
+
         @property
         def _get_pixel_type(self):
             """
@@ -20,7 +20,9 @@ def to_numpy(raster, numpy_datatype = None):
      also see raster.from_numpy function in this module.
 
      inputs:
-       Raster              Any raster supported by the arcpy.RasterToNumPyArray function
+       Raster              Any raster supported by the arcpy.RasterToNumPyArray function,
+                           or a GDAL virtual filesystem path such as those built by
+                           convert.tar_member_path for bands inside of .tar.gz archives
        numpy_datatype      must be a string equal to any of the types listed at the following
                            address [http://docs.scipy.org/doc/numpy/user/basics.types.html]
                            for example: 'uint8' or 'int32' or 'float32'
@@ -47,8 +49,17 @@ def to_numpy(raster, numpy_datatype = None):
     # create a metadata object and assign attributes to it
 
 
+    # GDAL virtual paths are read with gdal, as arcpy cannot see inside them
+    if raster.startswith("/vsi"):
+        import gdal
+        dataset     = gdal.Open(raster)
+        if dataset is None:
+            raise Exception("gdal could not open {0}".format(raster))
+        numpy_rast  = dataset.ReadAsArray()
+        dataset     = None
+
     # perform some checks to convert to supported data format
-    if not is_rast(raster):
+    elif not is_rast(raster):
         try:
             print("Raster '{0}' may not be supported, converting to tif".format(raster))
             tifraster = raster + ".tif"
@@ -61,7 +72,8 @@ def to_numpy(raster, numpy_datatype = None):
 
 
     # read in the raster as a numpy array
-    numpy_rast  = arcpy.RasterToNumPyArray(raster)
+    if not raster.startswith("/vsi"):
+        numpy_rast  = arcpy.RasterToNumPyArray(raster)
 
     # build metadata for multi band raster
     if len(numpy_rast.shape) == 3:
@@ -69,8 +81,12 @@ def to_numpy(raster, numpy_datatype = None):
         meta = []
 
         for i in range(zs):
-            bandpath = raster + "\\Band_{0}".format(i+1)
-            meta.append(metadata(bandpath, xs, ys))
+            # bands of GDAL virtual paths are described through the gdal dataset
+            if raster.startswith("/vsi"):
+                meta.append(metadata(raster, xs, ys, band = i+1))
+            else:
+                bandpath = raster + "\\Band_{0}".format(i+1)
+                meta.append(metadata(bandpath, xs, ys))
 
         if numpy_datatype is None:
             numpy_datatype = meta[0].numpy_datatype
@@ -86,16 +102,23 @@ def to_numpy(raster, numpy_datatype = None):
 
     numpy_rast = numpy_rast.astype(numpy_datatype)
 
+    # NoData value of every band, each band of a multi band raster may have its own
+    if isinstance(meta, list):
+        nodata = numpy.array([band_meta.NoData_Value for band_meta in meta],
+                             dtype = "float64")[:, None, None]
+    else:
+        nodata = meta.NoData_Value
+
     # mask NoData values from the array
     if 'float' in numpy_datatype:
-        numpy_rast[numpy_rast == meta.NoData_Value] = numpy.nan
+        numpy_rast[numpy_rast == nodata] = numpy.nan
         numpy_rast = numpy.ma.masked_array(numpy_rast, numpy.isnan(numpy_rast),
                                            dtype = numpy_datatype)
 
     elif 'int' in numpy_datatype: # (numpy.nan not supported by ints)
         mask = numpy.zeros(numpy_rast.shape)
-        mask[numpy_rast != meta.NoData_Value] = False    # do not mask
-        mask[numpy_rast == meta.NoData_Value] = True     # mask
+        mask[numpy_rast != nodata] = False    # do not mask
+        mask[numpy_rast == nodata] = True     # mask
         numpy_rast = numpy.ma.masked_array(numpy_rast, mask,
                                            dtype = numpy_datatype)
 
@@ -11,3 +11,5 @@ from fetch_test_MODIS import *
 from fetch_VA_shapefile import *
 from fetch_test_precip import *
 from fetch_test_SRTM import *
+from download_standin import *
+from benchmark_download import *
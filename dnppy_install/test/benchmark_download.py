@@ -0,0 +1,159 @@
+__author__ = 'jwely'
+
+from download_standin import standin_servers, build_standin_tree
+from datetime import datetime
+import tempfile
+import shutil
+import json
+import time
+import os
+
+__all__ = ["benchmark_download"]
+
+
+# network conditions each benchmark is run under
+default_conditions = {"lan":        {"latency": 0.0,  "bandwidth": None, "failure_rate": 0.0},
+                      "wan":        {"latency": 0.05, "bandwidth": 4e6,  "failure_rate": 0.0},
+                      "unreliable": {"latency": 0.05, "bandwidth": 4e6,  "failure_rate": 0.1}}
+
+
+def benchmark_download(workdir = None, conditions = None, days = 3, file_size = 1000000,
+                       baseline = None, tolerance = 0.8, save_as = None):
+    """
+    Measures the throughput of the download module against local stand-in servers.
+
+    fetch_MODIS (over http like e4ftl01 and over ftp like NSIDC), fetch_TRMM (over ftp
+    like PPS) and download_urls each download a synthetic data set under every set of
+    network conditions, and the files per second and MB per second of each run is
+    recorded. Comparing against a baseline from an earlier run guards against
+    changes which slow downloads down.
+
+    :param workdir:     directory for the synthetic server tree and the downloads. a
+                        temporary directory is used and removed afterwards if None.
+    :param conditions:  dict of {name: {"latency", "bandwidth", "failure_rate"}} as
+                        passed to test.standin_servers. defaults to lan, wan and unreliable.
+    :param days:        number of days of synthetic data on the servers
+    :param file_size:   size in bytes of each synthetic file
+    :param baseline:    results (or a json file of results) from an earlier run. an
+                        AssertionError is raised if any benchmark is now slower than
+                        tolerance times its baseline files per second.
+    :param tolerance:   fraction of the baseline throughput which is still acceptable
+    :param save_as:     json filepath to save these results to, for use as a later baseline
+
+    :return results:    dict of {condition: {benchmark: {"files", "bytes", "seconds",
+                        "files_per_s", "mb_per_s", "failures"}}}
+    """
+
+    from dnppy import download
+
+    if conditions is None:
+        conditions = default_conditions
+
+    cleanup = workdir is None
+    if cleanup:
+        workdir = tempfile.mkdtemp(prefix = "dnppy_benchmark_")
+
+    start  = datetime(2015, 1, 1)
+    end    = datetime(2015, 1, days)
+    tiles  = ["h11v05", "h12v05"]
+    layout = build_standin_tree(os.path.join(workdir, "servers"), start, end, tiles, file_size)
+
+    # listings of the stand-ins must never leak into the real listing cache
+    cache_dir = download.list_cache.shared.cache_dir
+    download.list_cache.shared.cache_dir = os.path.join(workdir, "list_cache")
+
+    def modis_http(outdir):
+        return download.fetch_MODIS("MOD11A1", "005", tiles, outdir, start, end, refresh = True)
+
+    def modis_ftp(outdir):
+        return download.fetch_MODIS("MOD10A1", "005", tiles, outdir, start, end, refresh = True)
+
+    def trmm(outdir):
+        return download.fetch_TRMM(start, end, outdir, "3B42")
+
+    def urls(outdir):
+        url_list = []
+        for folder, _, names in os.walk(layout["http"]):
+            relpath = os.path.relpath(folder, layout["http"]).replace(os.sep, "/")
+            url_list += ["http://e4ftl01.cr.usgs.gov/{0}/{1}".format(relpath, name) for name in names]
+        return download.download_urls(url_list, outdir)
+
+    benchmarks = [("fetch_MODIS_http", modis_http),
+                  ("fetch_MODIS_ftp",  modis_ftp),
+                  ("fetch_TRMM",       trmm),
+                  ("download_urls",    urls)]
+
+    results = {}
+    try:
+        for condition, settings in sorted(conditions.items()):
+            results[condition] = {}
+
+            for name, function in benchmarks:
+                outdir = os.path.join(workdir, "out", condition, name)
+
+                # every run starts cold, without cached listings, reused sessions or learned limits
+                download.list_cache.shared.clear()
+                download.ftp_pool.shared.close_all()
+                download.rate_limiter.shared.reset()
+
+                with standin_servers(layout, seed = 0, **settings) as servers:
+                    t = time.time()
+                    function(outdir)
+                    seconds = time.time() - t
+
+                download.ftp_pool.shared.close_all()
+
+                names  = os.listdir(outdir) if os.path.isdir(outdir) else []
+                files  = [os.path.join(outdir, f) for f in names if f != download.manifest.filename]
+                nbytes = sum(os.path.getsize(f) for f in files)
+
+                results[condition][name] = {"files":       len(files),
+                                            "bytes":       nbytes,
+                                            "seconds":     seconds,
+                                            "files_per_s": len(files) / seconds,
+                                            "mb_per_s":    nbytes / 1e6 / seconds,
+                                            "failures":    servers.failures}
+
+                print("{0:<12} {1:<18} {2:>5} files {3:>8.2f} files/s {4:>8.2f} MB/s".format(
+                    condition, name, len(files), len(files) / seconds, nbytes / 1e6 / seconds))
+    finally:
+        download.list_cache.shared.cache_dir = cache_dir
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    if save_as:
+        with open(save_as, 'w') as f:
+            json.dump(results, f, indent = 4, sort_keys = True)
+
+    if baseline:
+        _compare(results, baseline, tolerance)
+
+    return results
+
+
+def _compare(results, baseline, tolerance):
+    """ raises an AssertionError listing every benchmark slower than its baseline """
+
+    if isinstance(baseline, basestring):
+        with open(baseline, 'r') as f:
+            baseline = json.load(f)
+
+    slower = []
+    for condition in results:
+        for name, result in results[condition].items():
+            try:
+                before = baseline[condition][name]["files_per_s"]
+            except KeyError:
+                continue
+
+            if result["files_per_s"] < tolerance * before:
+                slower.append("{0} {1}: {2:.2f} files/s, baseline {3:.2f}".format(
+                    condition, name, result["files_per_s"], before))
+
+    if slower:
+        raise AssertionError("download throughput regressed!\n" + "\n".join(slower))
+    return
+
+
+if __name__ == "__main__":
+    benchmark_download(save_as = "download_benchmark.json")
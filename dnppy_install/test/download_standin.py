@@ -0,0 +1,339 @@
+__author__ = 'jwely'
+
+"""
+Local stand-ins for the remote servers used by the dnppy download module, so that
+the download functions can be tested and benchmarked without an internet connection.
+
+A synthetic directory tree laid out like the real servers is served over http in the
+style of e4ftl01.cr.usgs.gov, and over ftp in the style of n5eil01u.ecs.nsidc.org and
+pps.gsfc.nasa.gov. While the stand-ins are running, connections to those host names
+are redirected to them, so the fetch functions run completely unmodified.
+
+The ftp stand-in requires pyftpdlib (pip install pyftpdlib).
+"""
+
+from datetime import timedelta
+import SimpleHTTPServer
+import BaseHTTPServer
+import SocketServer
+import threading
+import logging
+import random
+import socket
+import shutil
+import time
+import gzip
+import cgi
+import os
+
+__all__ = ["standin_servers",
+           "build_standin_tree"]
+
+
+# real host names and which stand-in serves them
+_http_hosts = ["e4ftl01.cr.usgs.gov"]
+_ftp_hosts  = ["n5eil01u.ecs.nsidc.org", "pps.gsfc.nasa.gov"]
+
+# login used by fetch_TRMM on the PPS server
+_pps_user   = "develop.programming14@gmail.com"
+
+
+def build_standin_tree(root, start_dto, end_dto, tiles = None, file_size = 1000000):
+    """
+    builds a synthetic copy of the remote folder layouts used by fetch_MODIS and
+    fetch_TRMM, with one file per tile per day (and per 3 hours for TRMM).
+
+    :param root:        directory to build the tree in. it is emptied first.
+    :param start_dto:   datetime object, first day of data
+    :param end_dto:     datetime object, last day of data
+    :param tiles:       list of MODIS tiles, defaults to ["h11v05", "h12v05"]
+    :param file_size:   size in bytes of each synthetic file
+
+    :return layout:     dict with "http" and "ftp" roots and the number of files and
+                        bytes of each product, keyed by product.
+    """
+
+    if tiles is None:
+        tiles = ["h11v05", "h12v05"]
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+
+    http_root = os.path.join(root, "http")
+    ftp_root  = os.path.join(root, "ftp")
+    counts    = {}
+
+    # random bytes, so gzipped files are as large as they claim to be
+    payload = os.urandom(file_size)
+
+    def write(path, product, gz = False):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        if gz:
+            with gzip.open(path, 'wb') as f:
+                f.write(payload)
+        else:
+            with open(path, 'wb') as f:
+                f.write(payload)
+
+        n, size = counts.get(product, (0, 0))
+        counts[product] = (n + 1, size + os.path.getsize(path))
+
+    day = start_dto
+    while day <= end_dto:
+        stamp = day.strftime("%Y%j")
+
+        # e4ftl01 layout      MOLT/MOD11A1.005/2015.01.01/MOD11A1.A2015001.h11v05.005.hdf
+        # NSIDC layout        MOST/MOD10A1.005/2015.01.01/MOD10A1.A2015001.h11v05.005.hdf
+        for tile in tiles:
+            name = "MOD11A1.A{0}.{1}.005.{0}000000.hdf".format(stamp, tile)
+            write(os.path.join(http_root, "MOLT", "MOD11A1.005", day.strftime("%Y.%m.%d"), name), "MOD11A1")
+
+            name = "MOD10A1.A{0}.{1}.005.{0}000000.hdf".format(stamp, tile)
+            write(os.path.join(ftp_root, "MOST", "MOD10A1.005", day.strftime("%Y.%m.%d"), name), "MOD10A1")
+
+        # PPS layout          trmmdata/ByDate/V07/2015/01/01/3B42.20150101.00.7.HDF.gz
+        for hour in range(0, 24, 3):
+            name = "3B42.{0}.{1:02d}.7.HDF.gz".format(day.strftime("%Y%m%d"), hour)
+            write(os.path.join(ftp_root, "trmmdata", "ByDate", "V07", day.strftime("%Y/%m/%d"), name),
+                  "3B42", gz = True)
+
+        day += timedelta(days = 1)
+
+    layout = {"http": http_root, "ftp": ftp_root}
+    layout.update(counts)
+    return layout
+
+
+class standin_servers(object):
+    """
+    Runs the http and ftp stand-in servers on local ports and redirects the real
+    server host names to them until stopped. Use as a context manager:
+
+        layout = build_standin_tree(root, start, end)
+        with standin_servers(layout, latency = 0.05, bandwidth = 5e6, failure_rate = 0.05):
+            download.fetch_MODIS("MOD11A1", "005", ["h11v05"], outdir, start, end)
+
+    Network conditions are injected on both servers:
+        latency         seconds of delay added before every response
+        bandwidth       bytes per second each single transfer is limited to, None for no limit
+        failure_rate    fraction of file requests rejected. http answers "503 Service
+                        Unavailable" with a "Retry-After" header, ftp answers "421".
+        retry_after     seconds sent in the http Retry-After header
+        seed            seed for the random failures, so runs can be repeated
+    """
+
+    def __init__(self, layout, latency = 0.0, bandwidth = None, failure_rate = 0.0,
+                 retry_after = 1, seed = None):
+
+        self.layout         = layout
+        self.latency        = latency
+        self.bandwidth      = bandwidth
+        self.failure_rate   = failure_rate
+        self.retry_after    = retry_after
+        self.random         = random.Random(seed)
+        self.requests       = 0
+        self.failures       = 0
+        self.http_port      = None
+        self.ftp_port       = None
+
+        self._lock          = threading.Lock()
+        self._http          = None
+        self._ftp           = None
+        self._threads       = []
+        self._connect       = None
+        self._cwd           = None
+
+
+    def _should_fail(self):
+        """ counts a file request and decides whether to reject it """
+
+        with self._lock:
+            self.requests += 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failures += 1
+                return True
+        return False
+
+
+    def start(self):
+        """ starts both servers and redirects the real host names to them """
+
+        # pyftpdlib changes the working directory of the whole process while it checks paths
+        self._cwd = os.getcwd()
+
+        self._http     = _http_standin(self)
+        self.http_port = self._http.server_address[1]
+
+        self._ftp      = _ftp_standin(self)
+        self.ftp_port  = self._ftp.address[1]
+
+        for target in [self._http.serve_forever, lambda: self._ftp.serve_forever(handle_exit = False)]:
+            thread = threading.Thread(target = target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        self._redirect()
+        return self
+
+
+    def stop(self):
+        """ stops both servers and removes the host name redirection """
+
+        if self._connect is not None:
+            socket.create_connection = self._connect
+            self._connect = None
+
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+        if self._ftp is not None:
+            self._ftp.close_all()
+        if self._cwd is not None:
+            os.chdir(self._cwd)
+        return
+
+
+    def _redirect(self):
+        """
+        httplib and ftplib both open their connections with socket.create_connection,
+        so swapping it out points every download function at the stand-ins.
+        """
+
+        ports = dict([(host, self.http_port) for host in _http_hosts] +
+                     [(host, self.ftp_port)  for host in _ftp_hosts])
+        connect = self._connect = socket.create_connection
+
+        def create_connection(address, *args, **kwargs):
+            host, port = address
+            if host in ports:
+                address = ("127.0.0.1", ports[host])
+            return connect(address, *args, **kwargs)
+
+        socket.create_connection = create_connection
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def _http_standin(standin):
+    """ threaded http server with apache style directory listings, like e4ftl01 """
+
+    class handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def translate_path(self, path):
+            path = path.split("?")[0].split("#")[0]
+            parts = [p for p in path.split("/") if p and p not in (".", "..")]
+            return os.path.join(standin.layout["http"], *parts)
+
+        def do_GET(self):
+            time.sleep(standin.latency)
+
+            is_file = os.path.isfile(self.translate_path(self.path))
+            if is_file and standin._should_fail():
+                self.send_response(503)
+                self.send_header("Retry-After", str(standin.retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+        def list_directory(self, path):
+            # list_http_e4ftl01 reads the 6th quoted string of each line as the name,
+            # and the modification time and size after the link as its stamp
+            lines = ['<html><head><title>Index of {0}</title></head><body><pre>'.format(cgi.escape(self.path))]
+            for name in sorted(os.listdir(path)):
+                stat     = os.stat(os.path.join(path, name))
+                modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime))
+                if os.path.isdir(os.path.join(path, name)):
+                    icon, alt, name, size = "/icons/folder.gif", "[DIR]", name + "/", "-"
+                else:
+                    icon, alt, size = "/icons/unknown.gif", "   ", "{0:.1f}K".format(stat.st_size / 1024.0)
+                lines.append('<img src="{0}" alt="{1}"> <a href="{2}">{2}</a>  {3}  {4}'.format(
+                             icon, alt, name, modified, size))
+            lines.append('</pre></body></html>')
+
+            body = "\n".join(lines) + "\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return None
+
+        def copyfile(self, source, outputfile):
+            _throttled_copy(source, outputfile, standin.bandwidth)
+
+    class server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads      = True
+        allow_reuse_address = True
+
+    return server(("127.0.0.1", 0), handler)
+
+
+def _throttled_copy(source, outputfile, bandwidth, chunk_size = 64 * 1024):
+    """ copies a file object to another no faster than bandwidth bytes per second """
+
+    start = time.time()
+    sent  = 0
+    while True:
+        block = source.read(chunk_size)
+        if not block:
+            return
+        outputfile.write(block)
+        sent += len(block)
+
+        if bandwidth:
+            ahead = sent / float(bandwidth) - (time.time() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def _ftp_standin(standin):
+    """ threaded pyftpdlib server, with anonymous access (NSIDC) and the PPS login """
+
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        raise ImportError("the ftp stand-in server requires pyftpdlib, try 'pip install pyftpdlib'")
+
+    root = standin.layout["ftp"]
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    authorizer.add_user(_pps_user, _pps_user, root, perm = "elr")
+
+    class dtp_handler(ThrottledDTPHandler):
+        read_limit  = 0
+        write_limit = int(standin.bandwidth or 0)
+
+    class handler(FTPHandler):
+
+        def pre_process_command(self, line, cmd, arg):
+            time.sleep(standin.latency)
+
+            if cmd == "RETR" and standin._should_fail():
+                self.respond("421 Too many connections, try again later.")
+                return
+
+            FTPHandler.pre_process_command(self, line, cmd, arg)
+
+    handler.authorizer  = authorizer
+    handler.dtp_handler = dtp_handler
+    handler.banner      = "dnppy stand-in ftp server"
+
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+
+    return ThreadedFTPServer(("127.0.0.1", 0), handler)
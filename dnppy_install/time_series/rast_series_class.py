@@ -75,7 +75,44 @@ class rast_series_class(time_series_class):
 
         print("Imported and interpreted {0} raster filepath datetimes!".format(len(self.row_data)))
         return
-    
+
+
+    def from_catalog(self, catalog, **query):
+        """
+        loads up the results of a core.catalog query as a time series.
+        keyword arguments are passed to catalog.query, for example
+
+            cat = core.catalog(r"E:\MODIS\holdings.db")
+            rs  = rast_series_class()
+            rs.from_catalog(cat, product = "MOD11A1", tile = "h11v05",
+                            start = datetime(2013,1,1), end = datetime(2013,12,31),
+                            suffix = "_day")
+
+        dates come straight from the catalog, so no fmt or fmt_unmask is needed.
+        """
+
+        self.headers = ['filepaths','filenames','fmt_names']
+        self.row_data = []
+
+        for filepath, dto in catalog.query_dates(**query):
+            head, filename = os.path.split(filepath)
+            self.row_data.append([filepath, filename, dto.strftime("%Y%j")])
+
+        self.build_col_data()
+        self.define_time('fmt_names', "%Y%j")
+
+        print("Imported {0} raster filepath datetimes from catalog!".format(len(self.row_data)))
+        return
+
+
+    def to_cube_store(self, cubedir, chunks = (32, 256, 256), threads = 4):
+        """
+        Saves this rast_series as a chunked, compressed dnppy.raster.cube_store, so
+        that time and space windows of the series can be read without opening every
+        raster. arguments are the same as dnppy.raster.to_cube_store()
+        """
+        return raster.to_cube_store(self, cubedir, chunks, threads = threads)
+
 
     def null_set_range(self, high_thresh = None, low_thresh = None, NoData_Value = None):
         """